@@ -0,0 +1,575 @@
+'''
+Compiled assembly of the steady-state flow equations.
+
+Elements are grouped by type into struct-of-arrays parameter tables and
+port-index arrays once. Each residual evaluation is then one vectorized
+pass per element type instead of a Python loop over elements. Element
+types plug in through static methods on their class:
+
+    pack(elements)                    -> dict of parameter arrays
+    loss(p, mdot, rho, mu)            -> two-port damping load [Pa]
+    steady_residuals(p, P, mdot, rho, mu)
+                                      -> residuals of a general element
+
+    loss_jacobian(p, mdot, rho, mu)   -> flow derivative of loss()
+    steady_jacobian(p, P, mdot, rho, mu)
+                                      -> partials of steady_residuals()
+
+Two-port types only need pack(), loss() and loss_jacobian(). Types
+without them fall back to their per-element steady_flow_eqns() with
+finite-difference partials. Two-port types may also provide
+
+    inertance(p, rho)                 -> [1/m] momentum storage per unit mass flow
+    compliance(p, rho)                -> [kg/Pa] mass storage
+
+for the linearized dynamics matrices.
+
+The Jacobian is assembled in CSR form. Its sparsity pattern depends only
+on the network topology, so it is built once and each evaluation only
+refills the data array.
+
+Author(s):
+    Samuel Ciesielski
+
+'''
+
+import copy
+import numpy as np
+from scipy.sparse import csr_matrix, coo_matrix
+
+
+
+### ------------------- ###
+### Element Type Groups ###
+### ------------------- ###
+
+class Group:
+
+    ### Constructor
+    ### -----------
+    def __init__(self, cls, elements, rho, mu):
+        '''
+        Inputs:
+            cls      = (class) element type shared by all elements
+            elements = (list) elements of this type
+            rho, mu  = (vector) [kg/m^3], [Pa*s] fluid properties per element
+        '''
+        self.cls = cls
+        self.elements = list(elements)
+        self.ids = np.array([el.id for el in elements], dtype=np.int64)
+        self.ports = np.array([el.ports for el in elements], dtype=np.int64) \
+                       .reshape(len(elements), -1)
+        self.params = cls.pack(self.elements) if hasattr(cls, "pack") else {}
+        self.rho = np.asarray(rho, dtype=float)
+        self.mu = np.asarray(mu, dtype=float)
+
+        ### One equation per port
+        self.n = len(self.elements)
+        self.n_eq = self.ports.shape[1]
+        self.offset = 0
+
+    ### Equation rows owned by this group
+    @property
+    def rows(self):
+        return slice(self.offset, self.offset + self.n_eq*self.n)
+
+    ### Row of each [equation, element] pair
+    @property
+    def eq_rows(self):
+        return self.offset + np.arange(self.n_eq*self.n).reshape(self.n_eq, self.n)
+
+    ### Re-pack a single element in place
+    ### ---------------------------------
+    def update(self, k, rho, mu):
+        '''
+        Outputs:
+            (list) (key, old, new) for each parameter whose value changed
+        '''
+        changes = []
+        if hasattr(self.cls, "pack"):
+            for key, value in self.cls.pack([self.elements[k]]).items():
+                if self.params[key][k] != value[0]:
+                    changes.append((key, self.params[key][k], value[0]))
+                self.params[key][k] = value[0]
+        self.ports[k] = self.elements[k].ports
+        self.rho[k], self.mu[k] = rho, mu
+        return changes
+
+    ### Constant resistance of two-port loss elements
+    ### ---------------------------------------------
+    def resistance(self, dP=None, mdot=None):
+        '''
+        Secant dP/mdot of loss() through the flow rate mdot, or through the
+        flow rate at which the element alone would drop dP.
+        
+        Inputs:
+            dP   = (scalar) [Pa] pressure drop scale
+            mdot = (scalar) [kg/s] flow rate scale, used instead of dP
+            
+        Outputs:
+            (vector) [Pa*s/kg] resistance per element
+        '''
+        loss = lambda m: self.cls.loss(self.params, m, self.rho, self.mu)
+        if mdot is not None:
+            m = np.full(self.n, float(mdot))
+        else:
+            # fixed point m <- m*sqrt(dP/loss(m)), exact for quadratic losses
+            m = np.ones(self.n)
+            for _ in range(30):
+                m = np.clip(m*np.sqrt(dP/np.maximum(loss(m), 1e-300)), 1e-12, 1e12)
+        return loss(m)/m
+
+    ### Residuals for all elements in group
+    ### -----------------------------------
+    def residuals(self, P, mdot):
+        '''
+        Inputs:
+            P, mdot = (array) [..., element, port] port pressures and flows
+
+        Outputs:
+            (array) [..., equation, element] residuals
+        '''
+        ### General elements
+        if hasattr(self.cls, "steady_residuals"):
+            return self.cls.steady_residuals(self.params, P, mdot, self.rho, self.mu)
+
+        ### Two-port elements
+        if hasattr(self.cls, "loss"):
+            return np.stack([
+                # Steady-state momentum equation
+                P[..., 0] - P[..., 1] - self.cls.loss(self.params, mdot[..., 0], \
+                                                      self.rho, self.mu),
+                # Mass continuity equation
+                mdot[..., 0] - mdot[..., 1]
+            ], axis=-2)
+
+        ### Fallback to per-element equations
+        return self.scalar_residuals(P, mdot)
+
+    ### Partial derivatives for all elements in group
+    ### ----------------------------------------------
+    def jacobian(self, P, mdot):
+        '''
+        Outputs:
+            (array) [..., equation, variable, element] partials with respect
+                    to the element's port pressures then port flow rates
+        '''
+        ### General elements
+        if hasattr(self.cls, "steady_jacobian"):
+            return self.cls.steady_jacobian(self.params, P, mdot, self.rho, self.mu)
+
+        ### Two-port elements
+        if hasattr(self.cls, "loss_jacobian"):
+            J = np.zeros(P.shape[:-2] + (2, 4, self.n))
+            J[..., 0, 0, :] = 1
+            J[..., 0, 1, :] = -1
+            J[..., 0, 2, :] = -self.cls.loss_jacobian(self.params, mdot[..., 0], \
+                                                      self.rho, self.mu)
+            J[..., 1, 2, :] = 1
+            J[..., 1, 3, :] = -1
+            return J
+
+        ### Fallback to finite differences of per-element equations
+        X = np.concatenate([P, mdot], axis=-1)
+        R = self.scalar_residuals(P, mdot)
+        J = np.empty(R.shape[:-1] + (X.shape[-1],) + R.shape[-1:])
+        for v in range(X.shape[-1]):
+            h = 1e-7*np.maximum(np.abs(X[..., v]), 1)
+            Xh = X.copy()
+            Xh[..., v] += h
+            Rh = self.scalar_residuals(Xh[..., :self.n_eq], Xh[..., self.n_eq:])
+            J[..., v, :] = (Rh - R) / h[..., None, :]
+        return J
+
+    def scalar_residuals(self, P, mdot):
+        R = np.empty(P.shape[:-2] + (self.n_eq, self.n))
+        for idx in np.ndindex(P.shape[:-2]):
+            for k, el in enumerate(self.elements):
+                # local state vector holding only this element's ports
+                local = np.concatenate([P[idx + (k,)], mdot[idx + (k,)]])
+                ports, el.ports = el.ports, list(range(self.n_eq))
+                try:
+                    R[idx + (slice(None), k)] = el.steady_flow_eqns(local, 2*self.n_eq, \
+                                                                    self.rho[k], self.mu[k])
+                finally:
+                    el.ports = ports
+        return R
+
+
+
+### ------------------- ###
+### Steady-state System ###
+### ------------------- ###
+
+class Assembly:
+
+    ### Constructor
+    ### -----------
+    def __init__(self, circuit, properties):
+        '''
+        Inputs:
+            circuit    = (Network) meshed fluid circuit
+            properties = (function) element -> (rho, mu)
+        '''
+        self.circuit = circuit
+        self.properties = properties
+        self.build()
+
+    ### Group all elements by type
+    ### --------------------------
+    def build(self):
+        self.param_changes = [] # in-place parameter edits (group, key, k, old, new)
+        self.N_nodes = len(self.circuit.nodes)
+        by_type = {}
+        for element in self.circuit.elements:
+            by_type.setdefault(type(element), []).append(element)
+        self.groups = {cls: self.make_group(cls, elements) \
+                       for cls, elements in by_type.items()}
+        self.layout()
+
+    def make_group(self, cls, elements):
+        props = np.array([self.properties(el) for el in elements], dtype=float) \
+                  .reshape(len(elements), 2)
+        return Group(cls, elements, props[:, 0], props[:, 1])
+
+    ### Replace a group by its members, one row each in ID order
+    ### -------------------------------------------------------
+    def regroup(self, cls, members):
+        members = sorted(members, key=lambda el: el.id)
+        self.param_changes = [c for c in self.param_changes if c[0].cls is not cls]
+        if members:
+            self.groups[cls] = self.make_group(cls, members)
+        else:
+            self.groups.pop(cls, None)
+
+    ### Assign equation rows to groups
+    ### ------------------------------
+    def layout(self):
+        self.pattern = None
+        offset = 0
+        for group in self.groups.values():
+            group.offset = offset
+            offset += group.n_eq*group.n
+        self.N_eqns = offset
+        if not hasattr(self, "bc_nodes"):
+            self.set_BCs([], [], [], [])
+
+    ### Boundary condition rows
+    ### -----------------------
+    def set_BCs(self, P_nodes, P_values, mdot_nodes, mdot_values):
+        bc_nodes = np.concatenate([np.asarray(P_nodes, dtype=np.int64), \
+                                   self.N_nodes + np.asarray(mdot_nodes, dtype=np.int64)])
+        if not np.array_equal(bc_nodes, getattr(self, "bc_nodes", None)):
+            self.pattern = None
+        self.bc_nodes = bc_nodes
+        self.bc_values = np.concatenate([np.asarray(P_values, dtype=float), \
+                                         np.asarray(mdot_values, dtype=float)])
+
+
+    ### Where a boundary value or element parameter lives
+    ### -------------------------------------------------
+    def locate(self, target, key):
+        '''
+        Inputs:
+            target = (string) "pressure" or "flowrate" for a boundary value,
+                     or (list) elements sharing a parameter value
+            key    = (int) boundary node, or (string) packed parameter name
+
+        Outputs:
+            (list) (None, boundary row, None) or (type, parameter, element
+                   positions in the group), see assign()
+        '''
+        if isinstance(target, str):
+            bc = {int(node): b for b, node in enumerate(self.bc_nodes)}
+            node = key if target == "pressure" else self.N_nodes + key
+            if node not in bc:
+                raise Exception("No " + target + " boundary condition at node " + \
+                                str(key) + ".")
+            return [(None, bc[node], None)]
+        specs = []
+        for cls in {type(el): None for el in target}:
+            group = self.groups.get(cls)
+            if group is None or key not in group.params:
+                raise Exception(cls.__name__ + " has no parameter " + key + ".")
+            k = np.array([np.flatnonzero(group.ids == el.id)[0] for el in target \
+                          if type(el) is cls])
+            specs.append((cls, key, k))
+        return specs
+
+    def assign(self, specs, value):
+        for cls, key, k in specs:
+            if cls is None:
+                self.bc_values[key] = value
+            else:
+                self.groups[cls].params[key][k] = value
+
+
+    ### Pick up topology edits
+    ### ----------------------
+    def renumber(self, node_map, element_map):
+        ### Remap port and ID arrays in place
+        dropped = []
+        for cls, group in self.groups.items():
+            if node_map is not None:
+                group.ports = node_map[group.ports]
+            if element_map is not None:
+                group.ids = element_map[group.ids]
+                # rows of removed elements keep a stale ID another element may now hold
+                live = [el.id is not None and el.id == i for el, i in zip(group.elements, group.ids)]
+                if not all(live):
+                    dropped.append((cls, [el for el, keep in zip(group.elements, live) if keep]))
+        for cls, members in dropped:
+            self.regroup(cls, members)
+        if dropped:
+            self.layout()
+        self.pattern = None
+
+    def update(self, changed):
+        '''
+        Re-pack only what a set of changed element IDs touches. Elements
+        that stay in their group are updated in place, groups that gain or
+        lose members are rebuilt, and untouched groups are kept as-is.
+        '''
+        self.N_nodes = len(self.circuit.nodes)
+        elements = self.circuit.elements
+        changed = np.fromiter(changed, dtype=np.int64)
+        live = {i: elements[i] for i in changed \
+                if i < len(elements) and elements[i] is not None}
+
+        ### Types whose membership changes
+        rebuild = set()
+        for cls, group in self.groups.items():
+            if np.any(group.ids >= len(elements)) or len(np.unique(group.ids)) < group.n:
+                rebuild.add(cls)
+            for k in np.flatnonzero(np.isin(group.ids, changed)):
+                el = elements[group.ids[k]] if group.ids[k] < len(elements) else None
+                if type(el) is cls:
+                    group.elements[k] = el
+                    live.pop(int(group.ids[k]), None)
+                    for key, old, new in group.update(k, *self.properties(el)):
+                        self.param_changes.append((group, key, k, old, new))
+                    self.pattern = None
+                else:
+                    rebuild.add(cls)
+        rebuild |= {type(el) for el in live.values()}
+
+        ### Rebuild affected groups from their surviving and new members
+        for cls in rebuild:
+            members = {}
+            if cls in self.groups:
+                members = {el.id: el for el in self.groups[cls].elements \
+                           if el.id is not None and el.id < len(elements) \
+                           and elements[el.id] is el}
+            members.update({i: el for i, el in live.items() if type(el) is cls})
+            self.regroup(cls, members.values())
+
+        self.layout()
+
+
+    ### Copy holding only the arrays
+    ### ----------------------------
+    def copy(self, own_params=False):
+        '''
+        Detached from the circuit and its elements, e.g. to be sent to
+        worker processes or driven by a solver of its own.
+
+        Inputs:
+            own_params = (bool) give the copy its own parameter and boundary
+                         value arrays, to be edited without touching this one
+        '''
+        worker = copy.copy(self)
+        worker.circuit = worker.properties = None
+        worker.param_changes = []
+        worker.groups = {}
+        for cls, group in self.groups.items():
+            group = copy.copy(group)
+            if hasattr(cls, "loss") or hasattr(cls, "steady_residuals"):
+                group.elements = None # kernels only need the packed arrays
+            if own_params:
+                group.params = {key: value.copy() for key, value in group.params.items()}
+            worker.groups[cls] = group
+        if own_params:
+            worker.bc_values = self.bc_values.copy()
+        return worker
+
+
+    ### Residuals of steady system
+    ### --------------------------
+    def residuals(self, statevars, bc_values=None):
+        '''
+        Inputs:
+            statevars = (array) [..., N_sv] pressures then flow rates by node,
+                        with optional leading batch dimensions
+            bc_values = (array) [..., N_bc] boundary values per batch entry,
+                        defaults to the values given to set_BCs()
+
+        Outputs:
+            (array) [..., N_sv] element equations then boundary conditions
+        '''
+        if bc_values is None:
+            bc_values = self.bc_values
+        N = self.N_nodes
+        P = statevars[..., :N]
+        mdot = statevars[..., N:]
+
+        F = np.empty(statevars.shape[:-1] + (self.N_eqns + len(self.bc_nodes),))
+        for group in self.groups.values():
+            R = group.residuals(P[..., group.ports], mdot[..., group.ports])
+            F[..., group.rows] = R.reshape(R.shape[:-2] + (-1,))
+        F[..., self.N_eqns:] = statevars[..., self.bc_nodes] - bc_values
+
+        return F
+
+
+    ### Fixed sparsity pattern of the Jacobian
+    ### --------------------------------------
+    def build_pattern(self):
+        N = self.N_nodes
+        rows, cols = [], []
+
+        ### Element equations: every equation against every local variable
+        for group in self.groups.values():
+            n_ports = group.ports.shape[1]
+            local = np.concatenate([group.ports, N + group.ports], axis=1).T # [variable, element]
+            rows.append(np.broadcast_to(group.eq_rows[:, None, :], \
+                                        (group.n_eq, 2*n_ports, group.n)).ravel())
+            cols.append(np.broadcast_to(local[None, :, :], \
+                                        (group.n_eq, 2*n_ports, group.n)).ravel())
+
+        ### Boundary conditions
+        rows.append(self.N_eqns + np.arange(len(self.bc_nodes)))
+        cols.append(self.bc_nodes)
+
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        N_rows = self.N_eqns + len(self.bc_nodes)
+
+        ### CSR ordering of the entries, reused by every evaluation
+        self.pattern = np.lexsort((cols, rows))
+        self.indices = cols[self.pattern]
+        self.indptr = np.zeros(N_rows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=N_rows), out=self.indptr[1:])
+        self.shape = (N_rows, 2*N)
+
+
+    ### Linearized network
+    ### ------------------
+    def linear_system(self, statevars, dP=None, mdot=None):
+        '''
+        Linear approximation of the steady system, J x = b. Two-port loss
+        elements become constant resistances (see Group.resistance) and all
+        other elements are linearized about statevars. Boundary rows of b
+        hold the values given to set_BCs().
+        
+        Inputs:
+            statevars = (vector) [N_sv] reference state
+            dP, mdot  = (scalar) pressure drop or flow rate scale of the
+                        resistances
+                        
+        Outputs:
+            (csr_matrix) J, (vector) b
+        '''
+        J = self.jacobian(statevars)
+        b = J @ statevars - self.residuals(statevars)
+        
+        ### Overwrite loss partials with the secant resistances
+        slot = np.empty(len(self.pattern), dtype=np.int64)
+        slot[self.pattern] = np.arange(len(self.pattern))
+        start = 0
+        for group in self.groups.values():
+            if hasattr(group.cls, "loss") and not hasattr(group.cls, "steady_residuals"):
+                # entry [equation 0, variable 2 (mdot at port 0), element]
+                J.data[slot[start + 2*group.n + np.arange(group.n)]] = \
+                    -group.resistance(dP, mdot)
+                b[group.eq_rows[0]] = 0
+            start += group.n_eq*2*group.ports.shape[1]*group.n
+        
+        return J, b
+
+
+    ### Analytic sparse Jacobian of steady system
+    ### -----------------------------------------
+    def jacobian(self, statevars):
+        '''
+        Inputs:
+            statevars = (array) [N_sv] or [batch, N_sv] pressures then flow
+                        rates by node
+
+        Outputs:
+            (csr_matrix) [N_sv, N_sv] partials of residuals(), or the
+                         block-diagonal [batch*N_sv, batch*N_sv] Jacobian of
+                         all batch entries stacked
+        '''
+        if self.pattern is None:
+            self.build_pattern()
+
+        N = self.N_nodes
+        X = np.atleast_2d(statevars)
+        B = X.shape[0]
+        P = X[:, :N]
+        mdot = X[:, N:]
+
+        values = [group.jacobian(P[:, group.ports], mdot[:, group.ports]).reshape(B, -1) \
+                  for group in self.groups.values()]
+        values.append(np.ones((B, len(self.bc_nodes))))
+        data = np.concatenate(values, axis=1)[:, self.pattern]
+
+        if statevars.ndim == 1:
+            return csr_matrix((data[0], self.indices, self.indptr), shape=self.shape)
+
+        ### Tile pattern into diagonal blocks
+        N_rows, N_cols = self.shape
+        nnz = len(self.indices)
+        indices = (self.indices[None, :] + N_cols*np.arange(B)[:, None]).ravel()
+        indptr = np.concatenate([(self.indptr[:-1][None, :] + \
+                                  nnz*np.arange(B)[:, None]).ravel(), [B*nnz]])
+        return csr_matrix((data.ravel(), indices, indptr), shape=(B*N_rows, B*N_cols))
+
+
+    ### Linearized dynamics matrices
+    ### ----------------------------
+    def dynamics(self, statevars):
+        '''
+        Linearizes the circuit about statevars as
+
+            M x'' + C x' + K x = 0
+
+        in the time integrals x of the pressure and flow rate perturbations
+        (so x' = [dP, dmdot]). Rows are the residual rows. M holds the
+        inertance of each momentum equation and the compliance of each
+        continuity equation. Compliance is lumped at the outlet port,
+        behind the inertance (which acts on the inlet flow), so each
+        element is a reciprocal L-section; splitting it over both ports
+        makes long chains of them spuriously unstable. C is
+        the negated steady Jacobian (unit pressure couplings, damping
+        dloss/dmdot and boundary conditions) and K is empty for a purely
+        hydraulic circuit.
+
+        Inputs:
+            statevars = (vector) [N_sv] steady pressures then flow rates
+
+        Outputs:
+            (csr_matrix) M, C, K
+        '''
+        N = self.N_nodes
+        rows, cols, values = [], [], []
+
+        ### Storage terms by element type
+        for group in self.groups.values():
+            if hasattr(group.cls, "inertance"):
+                rows.append(group.eq_rows[0])
+                cols.append(N + group.ports[:, 0])
+                values.append(group.cls.inertance(group.params, group.rho))
+            if hasattr(group.cls, "compliance"):
+                rows.append(group.eq_rows[1])
+                cols.append(group.ports[:, 1])
+                values.append(group.cls.compliance(group.params, group.rho))
+
+        C = -self.jacobian(statevars)
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+        cols = np.concatenate(cols) if cols else np.zeros(0, dtype=np.int64)
+        values = np.concatenate(values) if values else np.zeros(0)
+        M = coo_matrix((values, (rows, cols)), shape=C.shape).tocsr()
+        M.eliminate_zeros()
+        K = csr_matrix(C.shape)
+
+        return M, C, K
@@ -2,6 +2,15 @@
 Functions and class for pulling temperature-dependent 
 heat transport properties of common propellants.
 
+Each fluid is tabulated in fluid_data/ as
+
+    <name>_data.csv  T, rho, cp, k, mu against temperature alone
+    <name>_TP.csv    T, P and any of rho, cp, k, mu on a full (T, P) grid,
+                     one grid point per row in any order, e.g. for
+                     cryogenic propellants
+
+and interpolated by cubic splines (bicubic over the grid).
+
 Author:
     Samuel Ciesielski
 
@@ -16,18 +25,34 @@ Sources:
 '''
 
 import os
+import hashlib
+import threading
 import numpy as np
-import pandas as pd
-from scipy.interpolate import interp1d
-import matplotlib.pyplot as plt
-
+from scipy.interpolate import CubicSpline
 
 
-# Available fluid models
-fluids = ["JetA"]
 
-# STP Temperature
+# STP Temperature and Pressure
 T_STP = 273.15 # [K]
+P_STP = 101325. # [Pa]
+
+# Tabulated properties, in table column order
+PROPERTIES = ("rho", "cp", "k", "mu")
+
+# Table files by kind
+TABLE_KINDS = ("data", "TP")
+
+# Available fluid models, one per table in fluid_data/
+def available_fluids():
+    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fluid_data')
+    names = set()
+    for file in os.listdir(data_dir):
+        for kind in TABLE_KINDS:
+            if file.endswith("_" + kind + ".csv"):
+                names.add(file[:-len("_" + kind + ".csv")])
+    return sorted(names)
+
+fluids = available_fluids()
 
 
 
@@ -42,77 +67,381 @@ class Fluid:
     ### Assign specific fluid
     ### ---------------------
     def assign(self, fluid):
-        self.T_data, \
-        self.rho_data, \
-        self.cp_data, \
-        self.k_data, \
-        self.mu_data = import_data(fluid)
+        # Data and interpolation coefficients are loaded once per process
+        # and shared by every Fluid of the same name
+        data = load(fluid)
+        if data.columns is not None:
+            self.T_data, \
+            self.rho_data, \
+            self.cp_data, \
+            self.k_data, \
+            self.mu_data = data.columns
         
+        self.data = data
+        self.table = data.table
         self.fluid = fluid
         
         
-    ### Pull specific property at specific temperature
-    ### ----------------------------------------------
-    def rho(self, T=T_STP):
-        return interp1d(self.T_data, self.rho_data, kind='cubic')(T)
+    ### Pull several properties at once
+    ### -------------------------------
+    def properties(self, T=T_STP, names=PROPERTIES, P=P_STP):
+        '''
+        Inputs:
+            T     = (scalar or array) [K] temperatures
+            names = (list) properties among "rho", "cp", "k", "mu"
+            P     = (scalar or array) [Pa] pressures, broadcast against T;
+                    used by fluids with (T, P) tables only
+            
+        Outputs:
+            (array) [name, *shape] properties in SI units
+        '''
+        return self.data.properties(T, names, P)
+        
+        
+    ### Pull specific property at specific temperature (and pressure)
+    ### -------------------------------------------------------------
+    def rho(self, T=T_STP, P=P_STP):
+        return self.data.properties(T, ("rho",), P)[0]
     
-    def cp(self, T=T_STP):
-        return interp1d(self.T_data, self.cp_data, kind='cubic')(T)
+    def cp(self, T=T_STP, P=P_STP):
+        return self.data.properties(T, ("cp",), P)[0]
     
-    def k(self, T=T_STP):
-        return interp1d(self.T_data, self.k_data, kind='cubic')(T)
+    def k(self, T=T_STP, P=P_STP):
+        return self.data.properties(T, ("k",), P)[0]
         
-    def mu(self, T=T_STP):
-        return interp1d(self.T_data, self.mu_data, kind='cubic')(T)
+    def mu(self, T=T_STP, P=P_STP):
+        return self.data.properties(T, ("mu",), P)[0]
+
+
 
+class SplineTable:
+    
+    ### Constructor
+    ### -----------
+    def __init__(self, x, y):
+        '''
+        Not-a-knot cubic splines through tabulated data (the interpolant of
+        interp1d(kind="cubic")), kept as per-interval polynomial coefficients.
+        The table is never modified after construction, so one instance can
+        serve any number of elements and threads.
         
+        Inputs:
+            x = (vector) [N] increasing abscissae, e.g. temperatures
+            y = (array) [N, column] tabulated values
+        '''
+        self.x = np.asarray(x, dtype=float)
+        self.c = np.ascontiguousarray(CubicSpline(self.x, y, axis=0).c) # [power, interval, column]
         
-### Import raw data for specific fluid
-### ----------------------------------
-def import_data(fluid_name):
-    # Check if fluid is valid
-    if fluid_name not in fluids:
-        raise Exception("Invalid fluid:" + fluid_name)
         
+    ### Evaluate columns over arrays of abscissae
+    ### -----------------------------------------
+    def __call__(self, x, columns=None):
+        '''
+        Inputs:
+            x       = (scalar or array) abscissae within the tabulated range
+            columns = (list) columns to evaluate, default all
+            
+        Outputs:
+            (array) [column, *x.shape] values
+        '''
+        x = np.asarray(x, dtype=float)
+        if np.any(x < self.x[0]) or np.any(x > self.x[-1]):
+            raise ValueError("Interpolation outside the tabulated range [" + \
+                             str(self.x[0]) + ", " + str(self.x[-1]) + "].")
+        c = self.c if columns is None else self.c[:, :, columns]
+        i = np.clip(np.searchsorted(self.x, x.ravel(), side="right") - 1, 0, len(self.x) - 2)
+        dx = (x.ravel() - self.x[i])[:, None]
+        
+        ### Horner's rule over [point, column]
+        c = c[:, i]
+        y = c[0]
+        for power in range(1, len(c)):
+            y = y*dx + c[power]
+        return y.T.reshape((c.shape[2],) + x.shape)
+        
+        
+        
+class GridTable:
+    
+    ### Constructor
+    ### -----------
+    def __init__(self, x, y, z, kind="cubic"):
+        '''
+        Piecewise bicubic (or bilinear) interpolant of gridded data, kept as
+        16 polynomial coefficients per cell and column. Bicubic patches are
+        Hermite patches through the values and the not-a-knot spline slopes
+        and cross derivative at the grid points, so the surface is C1 and
+        reproduces the 1-D splines along every grid line. Read-only after
+        construction.
+        
+        Inputs:
+            x, y = (vector) increasing grid coordinates, e.g. T and P
+            z    = (array) [x, y, column] tabulated values
+            kind = (string) "cubic" or "linear"
+        '''
+        self.x, self.y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        z = np.asarray(z, dtype=float)
+        N_x, N_y, N_c = z.shape
+        f00, f10, f01, f11 = z[:-1, :-1], z[1:, :-1], z[:-1, 1:], z[1:, 1:]
+        c = np.zeros((4, 4, N_x - 1, N_y - 1, N_c)) # [power of u, power of v, cell, column]
+        
+        if kind == "linear":
+            c[0, 0], c[1, 0], c[0, 1] = f00, f10 - f00, f01 - f00
+            c[1, 1] = f11 - f10 - f01 + f00
+        elif kind == "cubic":
+            ### Node slopes in cell-normalized coordinates u, v
+            dx, dy = np.diff(self.x)[:, None, None], np.diff(self.y)[None, :, None]
+            z_x = CubicSpline(self.x, z, axis=0)(self.x, 1)
+            z_y = CubicSpline(self.y, z, axis=1)(self.y, 1)
+            z_xy = CubicSpline(self.y, z_x, axis=1)(self.y, 1)
+            corner = lambda g, i, j: g[i:N_x - 1 + i, j:N_y - 1 + j]
+            F = np.empty((4, 4) + f00.shape)
+            for i in range(2):
+                for j in range(2):
+                    F[i, j] = corner(z, i, j)
+                    F[i, 2 + j] = corner(z_y, i, j)*dy
+                    F[2 + i, j] = corner(z_x, i, j)*dx
+                    F[2 + i, 2 + j] = corner(z_xy, i, j)*dx*dy
+            
+            ### Hermite basis, c = H F H^T
+            H = np.array([[1, 0, 0, 0], [0, 0, 1, 0], [-3, 3, -2, -1], [2, -2, 1, 1]], dtype=float)
+            c = np.einsum("ai,ij...,bj->ab...", H, F, H)
+        else:
+            raise Exception("Invalid interpolation kind: " + kind + ". Must be either " \
+                            "\"cubic\" or \"linear\".")
+        self.kind = kind
+        self.c = np.ascontiguousarray(c.reshape(4, 4, -1, N_c))
+        
+        
+    ### Evaluate columns over arrays of points
+    ### --------------------------------------
+    def __call__(self, x, y, columns=None, chunk=65536):
+        '''
+        Inputs:
+            x, y    = (scalar or array) broadcastable coordinates within the grid
+            columns = (list) columns to evaluate, default all
+            chunk   = (int) points evaluated together
+            
+        Outputs:
+            (array) [column, *shape] values
+        '''
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        shape = x.shape
+        x, y = x.ravel(), y.ravel()
+        for v, grid, name in ((x, self.x, "T"), (y, self.y, "P")):
+            if np.any(v < grid[0]) or np.any(v > grid[-1]):
+                raise ValueError("Interpolation outside the tabulated " + name + " range [" + \
+                                 str(grid[0]) + ", " + str(grid[-1]) + "].")
+        c = self.c if columns is None else self.c[..., columns]
+        out = np.empty((len(x), c.shape[-1]))
+        
+        for start in range(0, len(x), chunk):
+            xs, ys = x[start:start + chunk], y[start:start + chunk]
+            i = np.clip(np.searchsorted(self.x, xs, side="right") - 1, 0, len(self.x) - 2)
+            j = np.clip(np.searchsorted(self.y, ys, side="right") - 1, 0, len(self.y) - 2)
+            u = ((xs - self.x[i])/(self.x[i + 1] - self.x[i]))[:, None]
+            v = ((ys - self.y[j])/(self.y[j + 1] - self.y[j]))[:, None]
+            cell = i*(len(self.y) - 1) + j
+            
+            ### Horner's rule in v within each power of u, then in u
+            powers = 4 if self.kind == "cubic" else 2
+            z = 0
+            for a in reversed(range(powers)):
+                w = c[a, powers - 1][cell]
+                for b in reversed(range(powers - 1)):
+                    w = w*v + c[a, b][cell]
+                z = z*u + w
+            out[start:start + chunk] = z
+        return out.T.reshape((c.shape[-1],) + shape)
+        
+        
+        
+class FluidData:
+    
+    ### Constructor
+    ### -----------
+    def __init__(self, name, data=None, grid=None):
+        '''
+        Read-only property data of one fluid and its interpolants.
+        
+        Inputs:
+            name = (string) fluid name
+            data = (dictionary) T, rho, cp, k, mu vectors of a temperature
+                   table, or None
+            grid = (dictionary) T, P and property vectors of a (T, P) table,
+                   one entry per grid point, or None
+        '''
+        self.name = name
+        self.columns, self.table, self.grid = None, None, None
+        
+        ### Temperature table
+        if data is not None:
+            self.columns = tuple(np.array(data[key], dtype=float) for key in ("T",) + PROPERTIES)
+            for c in self.columns:
+                c.flags.writeable = False
+            self.table = SplineTable(self.columns[0], np.stack(self.columns[1:], axis=-1))
+            
+        ### (T, P) table, reshaped from rows onto its grid
+        if grid is not None:
+            self.grid_names = [key for key in PROPERTIES if key in grid]
+            T, P = np.unique(grid["T"]), np.unique(grid["P"])
+            if len(grid["T"]) != len(T)*len(P):
+                raise Exception("The (T, P) table of " + name + " is not a full grid: " + \
+                                str(len(grid["T"])) + " rows for " + str(len(T)) + \
+                                " temperatures x " + str(len(P)) + " pressures.")
+            order = np.lexsort((grid["P"], grid["T"]))
+            values = np.stack([np.asarray(grid[key], dtype=float)[order] \
+                               for key in self.grid_names], axis=-1)
+            self.grid = GridTable(T, P, values.reshape(len(T), len(P), -1))
+            
+            
+    ### Tabulated ranges
+    ### ----------------
+    def ranges(self):
+        '''
+        Outputs:
+            (tuple) [K] temperature range, (tuple) [Pa] pressure range, or
+            None if the properties don't depend on pressure
+        '''
+        if self.grid is not None:
+            return (self.grid.x[0], self.grid.x[-1]), (self.grid.y[0], self.grid.y[-1])
+        return (self.table.x[0], self.table.x[-1]), None
+            
+            
+    ### Interpolated properties
+    ### -----------------------
+    def properties(self, T, names, P=P_STP):
+        '''
+        The (T, P) table is used when there is one, else the temperature
+        table (and P is ignored).
+        '''
+        if self.grid is not None:
+            table, available = self.grid, self.grid_names
+        else:
+            table, available = self.table, PROPERTIES
+        missing = [name for name in names if name not in available]
+        if missing:
+            raise Exception("Fluid " + self.name + " has no data for " + ", ".join(missing) + ".")
+        columns = [available.index(name) for name in names]
+        if self.grid is not None:
+            return table(T, P, columns)
+        return table(T, columns)
+
+
+
+### Process-wide fluid registry
+### ---------------------------
+registry = {}
+registry_lock = threading.Lock()
+
+def load(fluid_name):
+    '''
+    Outputs:
+        (FluidData) shared data of the fluid, read from its CSV (or the
+        binary cache next to it) on first use in this process
+    '''
+    with registry_lock:
+        if fluid_name not in registry:
+            if fluid_name not in fluids:
+                raise Exception("Invalid fluid:" + fluid_name)
+            tables = {kind: read_data(fluid_name, kind) \
+                      if os.path.exists(data_path(fluid_name, kind=kind)) else None \
+                      for kind in TABLE_KINDS}
+            registry[fluid_name] = FluidData(fluid_name, tables["data"], tables["TP"])
+        return registry[fluid_name]
+    
+    
+### Fluid data file paths
+### ---------------------
+def data_path(fluid_name, extension=".csv", kind="data"):
     # Get fluid.py directory
     module_dir = os.path.dirname(os.path.abspath(__file__))
 
     # Build path to file containing property data
-    data_path = os.path.join(module_dir, '..', \
-                                         'src', \
-                                         'fluid_data', \
-                                         str(fluid_name)+"_data.csv")
+    return os.path.abspath(os.path.join(module_dir, 'fluid_data', \
+                                        str(fluid_name)+"_"+kind+extension))
+    
+    
+### Read data through the binary cache
+### ----------------------------------
+def read_data(fluid_name, kind="data"):
+    '''
+    The CSV is parsed only when its cache (<name>_<kind>.npz) is missing or
+    was built from a different file. A changed modification time alone
+    (e.g. after a checkout) is settled by comparing content hashes.
+    
+    Outputs:
+        (dictionary) column name -> data vector
+    '''
+    csv_path, cache_path = data_path(fluid_name, kind=kind), data_path(fluid_name, ".npz", kind)
+    stat = os.stat(csv_path)
+    digest = None
+    try:
+        with np.load(cache_path) as cache:
+            columns = {key: cache[key] for key in cache.files if key.startswith("column_")}
+            columns = {key[len("column_"):]: value for key, value in columns.items()}
+            if not columns:
+                raise KeyError("column_")
+            if int(cache["mtime_ns"]) == stat.st_mtime_ns and int(cache["size"]) == stat.st_size:
+                return columns
+            digest = file_hash(csv_path)
+            if str(cache["sha256"]) == digest:
+                write_cache(cache_path, columns, stat, digest)
+                return columns
+    except (OSError, KeyError, ValueError):
+        pass # missing or unreadable cache
+    
+    columns = parse_csv(csv_path)
+    write_cache(cache_path, columns, stat, digest or file_hash(csv_path))
+    return columns
+
+def file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
 
+def write_cache(cache_path, columns, stat, digest):
+    # Written aside and moved into place, so concurrent readers never see
+    # a partial file; a read-only data directory just goes without a cache
+    temp_path = cache_path + "." + str(os.getpid()) + ".tmp"
+    try:
+        with open(temp_path, "wb") as f:
+            np.savez(f, **{"column_" + key: value for key, value in columns.items()}, \
+                     mtime_ns=stat.st_mtime_ns, size=stat.st_size, sha256=digest)
+        os.replace(temp_path, cache_path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def parse_csv(csv_path):
+    import pandas as pd
+    
     # Pull into dataframe
-    data = pd.read_csv(os.path.abspath(data_path))
+    data = pd.read_csv(csv_path)
     
-    # Return as numpy arrays
-    T_data = np.array(data["T"])
-    rho_data = np.array(data["rho"])
-    cp_data = np.array(data["cp"])
-    k_data = np.array(data["k"])
-    mu_data = np.array(data["mu"])
-
-    return T_data, rho_data, cp_data, k_data, mu_data
+    # Return as numpy arrays, by column name
+    return {key.strip(): np.array(data[key], dtype=float) for key in data.columns}
+    
+    
+### Import raw data for specific fluid
+### ----------------------------------
+def import_data(fluid_name):
+    # Shared read-only arrays T, rho, cp, k, mu of the temperature table
+    data = load(fluid_name)
+    if data.columns is None:
+        raise Exception("Fluid " + fluid_name + " has no temperature table.")
+    return data.columns
     
     
 ### Interpolate data for specific properties
 ### ----------------------------------------
-def interp_rho(fluid, T):
-    T_data, rho_data, _, _, _ = import_data(fluid)
-    return interp1d(T_data, rho_data, kind='cubic')(T)
+def interp_rho(fluid, T, P=P_STP):
+    return load(fluid).properties(T, ("rho",), P)[0]
     
-def interp_cp(fluid, T):
-    T_data, _, cp_data, _, _ = import_data(fluid)
-    return interp1d(T_data, cp_data, kind='cubic')(T)
-
-def interp_k(fluid, T):
-    T_data, _, _, k_data, _ = import_data(fluid)
-    return interp1d(T_data, k_data, kind='cubic')(T)
-
-def interp_mu(fluid, T):
-    T_data, _, _, _, mu_data = import_data(fluid)
-    return interp1d(T_data, mu_data, kind='cubic')(T)
-
+def interp_cp(fluid, T, P=P_STP):
+    return load(fluid).properties(T, ("cp",), P)[0]
 
+def interp_k(fluid, T, P=P_STP):
+    return load(fluid).properties(T, ("k",), P)[0]
 
+def interp_mu(fluid, T, P=P_STP):
+    return load(fluid).properties(T, ("mu",), P)[0]
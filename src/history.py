@@ -0,0 +1,175 @@
+'''
+Recorded time histories of transient runs.
+
+A Recorder collects node pressures and flow rates as a transient marches,
+keeping every every-th step (or at most one per interval) of the selected
+nodes. Rows are buffered in fixed-size chunks. Held in memory, the chunks
+are stacked once the run ends; written to disk, each full chunk is
+appended to .npy files in a directory
+
+    t.npy     [time] times
+    P.npy     [time, node] pressures
+    mdot.npy  [time, node] flow rates
+    nodes.npy [node] recorded node numbers
+
+whose headers are rewritten after every chunk, so the files are valid
+(and readable) while the run is still going. A History opens such a
+directory as memory maps, reading only the time windows and nodes that
+are asked for.
+
+Author(s):
+    Samuel Ciesielski
+
+'''
+
+import os
+import numpy as np
+
+
+HEADER_SIZE = 128 # [bytes] fixed .npy header, rewritten in place as rows are added
+
+def write_header(f, shape):
+    ### .npy format 1.0 header for a C-ordered float64 array
+    header = "{'descr': '<f8', 'fortran_order': False, 'shape': " + str(tuple(shape)) + ", }"
+    header = header.ljust(HEADER_SIZE - 11) + "\n"
+    f.seek(0)
+    f.write(b"\x93NUMPY\x01\x00" + np.uint16(len(header)).tobytes() + header.encode("latin1"))
+    f.seek(0, os.SEEK_END)
+
+
+
+class Recorder:
+
+    ### Constructor
+    ### -----------
+    def __init__(self, N_nodes, nodes=None, every=1, interval=None, chunk=1024, path=None):
+        '''
+        Inputs:
+            N_nodes  = (int) nodes in the circuit
+            nodes    = (list) nodes to record, or None for all of them
+            every    = (int) keep every this many steps
+            interval = (scalar) [s] least time between kept steps, or None
+            chunk    = (int) rows buffered before they are stored
+            path     = (string) directory to stream to, or None to keep the
+                       history in memory
+        '''
+        self.nodes = np.arange(N_nodes) if nodes is None else np.asarray(nodes, dtype=np.int64)
+        self.columns = np.concatenate([self.nodes, N_nodes + self.nodes])
+        self.every, self.interval = every, interval
+        self.path = path
+        self.n_steps = 0
+        self.t_last = -np.inf
+        self.rows = 0
+
+        ### Chunk buffer, time in the first column
+        self.buffer = np.empty((chunk, 1 + len(self.columns)))
+        self.filled = 0
+        self.chunks = []
+
+        ### On-disk history, empty until the first chunk is written
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+            np.save(os.path.join(path, "nodes.npy"), self.nodes.astype(float))
+            self.files = {}
+            for name in ("t", "P", "mdot"):
+                f = open(os.path.join(path, name + ".npy"), "wb")
+                write_header(f, (0,) if name == "t" else (0, len(self.nodes)))
+                self.files[name] = f
+
+
+    ### Offer one step
+    ### --------------
+    def append(self, t, x, force=False):
+        '''
+        Inputs:
+            t     = (scalar) [s] time
+            x     = (vector) [N_sv] pressures then flow rates by node
+            force = (bool) keep this step regardless of decimation
+        '''
+        kept = self.n_steps % self.every == 0
+        if self.interval is not None:
+            kept = kept and t - self.t_last >= self.interval
+        self.n_steps += 1
+        if not (kept or force):
+            return
+        self.t_last = t
+        self.buffer[self.filled, 0] = t
+        self.buffer[self.filled, 1:] = x[self.columns]
+        self.filled += 1
+        if self.filled == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        block = self.buffer[:self.filled]
+        self.rows += self.filled
+        self.filled = 0
+        if self.path is None:
+            self.chunks.append(block.copy())
+            return
+        n = len(self.nodes)
+        for name, data in (("t", block[:, 0]), ("P", block[:, 1:1 + n]), ("mdot", block[:, 1 + n:])):
+            f = self.files[name]
+            f.write(np.ascontiguousarray(data).tobytes())
+            write_header(f, (self.rows,) if name == "t" else (self.rows, n))
+            f.flush()
+
+
+    ### Finish the history
+    ### ------------------
+    def close(self):
+        '''
+        Outputs:
+            in memory: (vector) [s] times, (array) [time, 2*node] recorded
+            pressures then flow rates; on disk: (History) of the directory
+        '''
+        self.flush()
+        if self.path is None:
+            block = np.concatenate(self.chunks) if self.chunks else self.buffer[:0]
+            return block[:, 0], block[:, 1:]
+        for f in self.files.values():
+            f.close()
+        return History(self.path)
+
+
+
+class History:
+
+    ### Constructor
+    ### -----------
+    def __init__(self, path):
+        '''
+        Inputs:
+            path = (string) directory written by a Recorder
+        '''
+        self.path = path
+        load = lambda name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+        self.t, self.P, self.mdot = load("t"), load("P"), load("mdot")
+        self.nodes = np.load(os.path.join(path, "nodes.npy")).astype(np.int64)
+        self.column = {node: k for k, node in enumerate(self.nodes)}
+
+    def __len__(self):
+        return len(self.t)
+
+
+    ### Views by time and node
+    ### ----------------------
+    def window(self, t_start=-np.inf, t_end=np.inf):
+        ### (slice) of rows with t_start <= t <= t_end
+        return slice(np.searchsorted(self.t, t_start, "left"), \
+                     np.searchsorted(self.t, t_end, "right"))
+
+    def pressure(self, node, t_start=-np.inf, t_end=np.inf):
+        '''
+        Outputs:
+            (vector) [s] times, (vector) [Pa] pressures at node
+        '''
+        rows = self.window(t_start, t_end)
+        return np.array(self.t[rows]), np.array(self.P[rows, self.column[node]])
+
+    def flowrate(self, node, t_start=-np.inf, t_end=np.inf):
+        '''
+        Outputs:
+            (vector) [s] times, (vector) [kg/s] flow rates at node
+        '''
+        rows = self.window(t_start, t_end)
+        return np.array(self.t[rows]), np.array(self.mdot[rows, self.column[node]])
@@ -0,0 +1,359 @@
+'''
+Sparse modal analysis of linearized fluid circuits.
+
+The quadratic pencil (lambda^2 M + lambda C + K) x = 0 of Model's
+dynamics matrices is linearized into the first-order companion form
+
+    A y = lambda B y,   A = [ 0   I ],   B = [ I  0 ],   y = [ x         ]
+                            [-K  -C ]        [ 0  M ]        [ lambda x  ]
+
+(or just -C y = lambda M y when K is empty), and only the few modes nearest a target frequency are extracted with
+shift-invert ARPACK: eigenvalues nu of (A - sigma B)^-1 B map back to
+lambda = sigma + 1/nu, so modes near the shift sigma = 2 pi i f become the
+largest nu. M is singular for circuits without compliance everywhere,
+which only adds infinite eigenvalues (nu = 0) that ARPACK never returns.
+Along a parameter sweep, modes are instead refined from the previous
+step's eigenpairs and paired by their modal assurance criterion (MAC).
+
+Forced responses use the dynamic stiffness K + i omega C - omega^2 M on a
+sparsity pattern shared by every frequency (Pencil), so one fill-reducing
+ordering serves a whole frequency sweep. Rows that are not polynomial in
+omega (distributed-parameter lines) can be replaced by exact entries
+evaluated per frequency.
+
+Author(s):
+    Samuel Ciesielski
+
+'''
+
+import numpy as np
+from scipy.sparse import bmat, identity, diags, csr_matrix, coo_matrix
+from scipy.sparse.linalg import splu, eigs, LinearOperator
+from scipy.optimize import linear_sum_assignment
+
+
+
+### First-order companion form of a quadratic pencil
+### -------------------------------------------------
+def companion(M, C, K):
+    '''
+    Without stiffness terms (K = 0, a purely hydraulic circuit) the pencil
+    is already first order in lambda x, A = -C and B = M. The full
+    companion form would only add n spurious zero eigenvalues.
+
+    Outputs:
+        (csc_matrix) A, B, (slice) rows of y holding lambda x
+    '''
+    n = M.shape[0]
+    if K.nnz == 0:
+        return (-C).tocsc(), M.tocsc(), slice(0, n)
+
+    I = identity(n, format="csr")
+    A = bmat([[None, I], [-K, -C]], format="csc")
+    B = bmat([[I, None], [None, M]], format="csc")
+    return A, B, slice(n, 2*n)
+
+
+### Modes nearest a shift
+### ---------------------
+def shift_invert_modes(A, B, sigma, k, v0=None, tol=0):
+    '''
+    Inputs:
+        A, B  = (sparse) companion form
+        sigma = (complex) shift [rad/s]
+        k     = (int) number of modes
+        v0    = (vector) ARPACK starting vector
+        tol   = (scalar) ARPACK relative accuracy, 0 for machine precision
+
+    Outputs:
+        (vector) [k] eigenvalues lambda, (array) [len(y), k] eigenvectors y
+    '''
+    lu, B, d_c = shifted_factor(A, B, sigma)
+    op = LinearOperator(A.shape, matvec=lambda y: lu.solve(B @ y), dtype=complex)
+    v0 = v0/d_c if v0 is not None else np.random.default_rng(0).standard_normal(A.shape[0])
+    nu, Y = eigs(op, k=min(k, A.shape[0] - 2), v0=v0, tol=tol)
+    Y = d_c[:, None]*Y
+    Y /= np.linalg.norm(Y, axis=0)
+    return sigma + 1/nu, Y
+
+
+### Modes nearest several targets
+### ------------------------------
+def nearest_modes(A, B, f_target, k, tol=0):
+    '''
+    Inputs:
+        f_target = (scalar or vector) [Hz] target frequencies
+        k        = (int) modes per target
+
+    Outputs:
+        (vector) eigenvalues, (array) eigenvectors y, see collect_modes
+    '''
+    lam, Y = [], []
+    for f in np.atleast_1d(f_target):
+        lam_f, Y_f = shift_invert_modes(A, B, 2j*np.pi*f, k, tol=tol)
+        lam.append(lam_f)
+        Y.append(Y_f)
+    return collect_modes(np.concatenate(lam), np.hstack(Y))
+
+
+### Equilibrated factorization of A - sigma B
+### ------------------------------------------
+def shifted_factor(A, B, sigma):
+    '''
+    Rows and columns are equilibrated first: pressures and flow rates
+    differ by many orders of magnitude, which wrecks the factorization
+    otherwise.
+
+    Outputs:
+        (SuperLU) factors of D_r (A - sigma B) D_c, (csr_matrix) D_r B D_c,
+        (vector) column scales D_c
+    '''
+    S = (A - sigma*B).tocsc()
+    d_r, d_c = equilibrate(S)
+    S = diags(d_r) @ S @ diags(d_c)
+    return splu(S.tocsc()), (diags(d_r) @ B @ diags(d_c)).tocsr(), d_c
+
+
+### Modes near known ones
+### ---------------------
+def refine_modes(A, B, lam0, Y0, tol=1e-8, max_iter=20):
+    '''
+    Block Krylov iteration of (A - sigma B)^-1 B started from the previous
+    eigenvectors, with one shift sigma = mean(lam0) and so one
+    factorization. After a small parameter step the old vectors nearly span
+    the new modes and a few blocks recover them by Rayleigh-Ritz, against
+    a full Arnoldi run per target without the history. Ritz pairs are
+    assigned to the previous modes by MAC.
+
+    Inputs:
+        A, B = (sparse) companion form
+        lam0 = (vector) previous eigenvalues
+        Y0   = (array) [len(y), len(lam0)] previous eigenvectors
+        tol  = (scalar) relative residual of each Ritz pair
+
+    Outputs:
+        (vector) lam, (array) Y, (int) solves, NaN for modes not converged
+    '''
+    sigma = np.mean(lam0)
+    lu, B_s, d_c = shifted_factor(A, B, sigma)
+    op = lambda V: lu.solve(np.asarray(B_s @ V))
+
+    ### Orthonormal basis V, its image TV and projection H = V^H T V,
+    ### with the previous vectors' coordinates Y0 = V C0 in that basis
+    n, k = Y0.shape
+    Vb = np.empty((n, min(n, k*(max_iter + 1))), dtype=complex, order="F")
+    TVb = np.empty_like(Vb)
+    Q, C0 = np.linalg.qr(Y0/d_c[:, None])
+    m = Q.shape[1]
+    Vb[:, :m], TVb[:, :m] = Q, op(Q)
+    V, TV = Vb[:, :m], TVb[:, :m]
+    H = inner(V, TV)
+    solves = m
+    for it in range(max_iter + 1):
+        ### Ritz pairs nearest the previous modes
+        nu, S = np.linalg.eig(H)
+        C = np.zeros((m, k), dtype=complex)
+        C[:C0.shape[0]] = C0
+        match, _ = match_modes(C, S)
+        nu, S = nu[match], S[:, match]
+        R = np.linalg.norm(TV @ S - (V @ S)*nu, axis=0)/np.linalg.norm(S, axis=0)
+        converged = R <= tol*np.abs(nu)
+        if np.all(converged) or it == max_iter:
+            break
+
+        ### Next block from the unconverged vectors
+        W = TV @ S[:, ~converged]
+        scale = np.linalg.norm(W, axis=0).max()
+        for _ in range(2):
+            W = W - V @ inner(V, W)
+        U, sv, _ = np.linalg.svd(W, full_matrices=False)
+        W = U[:, sv > 1e-10*scale][:, :Vb.shape[1] - m] # drop directions already in the basis
+        if W.shape[1] == 0:
+            break
+        TW = op(W)
+        H = np.block([[H, inner(V, TW)], [inner(W, TV), inner(W, TW)]])
+        Vb[:, m:m + W.shape[1]], TVb[:, m:m + W.shape[1]] = W, TW
+        m += W.shape[1]
+        V, TV = Vb[:, :m], TVb[:, :m]
+        solves += W.shape[1]
+
+    Y = d_c[:, None]*(V @ S)
+    Y /= np.linalg.norm(Y, axis=0)
+    lam = np.where(converged, sigma + 1/nu, np.nan)
+    return lam, Y, solves
+
+
+### V^H W, conjugating the narrower of two tall matrices
+### -----------------------------------------------------
+def inner(V, W):
+    return V.conj().T @ W if V.shape[1] <= W.shape[1] else (W.conj().T @ V).conj().T
+
+
+### Modal assurance criterion
+### -------------------------
+def mac(X, Y):
+    '''
+    Outputs:
+        (array) [X mode, Y mode] |x^H y|^2/(|x|^2 |y|^2), 1 for identical
+                shapes and 0 for orthogonal ones
+    '''
+    XY = np.abs(X.conj().T @ Y)**2
+    return XY/np.outer(np.sum(np.abs(X)**2, axis=0), np.sum(np.abs(Y)**2, axis=0))
+
+
+### Pair modes across parameter steps
+### ---------------------------------
+def match_modes(X_prev, X):
+    '''
+    Assignment of new modes to previous ones maximizing the total MAC.
+
+    Outputs:
+        (vector) [len(X_prev)] column of X matched to each previous mode,
+        (vector) their MAC values
+    '''
+    MAC = mac(X_prev, X)
+    rows, cols = linear_sum_assignment(-np.nan_to_num(MAC))
+    match = np.full(X_prev.shape[1], -1)
+    match[rows] = cols
+    values = np.zeros(X_prev.shape[1])
+    values[rows] = MAC[rows, cols]
+    return match, values
+
+
+### Row and column scaling of a sparse matrix
+### ------------------------------------------
+def equilibrate(S, iterations=10):
+    '''
+    Ruiz scaling: rows and columns are repeatedly divided by the square
+    root of their largest entry until all are close to unit size.
+
+    Outputs:
+        (vector) row scales, (vector) column scales
+    '''
+    S = abs(S).tocsr()
+    d_r, d_c = np.ones(S.shape[0]), np.ones(S.shape[1])
+    for _ in range(iterations):
+        T = diags(d_r) @ S @ diags(d_c)
+        r = np.sqrt(T.max(axis=1).toarray().ravel())
+        c = np.sqrt(T.max(axis=0).toarray().ravel())
+        d_r /= np.where(r > 0, r, 1)
+        d_c /= np.where(c > 0, c, 1)
+    return d_r, d_c
+
+
+### Sort and clean up modes
+### -----------------------
+def collect_modes(lam, X, rtol=1e-6):
+    '''
+    Keeps one mode of each conjugate pair (non-negative frequency), drops
+    repeats found from several shifts, and orders by frequency.
+
+    Inputs:
+        lam = (vector) eigenvalues
+        X   = (array) [n, len(lam)] mode shapes
+
+    Outputs:
+        (vector) lam, (array) X with each shape scaled to unit peak
+    '''
+    keep = lam.imag >= -rtol*np.abs(lam)
+    lam, X = lam[keep], X[:, keep]
+    order = np.lexsort((lam.real, lam.imag))
+    lam, X = lam[order], X[:, order]
+
+    unique = np.ones(len(lam), dtype=bool)
+    for i in range(1, len(lam)):
+        unique[i] = np.min(np.abs(lam[i] - lam[:i][unique[:i]]), initial=np.inf) > \
+                    rtol*max(abs(lam[i]), 1)
+    lam, X = lam[unique], X[:, unique]
+
+    return lam, unit_peak(X)
+
+
+def unit_peak(X):
+    peak = X[np.argmax(np.abs(X), axis=0), np.arange(X.shape[1])]
+    return X/np.where(peak == 0, 1, peak)
+
+
+
+### -------------------------- ###
+### Frequency-domain Stiffness ###
+### -------------------------- ###
+
+class Pencil:
+
+    ### Constructor
+    ### -----------
+    def __init__(self, M, C, K, exact=None):
+        '''
+        Holds M, C, K on the union of their sparsity patterns, so the
+        dynamic stiffness at any frequency is one fused data update on a
+        fixed CSR structure.
+
+        Inputs:
+            M, C, K = (sparse) [n x n] dynamics matrices
+            exact   = (tuple) (rows, cols, values) frequency-dependent
+                      entries replacing every M, C, K entry in their rows;
+                      values(omega) gives the [frequency, entry] stiffness
+        '''
+        n = M.shape[0]
+        mats = [m.tocoo() for m in (M, C, K)]
+        if exact is not None:
+            rows, cols, self.exact = exact
+            replaced = np.isin(np.arange(n), rows)
+            for i, m in enumerate(mats):
+                keep = ~replaced[m.row]
+                mats[i] = coo_matrix((m.data[keep], (m.row[keep], m.col[keep])), shape=m.shape)
+            mats.append(coo_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, n)))
+        else:
+            self.exact = None
+        rows = np.concatenate([m.row for m in mats]).astype(np.int64)
+        cols = np.concatenate([m.col for m in mats]).astype(np.int64)
+
+        ### CSR pattern of the union, and the slot of every entry in it
+        key, slot = np.unique(rows*n + cols, return_inverse=True)
+        self.indices = key % n
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(key // n, minlength=n), out=self.indptr[1:])
+        self.shape = (n, n)
+
+        ### Entries of each matrix on the union pattern
+        self.data = []
+        start = 0
+        for m in mats[:3]:
+            slots = slot[start:start + m.nnz]
+            self.data.append(np.bincount(slots, weights=m.data, minlength=len(key)))
+            start += m.nnz
+        self.exact_slots = slot[start:]
+        self.has_K = mats[2].nnz > 0
+
+    ### Dynamic stiffness on the response amplitudes
+    ### --------------------------------------------
+    def matrix(self, omega):
+        '''
+        Inputs:
+            omega = (scalar or vector) [rad/s] frequencies
+
+        Outputs:
+            (csr_matrix) K/(i omega) + C + i omega M, i.e. the stiffness
+                         K + i omega C - omega^2 M acting on the amplitudes
+                         i omega x = [dP, dmdot], or the block-diagonal
+                         stack over all frequencies in omega
+        '''
+        w = np.atleast_1d(omega).astype(float)[:, None]
+        M, C, K = self.data
+        data = C + 1j*w*M
+        if self.has_K:
+            data = data + K/(1j*w)
+        if self.exact is not None:
+            data = np.broadcast_to(data, (len(w), len(self.indices))).copy()
+            np.add.at(data, (slice(None), self.exact_slots), self.exact(w[:, 0]))
+
+        B, (n, _), nnz = len(w), self.shape, len(self.indices)
+        if np.ndim(omega) == 0:
+            return csr_matrix((data[0], self.indices, self.indptr), shape=self.shape)
+
+        ### Tile pattern into diagonal blocks
+        indices = (self.indices[None, :] + n*np.arange(B)[:, None]).ravel()
+        indptr = np.concatenate([(self.indptr[:-1][None, :] + \
+                                  nnz*np.arange(B)[:, None]).ravel(), [B*nnz]])
+        return csr_matrix((data.ravel(), indices, indptr), shape=(B*n, B*n))
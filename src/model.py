@@ -13,9 +13,18 @@ Source(s):
 
 from network import Network, Element, Node, Boundary
 from pipe import Pipe
-from 
+from fluid import Fluid
+from assembly import Assembly
+from solver import NewtonSolver
+from reduction import Reduction
+from modal import companion, nearest_modes, refine_modes, match_modes, unit_peak, Pencil
+from transient import MOC, BDF
+from replay import QuasiSteady
+from history import Recorder
+from thermal import Thermal
 import numpy as np
 from scipy.optimize import root
+from concurrent.futures import ThreadPoolExecutor
 
 
 
@@ -23,11 +32,33 @@ class Model:
     
     ### Base Constructor
     ### ----------------
-    def __init__(self, circuit):
+    def __init__(self, circuit, fluid=None):
+        '''
+        Inputs:
+            circuit = (Network) meshed fluid circuit
+            fluid   = (Fluid or string) working fluid of elements that don't
+                      carry their own (element.fluid)
+        '''
         ### Fluid system network, circuit, mesh, etc.
         if not isinstance(circuit, Network):
             raise TypeError("Model must be initalized with a network object.")
         self.circuit = circuit
+        circuit.refresh()
+        circuit.listeners.add(self)
+        
+        ### Working fluid(s)
+        if isinstance(fluid, str): fluid = Fluid(fluid)
+        self.fluid = fluid
+        
+        ### Compiled steady-state system (built on first use)
+        self.assembly = None
+        self.solvers = {} # Newton solvers by method, keep their orderings
+        self.property_cache = {}
+        self.reduction = None # series/parallel reduced circuit (built on first use)
+        
+        ### Topology edits not yet picked up by the model
+        self.stale_elements = set()
+        self.stale_nodes = set()
         
         ### Qty elements, nodes, and state variables
         self.N_el = len(circuit.elements)
@@ -37,19 +68,31 @@ class Model:
         ### Boundary conditions
         self.P_bc = np.array([None]*self.N_nodes)
         self.mdot_bc = np.array([None]*self.N_nodes)
+        self.T_bc = np.array([None]*self.N_nodes) # thermal solves only
         
         ### Steady-state solution data
         self.P_steady = np.array([None]*self.N_nodes)
         self.mdot_steady = np.array([None]*self.N_nodes)
+        self.T_steady = np.array([None]*self.N_nodes)
+        
+        ### Boundary values of the last converged solve, and a log of
+        ### iterations spent per solve for warm-start bookkeeping
+        self.bc_steady = None
+        self.solve_log = []
+        self.thermal = None # thermal solve whose element properties are in the assembly
         
         ### Linearized system dynamics matricies
-        self.M = np.zeros((self.N_sv, self.N_sv))
-        self.C = np.zeros((self.N_sv, self.N_sv))
-        self.K = np.zeros((self.N_sv, self.N_sv))
+        ### (N_sv x N_sv, built on demand so large networks aren't 
+        ###  allocated dense up front)
+        self.M = None
+        self.C = None
+        self.K = None
         
         ### Frequency domain solution data
-        self.f_n = ... # natural frequencies
-        self.omega_n = ... # circular f_n (system eigenvalues) 
+        self.f_n = None # natural frequencies
+        self.omega_n = None # circular f_n (system eigenvalues) 
+        self.zeta = None # damping ratios
+        self.mode_shapes = None # [N_sv, mode] pressure then flow amplitudes
 
 
         
@@ -57,12 +100,82 @@ class Model:
     ### Model Definition ###
     ### ---------------- ###
         
+    ### Track topology edits on the circuit
+    ### ------------------------------------
+    def network_changed(self, elements, nodes, node_map, element_map):
+        ### Carry node data over renumbered nodes
+        if node_map is not None:
+            # arrays keep their size until refresh(), possibly over several compactions
+            for name in ("P_bc", "mdot_bc", "T_bc", "P_steady", "mdot_steady", "T_steady"):
+                old = getattr(self, name)
+                n = min(len(old), len(node_map))
+                new = np.array([None]*len(node_map))
+                new[node_map[:n]] = old[:n]
+                setattr(self, name, new)
+            self.stale_nodes = {int(node_map[j]) for j in self.stale_nodes \
+                                if j < len(node_map)}
+        if element_map is not None:
+            self.stale_elements = {int(element_map[i]) for i in self.stale_elements \
+                                   if i < len(element_map)}
+        if self.assembly is not None:
+            self.assembly.renumber(node_map, element_map)
+        
+        ### Released nodes lose their conditions
+        for j in nodes:
+            if j < len(self.P_bc) and self.circuit.nodes[j] is None:
+                self.P_bc[j] = self.mdot_bc[j] = self.T_bc[j] = None
+        
+        ### Remember what changed until the next refresh
+        self.reduction = None
+        self.stale_elements |= elements
+        self.stale_nodes |= nodes
+        
+        
+    ### Pick up topology edits
+    ### ----------------------
+    def refresh(self):
+        ### Compact numbering and rebuild adjacency (may renumber nodes)
+        self.circuit.refresh()
+        
+        ### Resize per-node data, keeping values on surviving nodes
+        self.N_el = len(self.circuit.elements)
+        self.N_nodes = len(self.circuit.nodes)
+        self.N_sv = 2*self.N_nodes
+        for name in ("P_bc", "mdot_bc", "T_bc", "P_steady", "mdot_steady", "T_steady"):
+            old = getattr(self, name)
+            new = np.array([None]*self.N_nodes)
+            new[:min(len(old), self.N_nodes)] = old[:self.N_nodes]
+            setattr(self, name, new)
+            
+        ### Drop conditions on nodes that are no longer boundaries
+        for j in self.stale_nodes:
+            if j < self.N_nodes and not self.circuit.is_boundary[j]:
+                self.P_bc[j] = self.mdot_bc[j] = self.T_bc[j] = None
+                
+        ### Re-pack only the parts of the assembly touched by the edits
+        if self.assembly is not None and self.stale_elements:
+            self.assembly.update(self.stale_elements)
+            self.isothermal_properties() # no mix of repacked and thermal properties
+                
+        self.stale_elements = set()
+        self.stale_nodes = set()
+        
+        
+    ### Flag elements whose parameters were edited
+    ### ------------------------------------------
+    def element_changed(self, *elements):
+        ### Re-packed in place on the next solve
+        self.reduction = None
+        for element in elements:
+            self.stale_elements.add(element.id)
+        
+        
     ### Assign boundary conditions
     ### --------------------------
     def add_BC(self, BC_type, node, value):
         ### Check that node is boundary node
-        if isinstance(self.circuit.nodes[node], Boundary):
-            print("Requested node" + str(node) + "is not a boundary node.")
+        if not isinstance(self.circuit.nodes[node], Boundary):
+            print("Requested node " + str(node) + " is not a boundary node.")
             return
         
         ### Assign boundary condition
@@ -70,9 +183,11 @@ class Model:
             self.P_bc[node] = value
         elif BC_type == "flowrate":
             self.mdot_bc[node] = value
+        elif BC_type == "temperature":
+            self.T_bc[node] = value
         else:
             print("Invalid boundary condition. Must specify either" \
-                  "\"pressure\" or \"flowrate\".")        
+                  "\"pressure\", \"flowrate\" or \"temperature\".")        
         
         
     ### View configured boundary conditions
@@ -101,47 +216,470 @@ class Model:
     ### -------------------- ###
     
     
-    ### Construct nonlinear system
-    ### --------------------------
-    def build_steady_system(self, statevars):
-        ### Build system of nonlinear equations
-        ### constraining each element in fluid circuit
-        eqns = []
-        for i, element in enumerate(self.circuit.elements):
-            eqns.extend(element.steady_flow_eqns(statevars, \
-                                                 self.N_sv, \
-                                                 self.fluids[i].rho()))
+    ### Fluid properties of an element at reference temperature
+    ### -------------------------------------------------------
+    def element_properties(self, element):
+        fluid = self.element_fluid(element)
+        
+        # properties are shared by every element of the same fluid
+        if fluid not in self.property_cache:
+            rho, mu = fluid.properties(names=("rho", "mu"))
+            self.property_cache[fluid] = (float(rho), float(mu))
+        return self.property_cache[fluid]
+    
+    
+    def element_fluid(self, element):
+        fluid = element.fluid if element.fluid is not None else self.fluid
+        if fluid is None:
+            raise Exception("No fluid assigned to element " + element.name + ".")
+        return fluid
+    
+    
+    ### Compile steady-state system
+    ### ---------------------------
+    def compile(self):
+        ### Pick up pending topology edits
+        if self.stale_elements or self.stale_nodes or self.circuit.adjacency_stale:
+            self.refresh()
+        
+        ### Group elements by type into parameter and port arrays
+        if self.assembly is None:
+            self.property_cache = {}
+            self.assembly = Assembly(self.circuit, self.element_properties)
+        
+        ### Boundary condition rows
+        P_nodes = [j for j in range(self.N_nodes) if self.P_bc[j] is not None]
+        mdot_nodes = [j for j in range(self.N_nodes) if self.mdot_bc[j] is not None]
+        self.assembly.set_BCs(P_nodes, self.P_bc[P_nodes], \
+                              mdot_nodes, self.mdot_bc[mdot_nodes])
         
         ### Model checks
-        if len(eqns) < self.N_sv:
-            raise Exception("Number of equations in steady-state problem" \
+        N_eqns = self.assembly.N_eqns + len(self.assembly.bc_nodes)
+        if N_eqns < self.N_sv:
+            raise Exception("Number of equations in steady-state problem " \
                             "is less than the number of state variables.")
-        elif len(eqns) > self.N_sv:
-            raise Exception("Number of equations in steady-state problem" \
+        elif N_eqns > self.N_sv:
+            raise Exception("Number of equations in steady-state problem " \
                             "is greater than the number of state variables.")   
         
-        ### Nominal qty of equations have been added
-        else:
-            return np.array(eqns)
+        return self.assembly
+    
+    
+    ### Construct nonlinear system
+    ### --------------------------
+    def build_steady_system(self, statevars):
+        ### Residuals of the equations constraining each element in 
+        ### fluid circuit, followed by the boundary conditions
+        return self.assembly.residuals(statevars)
+    
+    
+    ### Construct sparse Jacobian of nonlinear system
+    ### ---------------------------------------------
+    def build_steady_jacobian(self, statevars):
+        return self.assembly.jacobian(statevars)
     
     
     ### Steady-state solver
     ### -------------------
-    def steady_solve(self):
+    def steady_solve(self, method="newton", x0=None, warm_start=True, max_step=.25, \
+                     guess="linear", **options):
+        '''
+        Inputs:
+            method     = (string) "newton" (sparse direct Newton), "krylov"
+                         (Newton-GMRES) or any dense scipy.optimize.root method
+            x0         = (vector) initial guess, overrides warm start
+            guess      = (string) cold-start guess, "linear" (solution of the
+                         linearized network) or "ones"
+            warm_start = (bool) start from the last converged solution, and
+                         step boundary values and element parameters from
+                         their last converged values when they changed a lot
+            max_step   = (scalar) largest relative change of any boundary value
+                         or parameter per continuation step
+            options    = solver options, see NewtonSolver or scipy root
+        '''
         ### Build nonlinear system of equations
-        eqns = self.build_steady_system 
+        self.compile()
+        self.isothermal_properties()
         
         ### Develop initial guess
-        sol_0 = np.ones(self.N_sv)
+        warm = x0 is None and warm_start and self.has_steady()
+        if x0 is None:
+            x0 = self.steady_state() if warm else np.full(self.N_sv, np.nan)
+            missing = np.isnan(x0) # all of it cold, or nodes added since the last solve
+            if np.any(missing):
+                cold = self.initial_guess() if guess == "linear" else np.ones(self.N_sv)
+                x0[missing] = cold[missing]
+            
+        ### Continuation from the last converged problem
+        changes = self.continuation_changes() if warm else []
+        scale = max([0] + [abs(new - old)/max(abs(old), abs(new)) \
+                           for _, old, new in changes])
+        if scale > max_step:
+            steady_sol = self.continuation_solve(method, x0, changes, \
+                                                 int(np.ceil(scale/max_step)), options)
+        else:
+            steady_sol = self.root_solve(method, x0, options)
+            steady_sol.steps = 1
+        
+        ### Pull variables and remember the converged problem for the next
+        ### warm start; a failed solve leaves the last converged state
+        if steady_sol.success:
+            self.P_steady = steady_sol.x[:self.N_nodes]
+            self.mdot_steady = steady_sol.x[self.N_nodes:]
+            self.bc_steady = (self.assembly.bc_nodes.copy(), self.assembly.bc_values.copy())
+            self.assembly.param_changes = []
+        self.solve_log.append({"warm": warm, "nit": steady_sol.nit, \
+                               "steps": steady_sol.steps, "success": steady_sol.success})
+        
+        return steady_sol
+    
+    
+    ### Coupled thermal-hydraulic steady state
+    ### --------------------------------------
+    def thermal_solve(self, heat=None, **options):
+        '''
+        Solves node temperatures with the pressures and flow rates, each
+        element's rho, mu and cp taken at its own temperature (see
+        thermal.py). Every inlet boundary node needs a "temperature"
+        boundary condition. Element properties are left at the solution,
+        so dynamics and modal analyses that follow use them, until the next
+        isothermal solve or circuit edit restores the reference properties
+        (see isothermal_properties).
+        
+        Inputs:
+            heat    = (dictionary) element -> [W] heat added, e.g. by a
+                      cooling jacket
+            options = NewtonSolver options
+            
+        Outputs:
+            (OptimizeResult) solution, x = [P, mdot, T] by node
+        '''
+        ### Isothermal flow field to start from
+        self.compile()
+        if not self.has_steady():
+            self.steady_solve(**options)
+        T_nodes = [j for j in range(self.N_nodes) if self.T_bc[j] is not None]
+        if not T_nodes:
+            raise Exception("Thermal solve needs temperature boundary conditions.")
+        thermal = Thermal(self.assembly, self.element_fluid, T_nodes, \
+                          self.T_bc[T_nodes], heat)
+        
+        T0 = self.T_steady.astype(float)
+        T0[np.isnan(T0)] = np.mean(thermal.T_values)
+        x0 = np.concatenate([self.steady_state(), T0])
+        
+        solver = NewtonSolver("newton", **options)
+        sol = solver.solve(thermal.residuals, thermal.jacobian, x0, key=thermal.pattern)
+        self.thermal = thermal
+        
+        ### Keep the solution and its properties only if converged
+        if sol.success:
+            thermal.residuals(sol.x) # leave properties at the returned state
+            N = self.N_nodes
+            self.P_steady, self.mdot_steady, self.T_steady = sol.x[:N], sol.x[N:2*N], sol.x[2*N:]
+            self.bc_steady = (self.assembly.bc_nodes.copy(), self.assembly.bc_values.copy())
+        else:
+            self.isothermal_properties()
+        self.solve_log.append({"warm": True, "nit": sol.nit, "steps": 1, "success": sol.success})
+        
+        return sol
+    
+    
+    ### Undo the per-element properties of a thermal solve
+    ### -------------------------------------------------
+    def isothermal_properties(self):
+        if self.thermal is None:
+            return
+        self.thermal = None
+        if self.assembly is None:
+            return
+        for group in self.assembly.groups.values():
+            props = np.array([self.element_properties(el) for el in group.elements], \
+                             dtype=float).reshape(group.n, 2)
+            group.rho, group.mu = props[:, 0].copy(), props[:, 1].copy()
+    
+    
+    ### Steady solve of the series/parallel reduced circuit
+    ### --------------------------------------------------
+    def reduced_solve(self, **options):
+        '''
+        Collapses series chains of two-port elements and folds identical
+        parallel branches (see reduction.py), solves the smaller circuit and
+        recovers pressures and flow rates at every node of this one. The
+        reduction is kept until the circuit or an element is edited.
+        
+        Inputs:
+            options = steady_solve options
+        '''
+        if self.reduction is None:
+            self.reduction = Reduction(self)
+        return self.reduction.solve(**options)
+    
+    
+    ### Single nonlinear solve of the compiled system
+    ### ---------------------------------------------
+    def root_solve(self, method, x0, options):
+        eqns = self.build_steady_system 
+        
+        ### Sparse Newton backends
+        if method in ("newton", "krylov"):
+            if method not in self.solvers or options:
+                self.solvers[method] = NewtonSolver(method, **options)
+            if self.assembly.pattern is None:
+                self.assembly.build_pattern()
+            return self.solvers[method].solve(eqns, self.build_steady_jacobian, \
+                                              x0, key=self.assembly.pattern)
+            
+        ### Dense rootfinding with analytic Jacobian
+        sol = root(eqns, x0, method=method, options=options or None, \
+                   jac=lambda x: self.build_steady_jacobian(x).toarray())
+        sol.nit = sol.get("nit", sol.nfev)
+        return sol
+    
+    
+    ### Initial guess from linearized network
+    ### -------------------------------------
+    def initial_guess(self, bc_values=None):
+        '''
+        Solves the network with every loss element replaced by a constant
+        resistance, with one sparse factorization. Resistances are secants
+        of each element's loss through the flow scale of the flow boundary
+        conditions, or else through the flow that would drop the full
+        pressure boundary spread across that element alone.
+        
+        Inputs:
+            bc_values = (array) [N_bc] or [batch, N_bc] boundary values,
+                        defaults to the compiled ones
+                        
+        Outputs:
+            (array) [N_sv] or [batch, N_sv] initial guess
+        '''
+        assembly = self.assembly
+        if bc_values is None:
+            bc_values = assembly.bc_values
+        bc_values = np.asarray(bc_values, dtype=float)
+        
+        ### Pressure and flow scales of the boundary conditions
+        is_P = assembly.bc_nodes < self.N_nodes
+        P_values = bc_values[..., is_P]
+        mdot_values = np.abs(bc_values[..., ~is_P])
+        P_ref = np.mean(P_values) if P_values.size else 0.
+        dP = np.mean(np.ptp(P_values, axis=-1)) if P_values.shape[-1] > 1 else 0.
+        if dP <= 0:
+            dP = max(.1*abs(P_ref), 1e5)
+        mdot = np.max(mdot_values) if mdot_values.size and np.max(mdot_values) > 0 \
+               else None
+        
+        ### Linear network about a uniform, stagnant state
+        x_ref = np.concatenate([np.full(self.N_nodes, P_ref), np.zeros(self.N_nodes)])
+        if assembly.pattern is None:
+            assembly.build_pattern()
+        J, b = assembly.linear_system(x_ref, dP, mdot)
+        B = np.tile(b, bc_values.shape[:-1] + (1,))
+        B[..., assembly.N_eqns:] = bc_values
+        
+        ### One factorization for all right-hand sides, in the Newton ordering
+        solver = self.solvers.setdefault("newton", NewtonSolver("newton"))
+        solver.analyze(J, assembly.pattern)
+        X = solver.linear_solve(J, B.reshape(-1, self.N_sv).T, 0).T
+        if not np.all(np.isfinite(X)):
+            print("Linearized network is singular, using a uniform initial guess.")
+            X = np.ones_like(X)
+            
+        return X.reshape(B.shape)
+    
+    
+    ### Warm-start helpers
+    ### ------------------
+    def has_steady(self):
+        return self.bc_steady is not None and \
+               np.any(np.isfinite(self.steady_state()))
+    
+    def steady_state(self):
+        return np.concatenate([self.P_steady, self.mdot_steady]).astype(float)
+    
+    def continuation_changes(self):
+        '''
+        Outputs:
+            (list) (setter, old, new) for each boundary value and element
+                   parameter that differs from the last converged problem
+        '''
+        assembly = self.assembly
+        changes = []
+        
+        ### Boundary values (only if the same nodes are constrained)
+        bc_nodes, bc_values = self.bc_steady
+        if np.array_equal(bc_nodes, assembly.bc_nodes):
+            for b in np.flatnonzero(bc_values != assembly.bc_values):
+                def setter(value, b=b): assembly.bc_values[b] = value
+                changes.append((setter, bc_values[b], assembly.bc_values[b]))
+        
+        ### Element parameters edited in place
+        for group, key, k, old, new in assembly.param_changes:
+            def setter(value, p=group.params[key], k=k): p[k] = value
+            changes.append((setter, old, new))
+            
+        return changes
+    
+    
+    ### Continuation over changed boundary values and parameters
+    ### --------------------------------------------------------
+    def continuation_solve(self, method, x0, changes, N_steps, options):
+        ### Walk lambda from 0 (last converged problem) to 1 (new problem),
+        ### halving the step on failure and growing it after successes
+        lam, dlam = 0., 1/N_steps
+        x, nit, steps = x0, 0, 0
+        while lam < 1:
+            lam_try = min(1., lam + dlam)
+            for setter, old, new in changes:
+                setter(old + lam_try*(new - old))
+            sol = self.root_solve(method, x, options)
+            nit += sol.nit
+            steps += 1
+            
+            if sol.success:
+                lam, x = lam_try, sol.x
+                dlam *= 1.5
+            else:
+                dlam /= 2
+                if dlam < 1e-3: break
+        
+        ### Leave the new problem in place
+        for setter, old, new in changes:
+            setter(new)
         
-        ### Rootfinding
-        steady_sol = root(eqns, sol_0)
+        sol.nit, sol.steps = nit, steps
+        return sol
+    
+    
+    ### Iteration savings of warm starts
+    ### --------------------------------
+    def warm_start_report(self):
+        '''
+        Compares iterations of warm-started solves against the mean of the
+        cold solves in solve_log.
+        '''
+        cold = [s["nit"] for s in self.solve_log if not s["warm"]]
+        warm = [s["nit"] for s in self.solve_log if s["warm"]]
+        report = {
+            "cold_solves": len(cold),
+            "warm_solves": len(warm),
+            "cold_mean_nit": np.mean(cold) if cold else np.nan,
+            "warm_mean_nit": np.mean(warm) if warm else np.nan,
+            "continuation_steps": sum(s["steps"] - 1 for s in self.solve_log),
+        }
+        report["nit_saved"] = report["cold_mean_nit"]*len(warm) - sum(warm)
+        
+        print("Cold solves: " + str(len(cold)) + ", mean iterations: " + \
+              str(report["cold_mean_nit"]))
+        print("Warm solves: " + str(len(warm)) + ", mean iterations: " + \
+              str(report["warm_mean_nit"]))
+        print("Iterations saved: " + str(report["nit_saved"]))
         
-        ### Pull variables
-        self.P_steady = steady_sol[0:self.N_nodes-1]
-        self.mdot_steady = steady_sol[self.N_nodes:self.N_sv-1]
+        return report
         
     
+    ### Batched operating-point sweep
+    ### -----------------------------
+    def sweep(self, P_bc=None, mdot_bc=None, **options):
+        '''
+        Solves the circuit at many boundary values at once with a batched
+        sparse Newton iteration over stacked state vectors.
+        
+        Inputs:
+            P_bc    = (dictionary) node -> (vector) pressures [Pa] per
+                      operating point, or a scalar held constant
+            mdot_bc = (dictionary) node -> (vector) flow rates [kg/s] per
+                      operating point, or a scalar held constant
+            options = NewtonSolver options
+            
+        Boundary nodes not listed keep the values set with add_BC.
+        
+        Outputs:
+            (array) [operating point, N_sv] pressures then flow rates by node,
+                    NaN for points that did not converge
+        '''
+        P_bc, mdot_bc = P_bc or {}, mdot_bc or {}
+        
+        ### Temporarily register swept nodes so the assembly has their rows
+        ### (a swept value replaces any other condition on its node)
+        saved = self.P_bc.copy(), self.mdot_bc.copy()
+        for node in P_bc: self.P_bc[node], self.mdot_bc[node] = 0., None
+        for node in mdot_bc: self.P_bc[node], self.mdot_bc[node] = None, 0.
+        try:
+            assembly = self.compile()
+        finally:
+            self.P_bc, self.mdot_bc = saved
+        self.isothermal_properties()
+            
+        ### Boundary values per operating point
+        N_pts = max([np.size(v) for v in (*P_bc.values(), *mdot_bc.values())] + [1])
+        values = np.tile(assembly.bc_values, (N_pts, 1))
+        for b, node in enumerate(assembly.bc_nodes):
+            swept = P_bc if node < self.N_nodes else mdot_bc
+            node = node if node < self.N_nodes else node - self.N_nodes
+            if node in swept:
+                values[:, b] = np.broadcast_to(swept[node], N_pts)
+                
+        ### Batched Newton iteration, warm started from the last steady solve
+        ### when it constrained the same nodes
+        X0 = self.initial_guess(values)
+        if self.has_steady() and np.array_equal(self.bc_steady[0], assembly.bc_nodes):
+            x0 = self.steady_state()
+            X0 = np.where(np.isnan(x0), X0, x0)
+        if "newton" not in self.solvers or options:
+            self.solvers["newton"] = NewtonSolver("newton", **options)
+        if assembly.pattern is None:
+            assembly.build_pattern()
+        sol = self.solvers["newton"].solve_batch(
+            lambda X, idx: assembly.residuals(X, values[idx]), \
+            lambda X, idx: assembly.jacobian(X), \
+            X0, key=assembly.pattern)
+        
+        ### Mark unconverged points
+        results = sol.x
+        if not np.all(sol.success):
+            print(str(np.sum(~sol.success)) + " of " + str(N_pts) + \
+                  " operating points did not converge.")
+            results[~sol.success] = np.nan
+            
+        return results
+    
+    
+    ### Quasi-steady replay of boundary-condition time series
+    ### ----------------------------------------------------
+    def replay(self, samples, channels, path=None, nodes=None, every=1, chunk=1024, **options):
+        '''
+        Solves the circuit at every sample of a measured record, each warm
+        started from the previous one (see replay.py).
+        
+        Inputs:
+            samples  = (iterable) (t, values) per sample, e.g. csv_samples()
+            channels = (list) (target, key) driven by each value, target
+                       "pressure" or "flowrate" with a boundary node, or
+                       elements with a parameter name such as "Knet"
+            path     = (string) directory to stream solutions to in chunks
+                       (see history.py), or None to yield them
+            nodes    = (list) nodes to record on disk, or None for all
+            every    = (int) record every this many samples
+            options  = NewtonSolver options
+            
+        Outputs:
+            path None: (generator) (t, x) per sample, x NaN where the solve
+            did not converge; else (History) of path
+        '''
+        self.isothermal_properties()
+        self.replayer = QuasiSteady(self, channels, **options)
+        solutions = self.replayer(samples)
+        if path is None:
+            return solutions
+        
+        recorder = Recorder(self.N_nodes, nodes, every, chunk=chunk, path=path)
+        for t, x in solutions:
+            recorder.append(t, x)
+        return recorder.close()
+    
+    
     ### Solution View Options
     ### ---------------------
     def print_steady_data(self):
@@ -168,19 +706,346 @@ class Model:
     ### Construct linearized dynamics matricies
     ### ---------------------------------------
     def build_dynamics_mats(self):
-        ... # (TODO)
+        '''
+        Sparse M, C, K about the steady solution (see Assembly.dynamics).
+        
+        Outputs:
+            (csr_matrix) M, C, K [N_sv x N_sv]
+        '''
+        self.compile()
+        x = self.steady_state()
+        if not np.all(np.isfinite(x)):
+            raise Exception("Dynamics are linearized about the steady state. " \
+                            "Run steady_solve first.")
+        self.M, self.C, self.K = self.assembly.dynamics(x)
+        
+        return self.M, self.C, self.K
         
         
     ### Natural frequency eignesolver
     ### -----------------------------
-    def eigen_solve(self):
-        ... # (TODO)
+    def eigen_solve(self, k=6, f_target=100., tol=0):
+        '''
+        Extracts the k modes nearest each target frequency from the
+        linearized dynamics by shift-invert ARPACK (see modal.py).
+        
+        Inputs:
+            k        = (int) modes per target
+            f_target = (scalar or vector) [Hz] target frequencies, e.g.
+                       spread over the 10-500 Hz POGO/chugging band
+            tol      = (scalar) ARPACK relative accuracy
+            
+        Outputs:
+            (vector) f_n [Hz], (vector) zeta, ordered by frequency
+        '''
+        M, C, K = self.build_dynamics_mats()
+        A, B, shape_rows = companion(M, C, K)
+        
+        lam, Y = nearest_modes(A, B, f_target, k, tol)
+        self.set_modes(lam, Y, shape_rows)
+        return self.f_n, self.zeta
+    
+    def set_modes(self, lam, Y, shape_rows):
+        self.omega_n = lam
+        self.f_n = lam.imag/(2*np.pi)
+        self.zeta = -lam.real/np.abs(lam)
+        self.mode_vectors = Y # companion eigenvectors, reused by track_modes
+        self.mode_shapes = unit_peak(Y[shape_rows]) # lambda x = [dP, dmdot] amplitudes
+        
+        
+    ### Modes followed through a parameter sweep
+    ### ----------------------------------------
+    def track_modes(self, values, update, k=6, f_target=100., mac_min=.8, tol=1e-8, \
+                    max_iter=20):
+        '''
+        Follows the modes of the first sweep point through the rest, e.g.
+        for POGO stability charts over tank pressure or line length. Each
+        point is warm started: the steady solve from the last one, and the
+        modes by a Krylov iteration started from the last eigenvectors and
+        shifted among the last eigenvalues (modal.refine_modes). Modes are paired across
+        points by MAC, so each column is one physical mode even where
+        frequencies cross. A point whose modes do not all pair above
+        mac_min is solved cold with eigen_solve and paired the same way.
+        
+        Inputs:
+            values   = (vector) parameter value per sweep point
+            update   = (function) value -> None, applies a value to the
+                       model (add_BC, or an element edit followed by
+                       element_changed)
+            k        = (int) modes per target at the first point
+            f_target = (scalar or vector) [Hz] targets of cold solves
+            mac_min  = (scalar) least MAC accepted between points
+            tol      = (scalar) relative residual of refined modes
+            max_iter = (int) Krylov blocks per point
+            
+        Outputs:
+            (array) f_n [Hz], (array) zeta, (array) MAC with the previous
+            point, each [point, mode]; NaN where a mode was lost
+        '''
+        self.tracking_log = []
+        F = Z = MAC = None
+        lam = Y = X = shape_rows = None
+        for i, value in enumerate(values):
+            update(value)
+            sol = self.steady_solve()
+            log = {"value": value, "cold": False, "solves": 0}
+            self.tracking_log.append(log)
+            if not sol.success:
+                continue
+            
+            ### First point defines the tracked modes
+            if lam is None:
+                self.eigen_solve(k, f_target)
+                lam, Y, X = self.omega_n, self.mode_vectors, self.mode_shapes
+                F = np.full((len(values), len(lam)), np.nan)
+                Z, MAC = F.copy(), F.copy()
+                F[i], Z[i], MAC[i] = self.f_n, self.zeta, 1
+                log["cold"] = True
+                continue
+            
+            ### Refine from the last point, or solve cold and pair
+            M, C, K = self.build_dynamics_mats()
+            A, B, shape_rows = companion(M, C, K)
+            lam_i, Y_i, log["solves"] = refine_modes(A, B, lam, Y, tol, max_iter)
+            match, mac = match_modes(X, unit_peak(Y_i[shape_rows]))
+            if not (np.all(np.isfinite(lam_i)) and np.all(mac >= mac_min)):
+                self.eigen_solve(k, f_target)
+                lam_i, Y_i = self.omega_n, self.mode_vectors
+                match, mac = match_modes(X, self.mode_shapes)
+                log["cold"] = True
+            found = (match >= 0) & (mac >= mac_min)
+            
+            ### Tracked modes in their original order
+            lam = np.where(found, lam_i[match], lam)
+            Y = np.where(found, Y_i[:, match], Y)
+            X = unit_peak(Y[shape_rows])
+            F[i] = np.where(found, lam.imag/(2*np.pi), np.nan)
+            Z[i] = np.where(found, -lam.real/np.abs(lam), np.nan)
+            MAC[i] = np.where(found, mac, np.nan)
+            
+        if shape_rows is not None:
+            self.set_modes(lam, Y, shape_rows)
+        return F, Z, MAC
+        
+        
+    ### Frequency response functions
+    ### ----------------------------
+    def frequency_response(self, f, inputs, outputs, batch=32, threads=None, \
+                           distributed=False):
+        '''
+        Transfer functions from boundary-value disturbances to node
+        pressures and flow rates, from the dynamic stiffness
+        K + i omega C - omega^2 M at each frequency. The fill-reducing
+        ordering is computed once and reused for every frequency; each
+        batch of frequencies is factored as one block-diagonal system.
+        With distributed=True, pipes with a wave speed enter through their
+        exact transfer matrices (Pipe.transfer_matrix) instead of a single
+        lumped section, so a long line needs no splitting into segments.
+        
+        Inputs:
+            f       = (vector) [Hz] frequencies
+            inputs  = (list) ("pressure" or "flowrate", node) boundary
+                      conditions disturbed with unit amplitude
+            outputs = (list) ("pressure" or "flowrate", node) responses
+            batch   = (int) frequencies per factorization
+            threads = (int) worker threads over batches, None to run in
+                      this thread
+            distributed = (bool) wave-equation pipes
+            
+        Outputs:
+            (array) [frequency, output, input] complex FRFs, e.g. [Pa/Pa]
+        '''
+        M, C, K = self.build_dynamics_mats()
+        pencil = Pencil(M, C, K, self.distributed_rows() if distributed else None)
+        n = self.N_sv
+        
+        ### Unit disturbance of each input's boundary row (rows read
+        ### -x_bc = -value, as C is the negated steady Jacobian)
+        bc = {int(node): b for b, node in enumerate(self.assembly.bc_nodes)}
+        F = np.zeros((n, len(inputs)))
+        for i, (BC_type, node) in enumerate(inputs):
+            key = node if BC_type == "pressure" else self.N_nodes + node
+            if key not in bc:
+                raise Exception("No " + BC_type + " boundary condition at node " + \
+                                str(node) + ".")
+            F[self.assembly.N_eqns + bc[key], i] = -1
+        out = np.array([node if var == "pressure" else self.N_nodes + node \
+                        for var, node in outputs], dtype=np.int64)
+        
+        ### Ordering of the shared pattern
+        omega = 2*np.pi*np.asarray(f, dtype=float)
+        solver = NewtonSolver("newton")
+        solver.analyze(pencil.matrix(np.max(omega)), pencil)
+        
+        def solve(w):
+            perm = (solver.perm_c[None, :] + n*np.arange(len(w))[:, None]).ravel()
+            X = solver.linear_solve(pencil.matrix(w), np.tile(F, (len(w), 1)), 0, perm)
+            return X.reshape(len(w), n, -1)[:, out, :]
+        
+        chunks = np.array_split(omega, max(1, int(np.ceil(len(omega)/batch))))
+        if threads is None:
+            H = list(map(solve, chunks))
+        else:
+            with ThreadPoolExecutor(threads) as pool:
+                H = list(pool.map(solve, chunks))
+            
+        return np.concatenate(H)
+        
+        
+    ### Exact momentum and continuity rows of wave-equation pipes
+    ### --------------------------------------------------------
+    def distributed_rows(self):
+        '''
+        Replaces the lumped rows of each pipe with a wave speed by
+        
+            -dP_1 + T_11 dP_2 + T_12 dmdot_2 = 0
+            -dmdot_1 + T_21 dP_2 + T_22 dmdot_2 = 0
+            
+        Outputs:
+            (tuple) (rows, cols, values) exact entries for Pencil, or None
+        '''
+        group = self.assembly.groups.get(Pipe)
+        if group is None or not np.any(np.isfinite(group.params["a"])):
+            return None
+        k = np.flatnonzero(np.isfinite(group.params["a"]))
+        N = self.N_nodes
+        P_1, P_2 = group.ports[k, 0], group.ports[k, 1]
+        r_m, r_c = group.eq_rows[0, k], group.eq_rows[1, k]
+        rows = np.concatenate([r_m, r_m, r_m, r_c, r_c, r_c])
+        cols = np.concatenate([P_1, P_2, N + P_2, N + P_1, P_2, N + P_2])
+        
+        params = {key: value[k] for key, value in group.params.items()}
+        mdot = self.steady_state()[N + P_1]
+        rho, mu = group.rho[k], group.mu[k]
+        def values(omega):
+            T = Pipe.transfer_matrix(params, omega, mdot, rho, mu)
+            one = -np.ones(T.shape[:1] + T.shape[3:])
+            return np.concatenate([one, T[:, 0, 0], T[:, 0, 1], \
+                                   one, T[:, 1, 0], T[:, 1, 1]], axis=1)
+        
+        return rows, cols, values
+        
+        
+    ### Transfer matrix of a series run
+    ### -------------------------------
+    def transfer_matrix(self, elements, f):
+        '''
+        Chains the 2x2 transfer matrices of a series run of two-port
+        elements, [dP_in, dmdot_in] = T [dP_out, dmdot_out], about the
+        steady solution. Pipes use their exact distributed-parameter
+        matrices; other elements are the lumped L-sections of the
+        dynamics matrices, [[1 + ZY, Z], [Y, 1]] with Z = R + i omega I and
+        Y = i omega c. The cost per frequency is independent of how finely
+        the run would otherwise be segmented.
+        
+        Inputs:
+            elements = (list) two-port elements in flow order, each outlet
+                       (port 1) tied to the next inlet (port 0)
+            f        = (vector) [Hz] frequencies
+            
+        Outputs:
+            (array) [frequency, 2, 2] complex transfer matrices
+        '''
+        for a, b in zip(elements[:-1], elements[1:]):
+            if a.ports[1] != b.ports[0]:
+                raise Exception(a.name + " and " + b.name + " are not in series " \
+                                "(outlet port 1 to inlet port 0).")
+        self.compile()
+        x = self.steady_state()
+        if not np.all(np.isfinite(x)):
+            raise Exception("Transfer matrices are linearized about the steady " \
+                            "state. Run steady_solve first.")
+        omega = 2*np.pi*np.asarray(f, dtype=float)
+        
+        ### Section matrices by element type
+        T = np.empty((len(omega), 2, 2, len(elements)), dtype=complex)
+        by_type = {}
+        for i, el in enumerate(elements):
+            by_type.setdefault(type(el), []).append(i)
+        for cls, index in by_type.items():
+            group = self.assembly.groups[cls]
+            if not hasattr(cls, "loss_jacobian"):
+                raise Exception(cls.__name__ + " is not a two-port loss element.")
+            k = np.array([group.elements.index(elements[i]) for i in index])
+            params = {key: value[k] for key, value in group.params.items()}
+            mdot = x[self.N_nodes + group.ports[k, 0]]
+            rho, mu = group.rho[k], group.mu[k]
+            if cls is Pipe:
+                T[..., index] = Pipe.transfer_matrix(params, omega, mdot, rho, mu)
+                continue
+            w = omega[:, None]
+            Z = cls.loss_jacobian(params, mdot, rho, mu) + \
+                1j*w*(cls.inertance(params, rho) if hasattr(cls, "inertance") else 0)
+            Y = 1j*w*(cls.compliance(params, rho) if hasattr(cls, "compliance") else 0)
+            Z, Y = np.broadcast_arrays(Z, Y)
+            T[:, 0, 0, index], T[:, 0, 1, index] = 1 + Z*Y, Z
+            T[:, 1, 0, index], T[:, 1, 1, index] = Y, 1
+        
+        ### Product from inlet to outlet
+        chain = T[..., 0]
+        for i in range(1, len(elements)):
+            chain = chain @ T[..., i]
+        return chain
         
         
     ### Solution View Options
     ### ---------------------
     def print_freq_domain_data(self):
-        ... # (TODO)
+        print("Natural frequencies: ")
+        for i in range(len(self.f_n)):
+            print("   Mode " + str(i) + ": " + str(self.f_n[i]) + " Hz, zeta = " + \
+                  str(self.zeta[i]))
         
     def plot_freq_domain_data(self):
-        ... # (TODO)
\ No newline at end of file
+        ... # (TODO)        
+    
+    
+    ### -------------------- ###
+    ### Time Domain Methods  ###
+    ### -------------------- ###
+    
+    
+    ### Transient from the steady state
+    ### -------------------------------
+    def transient_solve(self, t_end, events=(), method="moc", dt=None, every=1, interval=None, \
+                        nodes=None, path=None, chunk=1024, **options):
+        '''
+        Marches the circuit in time from its steady solution while boundary
+        values or element parameters follow the given events, e.g. a valve
+        closure (orifice "Knet" rising) or a start-up (inlet pressure ramp).
+        
+        Inputs:
+            t_end    = (scalar) [s] simulated time
+            events   = (list) (target, key, function of t), see Transient.add_event
+            method   = (string) "moc", method of characteristics on wave-speed
+                       pipes with lumped orifices, tees and reducers, or
+                       "bdf", implicit adaptive integration of the lumped
+                       circuit (M x' = F(x, t)) for stiff inertances
+            dt       = (scalar) [s] time step ("moc") or first step ("bdf")
+            every    = (int) record every this many steps
+            interval = (scalar) [s] least time between records, or None
+            nodes    = (list) nodes to record, or None for all of them
+            path     = (string) directory to stream the history to in chunks
+                       of chunk records (see history.py), or None to keep it
+                       in memory
+            options  = MOC options (reaches, tol, maxiter) or BDF options
+                       (rtol, atol, max_step, max_order, maxiter)
+            
+        Outputs:
+            in memory: (vector) [s] times, (array) [time, 2*node] recorded
+            pressures then flow rates; on disk: (History) of path
+        '''
+        engines = {"moc": MOC, "bdf": BDF}
+        if method not in engines:
+            raise Exception("Invalid transient method: " + method + ". Must be either " \
+                            "\"moc\" or \"bdf\".")
+        self.transient = engines[method](self, dt=dt, **options)
+        for event in events:
+            self.transient.add_event(*event)
+        history = self.transient.run(t_end, every, interval, nodes, path, chunk)
+        if path is None:
+            self.t_transient, self.x_transient = history
+        else:
+            self.transient_history = history
+        
+        return history
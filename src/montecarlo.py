@@ -0,0 +1,305 @@
+'''
+Monte Carlo tolerance analysis of steady-state fluid circuits.
+
+Element parameters (e.g. orifice diameters "do", orifice K-factors "Knet",
+pipe roughness "epsilon") are sampled within manufacturing tolerance and
+the circuit is solved at every sample. Samples are drawn and solved in
+chunks: each chunk is one batched Newton solve in which every batch entry
+carries its own copy of the sampled parameter arrays. Chunks are spread
+over a process pool. The compiled assembly arrays (the read-only topology)
+are sent once per worker, and only a seed and a chunk size go out per
+task.
+
+Results are never stored per sample. Each finished chunk is folded into
+running statistics of every state variable: mean, standard deviation,
+extremes and a fixed-bin histogram that percentiles are read from.
+
+Author(s):
+    Samuel Ciesielski
+
+'''
+
+from multiprocessing import Pool
+import numpy as np
+from solver import NewtonSolver
+
+
+
+class MonteCarlo:
+
+    ### Constructor
+    ### -----------
+    def __init__(self, model, seed=0):
+        '''
+        Inputs:
+            model = (Model) circuit with boundary conditions assigned
+            seed  = (int) seed of the sample streams
+        '''
+        self.model = model
+        self.seed = seed
+        self.tolerances = [] # (element, param, tol, distribution, relative)
+
+
+    ### Vary a parameter of one or more elements
+    ### ----------------------------------------
+    def add_tolerance(self, elements, param, tol, distribution="uniform", relative=True):
+        '''
+        Inputs:
+            elements     = (Element or list) elements varied independently
+            param        = (string) packed parameter name, e.g. "do", "Knet",
+                           "epsilon", "Dh", "l"
+            tol          = (scalar) half-width of a uniform distribution, or
+                           standard deviation of a normal distribution
+            distribution = (string) "uniform" or "normal"
+            relative     = (bool) tol is a fraction of the nominal value
+        '''
+        if distribution not in ("uniform", "normal"):
+            raise Exception("Invalid distribution: " + distribution + ". Must be " \
+                            "either \"uniform\" or \"normal\".")
+        if not isinstance(elements, (list, tuple)):
+            elements = [elements]
+        for element in elements:
+            self.tolerances.append((element, param, tol, distribution, relative))
+
+
+    ### Sample specification against the compiled assembly
+    ### ---------------------------------------------------
+    def build_specs(self, assembly):
+        '''
+        Outputs:
+            (list) per (type, param): element positions in the group,
+                   nominal values, tolerances, normal flags, relative flags
+        '''
+        specs = {}
+        for element, param, tol, distribution, relative in self.tolerances:
+            group = assembly.groups.get(type(element))
+            if group is None or param not in group.params:
+                raise Exception(type(element).__name__ + " has no parameter " + param + ".")
+            k = np.flatnonzero(group.ids == element.id)
+            if len(k) == 0:
+                raise Exception(element.name + " is not in the model's circuit.")
+            specs.setdefault((type(element), param), []).append( \
+                (k[0], group.params[param][k[0]], tol, distribution == "normal", relative))
+
+        return [(cls, param, *map(np.array, zip(*entries))) \
+                for (cls, param), entries in specs.items()]
+
+
+    ### Run samples
+    ### -----------
+    def run(self, N_samples, chunk_size=500, processes=None, bins=200, **options):
+        '''
+        Inputs:
+            N_samples  = (int) number of samples
+            chunk_size = (int) samples per batched solve / pool task
+            processes  = (int) worker processes, None for all cores, 1 to
+                         run in this process
+            bins       = (int) histogram bins per state variable
+            options    = NewtonSolver options
+
+        Outputs:
+            (Summary) statistics of pressures then flow rates by node
+        '''
+        model = self.model
+        assembly = model.compile()
+        if assembly.pattern is None:
+            assembly.build_pattern()
+        specs = self.build_specs(assembly)
+
+        ### Nominal solution seeds every sample
+        nominal = model.steady_solve(**options)
+        if not nominal.success:
+            raise Exception("Nominal steady solve did not converge: " + str(nominal.message))
+        x0 = nominal.x
+        if N_samples <= 0:
+            return Summary(x0, x0, bins) # empty, count = 0
+
+        ### Independent seed per chunk, so results don't depend on scheduling
+        sizes = [min(chunk_size, N_samples - start) for start in range(0, N_samples, chunk_size)]
+        seeds = np.random.SeedSequence(self.seed).spawn(len(sizes))
+        tasks = list(zip(seeds, sizes))
+        payload = (assembly.copy(), specs, x0, options)
+
+        summary = None
+        if processes == 1:
+            init_worker(*payload)
+            chunks = map(run_chunk, tasks)
+            for results in chunks:
+                summary = fold(summary, results, bins)
+        else:
+            with Pool(processes, initializer=init_worker, initargs=payload) as pool:
+                for results in pool.imap_unordered(run_chunk, tasks):
+                    summary = fold(summary, results, bins)
+
+        if summary.failed:
+            print(str(summary.failed) + " of " + str(N_samples) + \
+                  " samples did not converge.")
+        return summary
+
+
+
+### ----------------- ###
+### Running Statistics ###
+### ----------------- ###
+
+class Summary:
+
+    ### Constructor
+    ### -----------
+    def __init__(self, lo, hi, bins):
+        '''
+        Inputs:
+            lo, hi = (vector) [N_var] histogram range per variable; values
+                     outside it land in under/overflow bins
+            bins   = (int) bins per variable
+        '''
+        self.lo = np.asarray(lo, dtype=float)
+        self.hi = np.maximum(np.asarray(hi, dtype=float), self.lo + 1e-300)
+        self.bins = bins
+        N_var = len(self.lo)
+
+        self.count = 0
+        self.failed = 0
+        self.mean = np.zeros(N_var)
+        self.M2 = np.zeros(N_var)
+        self.min = np.full(N_var, np.inf)
+        self.max = np.full(N_var, -np.inf)
+        self.counts = np.zeros((N_var, bins + 2), dtype=np.int64) # [under, bins..., over]
+
+    @property
+    def std(self):
+        return np.sqrt(self.M2/max(self.count - 1, 1))
+
+    @property
+    def edges(self):
+        return self.lo[:, None] + (self.hi - self.lo)[:, None]*np.linspace(0, 1, self.bins + 1)
+
+
+    ### Fold a chunk of samples in
+    ### --------------------------
+    def update(self, X):
+        '''
+        Inputs:
+            X = (array) [samples, N_var], rows with NaN count as failed
+        '''
+        ok = np.all(np.isfinite(X), axis=1)
+        self.failed += int(np.sum(~ok))
+        X = X[ok]
+        n = len(X)
+        if n == 0:
+            return
+
+        ### Moments, merged pairwise (Chan et al.)
+        mean = X.mean(axis=0)
+        M2 = np.sum((X - mean)**2, axis=0)
+        delta = mean - self.mean
+        total = self.count + n
+        self.mean = self.mean + delta*n/total
+        self.M2 = self.M2 + M2 + delta**2*self.count*n/total
+        self.count = total
+        self.min = np.minimum(self.min, X.min(axis=0))
+        self.max = np.maximum(self.max, X.max(axis=0))
+
+        ### Histogram counts
+        N_var = len(self.lo)
+        b = np.floor((X - self.lo)/(self.hi - self.lo)*self.bins).astype(np.int64)
+        b = np.clip(b, -1, self.bins) + 1
+        flat = (np.arange(N_var)*(self.bins + 2) + b).ravel()
+        self.counts += np.bincount(flat, minlength=N_var*(self.bins + 2)) \
+                         .reshape(N_var, self.bins + 2)
+
+
+    ### Percentiles from the histogram
+    ### ------------------------------
+    def percentile(self, q):
+        '''
+        Inputs:
+            q = (scalar or vector) percentiles in [0, 100]
+
+        Outputs:
+            (array) [len(q), N_var] percentiles, linearly interpolated within
+                    bins (under/overflow bins span out to the extremes)
+        '''
+        q = np.atleast_1d(q)
+        N_var = len(self.lo)
+        lower = np.concatenate([np.minimum(self.min, self.lo)[:, None], self.edges], axis=1)
+        upper = np.concatenate([self.edges, np.maximum(self.max, self.hi)[:, None]], axis=1)
+        cum = np.cumsum(self.counts, axis=1)
+
+        out = np.empty((len(q), N_var))
+        for i, target in enumerate(q/100*self.count):
+            b = np.argmax(cum >= max(target, 1e-12), axis=1)
+            rows = np.arange(N_var)
+            before = cum[rows, b] - self.counts[rows, b]
+            frac = (target - before)/np.maximum(self.counts[rows, b], 1)
+            out[i] = lower[rows, b] + np.clip(frac, 0, 1)*(upper[rows, b] - lower[rows, b])
+        return np.clip(out, self.min, self.max)
+
+    ### Histogram of one variable
+    ### -------------------------
+    def histogram(self, var):
+        '''
+        Outputs:
+            (vector) counts per bin, (vector) bin edges
+        '''
+        return self.counts[var, 1:-1], self.edges[var]
+
+
+
+### ---------------------- ###
+### Worker Process Helpers ###
+### ---------------------- ###
+
+worker = {}
+
+def init_worker(assembly, specs, x0, options):
+    worker.update(assembly=assembly, specs=specs, x0=x0, \
+                  solver=NewtonSolver("newton", **options))
+
+### Draw and solve one chunk of samples
+### -----------------------------------
+def run_chunk(task):
+    seed, n = task
+    assembly, solver = worker["assembly"], worker["solver"]
+    rng = np.random.default_rng(seed)
+
+    ### Sampled parameter arrays [sample, element] per (type, param)
+    samples = []
+    for cls, param, k, nominal, tol, normal, relative in worker["specs"]:
+        values = np.tile(assembly.groups[cls].params[param], (n, 1))
+        draw = np.where(normal, rng.standard_normal((n, len(k))), \
+                        rng.uniform(-1, 1, (n, len(k))))
+        values[:, k] = nominal + draw*tol*np.where(relative, nominal, 1)
+        samples.append((assembly.groups[cls].params, param, values))
+
+    ### Batched solve with each entry's parameters swapped in
+    def swap(idx):
+        for params, param, values in samples:
+            params[param] = values[idx]
+
+    nominal = [(params, param, params[param]) for params, param, _ in samples]
+    try:
+        sol = solver.solve_batch( \
+            lambda X, idx: (swap(idx), assembly.residuals(X))[1], \
+            lambda X, idx: (swap(idx), assembly.jacobian(X))[1], \
+            np.tile(worker["x0"], (n, 1)), key=assembly.pattern)
+    finally:
+        for params, param, values in nominal:
+            params[param] = values
+
+    results = sol.x
+    results[~sol.success] = np.nan
+    return results
+
+### Start or extend the running summary
+### -----------------------------------
+def fold(summary, results, bins):
+    if summary is None:
+        ### Histogram range from the first chunk, padded for later tails
+        ok = np.all(np.isfinite(results), axis=1)
+        lo, hi = (np.min(results[ok], axis=0), np.max(results[ok], axis=0)) if np.any(ok) \
+                 else (np.zeros(results.shape[1]), np.ones(results.shape[1]))
+        pad = .5*(hi - lo) + 1e-9*np.maximum(np.abs(lo), 1)
+        summary = Summary(lo - pad, hi + pad, bins)
+    summary.update(results)
+    return summary
@@ -1,66 +1,333 @@
 '''
 Objects and methods for building lumped element mesh.
 
+Elements are numbered with integer IDs in breadth-first order from the
+source element, and nodes are numbered in the order they are discovered.
+Alongside the element/node object lists the network keeps compact
+CSR-style adjacency arrays:
+
+    el_ptr, el_nodes     = element -> node  (ports of element i are
+                           el_nodes[el_ptr[i]:el_ptr[i+1]])
+    node_ptr, node_els   = node -> element  (elements touching node j are
+                           node_els[node_ptr[j]:node_ptr[j+1]], the port
+                           used by each is in node_ports)
+
 Author(s):
     Samuel Cieselski
 
 '''
 
+from collections import deque
+from weakref import WeakSet
+import numpy as np
+
+
 
 class Network:
 
     ### Constructor
     ### -----------
     def __init__(self, source):
+        self.listeners = WeakSet() # objects notified of topology edits
         self.mesh(source)
-  
+
+    ### Listeners are process-local, so don't carry them through pickling
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["listeners"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.listeners = WeakSet()
+
     ### Meshing by breadth-first traversal
     ### ----------------------------------
     def mesh(self, source):
         ### Build network by BFS from source component
-        self.elements = [source]
+        self.elements = []
         self.nodes = []
-        
-        queue = [source]
+        self.index = {} # element -> integer element ID
+        self.free_elements = [] # IDs released by removals, reused first
+        self.free_nodes = []
+        self.add_element(source)
+
+        queue = deque([source])
         while queue:
-            
+            top = queue.popleft()
+
             # Parse through neighbors of element at queue top
-            for n, neighbor in enumerate(queue[0].neighbors):
-                
+            for n, neighbor in enumerate(top.neighbors):
+
                 # Case 1: boundaries (no neighbor present)
-                if neighbor is None: 
-                    self.update_boundary(queue[0], n)
-                    
-                # Case 2: neighbor is unaccounted for
-                elif neighbor not in self.elements:
-                    self.update_connection(queue[0], neighbor, n)
+                if neighbor is None:
+                    self.update_boundary(top, n)
 
+                # Case 2: neighbor is unaccounted for
+                elif neighbor not in self.index:
                     # push component to network and queue for further BFS
-                    self.elements.append(neighbor)
+                    self.add_element(neighbor)
+                    self.update_connection(top, neighbor, n)
                     queue.append(neighbor)
-                    
+
                 # Case 3: neighbor is accounted-for, but missing connection
-                elif queue[0].ports[n] is None: 
-                    self.update_connection(queue[0], neighbor, n)
+                elif top.ports[n] is None:
+                    self.update_connection(top, neighbor, n)
+
+        self.notify(set(range(len(self.elements))), set(range(len(self.nodes))))
+        self.build_adjacency()
 
-            queue.pop(0)
-            
     ### Meshing helper funcs
     ### --------------------
+    def add_element(self, element):
+        if self.free_elements:
+            element.id = self.free_elements.pop()
+            self.elements[element.id] = element
+        else:
+            element.id = len(self.elements)
+            self.elements.append(element)
+        element.ports = [None]*len(element.neighbors)
+        element.network = self
+        self.index[element] = element.id
+
+    def new_node(self, node):
+        if self.free_nodes:
+            j = self.free_nodes.pop()
+            self.nodes[j] = node
+        else:
+            j = len(self.nodes)
+            self.nodes.append(node)
+        return j
+
     def update_boundary(self, top, n):
-        self.nodes.append(Boundary())
-        top.ports[n] = len(self.nodes) - 1
+        top.ports[n] = self.new_node(Boundary())
 
     def update_connection(self, top, neighbor, n):
         # Build connection to neighbor
-        self.nodes.append(Connection())
-        top.ports[n] = len(self.nodes) - 1
+        top.ports[n] = self.new_node(Connection())
 
         # Build connection from neighbor
-        for m, second_neighbor in enumerate(neighbor.neighbors):
-            if second_neighbor is top:
-                neighbor.ports[m] = len(self.nodes) - 1
-                    
+        neighbor.ports[top.neighbor_ports[n]] = top.ports[n]
+
+
+
+    ### ---------------------- ###
+    ### Incremental Re-meshing ###
+    ### ---------------------- ###
+    ###
+    ### Edits touch only the ports of the edited elements and the nodes
+    ### between them. Node and element numbers are kept wherever the
+    ### node survives the edit, and released numbers are handed out again
+    ### by the next insertion. Listeners (e.g. a Model) are told which
+    ### elements and nodes changed through network_changed().
+
+
+    ### Insert element(s) already tied to elements in the network
+    ### ----------------------------------------------------------
+    def insert(self, element):
+        if element in self.index:
+            raise Exception(element.name + " is already in the network.")
+
+        ### BFS over any new elements reachable from the inserted one
+        changed_elements, changed_nodes = set(), set()
+        self.add_element(element)
+        queue = deque([element])
+        while queue:
+            top = queue.popleft()
+            changed_elements.add(top.id)
+
+            for n, neighbor in enumerate(top.neighbors):
+                # Open port
+                if neighbor is None:
+                    self.update_boundary(top, n)
+
+                # Existing element: its boundary node becomes the connection
+                elif neighbor in self.index and top.ports[n] is None and \
+                     neighbor.ports[top.neighbor_ports[n]] is not None:
+                    j = neighbor.ports[top.neighbor_ports[n]]
+                    self.nodes[j] = Connection()
+                    top.ports[n] = j
+                    changed_elements.add(neighbor.id)
+
+                # New element
+                elif neighbor not in self.index:
+                    self.add_element(neighbor)
+                    self.update_connection(top, neighbor, n)
+                    queue.append(neighbor)
+
+                # New element found from both sides
+                elif top.ports[n] is None:
+                    self.update_connection(top, neighbor, n)
+
+                changed_nodes.add(top.ports[n])
+
+        self.notify(changed_elements, changed_nodes)
+
+
+    ### Remove element, leaving its neighbors with boundary nodes
+    ### ---------------------------------------------------------
+    def remove(self, element):
+        i = self.index.pop(element)
+        changed_elements, changed_nodes = {i}, set()
+
+        for n, j in enumerate(element.ports):
+            neighbor = element.neighbors[n]
+            changed_nodes.add(j)
+
+            # Connection is kept as the neighbor's new boundary
+            if neighbor is not None:
+                self.nodes[j] = Boundary()
+                changed_elements.add(neighbor.id)
+
+            # Boundary node is released
+            else:
+                self.nodes[j] = None
+                self.free_nodes.append(j)
+
+        element.unlink()
+        element.ports = [None]*len(element.ports)
+        element.id = None
+        element.network = None
+        self.elements[i] = None
+        self.free_elements.append(i)
+
+        self.notify(changed_elements, changed_nodes)
+
+
+    ### Swap an element for another with the same number of ports
+    ### ---------------------------------------------------------
+    def replace(self, old, new):
+        if len(old.ports) != len(new.ports):
+            raise Exception("Replacement element must have the same number of ports.")
+
+        i = self.index.pop(old)
+
+        ### Take over neighbors
+        for n, neighbor in enumerate(old.neighbors):
+            if neighbor is not None:
+                m = old.neighbor_ports[n]
+                neighbor.neighbors[m] = new
+            new.neighbors[n] = neighbor
+            new.neighbor_ports[n] = old.neighbor_ports[n]
+
+        ### Take over ID and nodes
+        new.id, new.ports, new.network = i, old.ports, self
+        self.index[new] = i
+        self.elements[i] = new
+
+        old.neighbors = [None]*len(old.neighbors)
+        old.neighbor_ports = [None]*len(old.neighbors)
+        old.ports = [None]*len(old.neighbors)
+        old.id = None
+        old.network = None
+
+        self.notify({i}, set())
+
+
+    ### Tie two open ports of elements in the network together
+    ### ------------------------------------------------------
+    def tie(self, a, a_index, b, b_index):
+        if a.neighbors[a_index] is not None or b.neighbors[b_index] is not None:
+            raise Exception("Both ports must be open boundaries to be tied.")
+
+        ### a's boundary becomes the connection, b's boundary is released
+        j, k = a.ports[a_index], b.ports[b_index]
+        a.tie_in(b, a_index, b_index)
+        self.nodes[j] = Connection()
+        self.nodes[k] = None
+        self.free_nodes.append(k)
+        b.ports[b_index] = j
+
+        self.notify({a.id, b.id}, {j, k})
+
+
+    ### Split a connection into two boundaries
+    ### --------------------------------------
+    def untie(self, a, a_index):
+        b, b_index = a.neighbors[a_index], a.neighbor_ports[a_index]
+        if b is None:
+            raise Exception("Port is not connected.")
+
+        ### a keeps the node, b gets a new boundary node
+        j = a.ports[a_index]
+        a.neighbors[a_index] = a.neighbor_ports[a_index] = None
+        b.neighbors[b_index] = b.neighbor_ports[b_index] = None
+        self.nodes[j] = Boundary()
+        self.update_boundary(b, b_index)
+
+        self.notify({a.id, b.id}, {j, b.ports[b_index]})
+
+
+    ### Fill numbering holes left by removals
+    ### -------------------------------------
+    def compact(self):
+        ### Move highest live numbers into holes so only they are renumbered
+        node_map = compact_list(self.nodes, self.free_nodes)
+        element_map = compact_list(self.elements, self.free_elements)
+        if node_map is None and element_map is None:
+            return
+
+        ### Apply renumbering
+        for element in self.elements:
+            if element_map is not None:
+                element.id = self.index[element] = int(element_map[element.id])
+            if node_map is not None:
+                element.ports = [int(node_map[j]) for j in element.ports]
+
+        self.notify(set(), set(), node_map=node_map, element_map=element_map)
+
+
+    ### Rebuild adjacency arrays after edits
+    ### ------------------------------------
+    def refresh(self):
+        if self.adjacency_stale:
+            self.build_adjacency()
+
+
+    ### Tell listeners about an edit
+    ### ----------------------------
+    def notify(self, elements, nodes, node_map=None, element_map=None):
+        self.adjacency_stale = True
+        for listener in list(self.listeners):
+            listener.network_changed(elements, nodes, node_map, element_map)
+
+    ### Compact adjacency arrays
+    ### ------------------------
+    def build_adjacency(self):
+        self.compact()
+        self.adjacency_stale = False
+
+        ### Element -> node
+        num_ports = np.array([len(el.ports) for el in self.elements], dtype=np.int64)
+        self.el_ptr = np.zeros(len(self.elements) + 1, dtype=np.int64)
+        np.cumsum(num_ports, out=self.el_ptr[1:])
+        self.el_nodes = np.fromiter((p for el in self.elements for p in el.ports), \
+                                    dtype=np.int64, count=self.el_ptr[-1])
+
+        ### Node -> element (ports sorted by node, stable in element order)
+        slot_els = np.repeat(np.arange(len(self.elements), dtype=np.int64), num_ports)
+        slot_ports = np.arange(self.el_ptr[-1], dtype=np.int64) - self.el_ptr[slot_els]
+        order = np.argsort(self.el_nodes, kind="stable")
+        self.node_els = slot_els[order]
+        self.node_ports = slot_ports[order]
+        self.node_ptr = np.zeros(len(self.nodes) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.el_nodes, minlength=len(self.nodes)), \
+                  out=self.node_ptr[1:])
+
+        ### Node type mask
+        self.is_boundary = np.fromiter((isinstance(node, Boundary) for node in self.nodes), \
+                                       dtype=bool, count=len(self.nodes))
+
+    ### Adjacency lookups
+    ### -----------------
+    def element_nodes(self, i):
+        self.refresh()
+        return self.el_nodes[self.el_ptr[i]:self.el_ptr[i+1]]
+
+    def node_elements(self, j):
+        self.refresh()
+        return self.node_els[self.node_ptr[j]:self.node_ptr[j+1]]
+
     ### Qualitative mesh checks
     ### -----------------------
     def mesh_checks(self):
@@ -68,26 +335,29 @@ class Network:
         connections = []
         boundaries = []
         for n, node in enumerate(self.nodes):
+            if node is None: continue
             if isinstance(node, Connection):
                 connections.append(n)
-            elif isinstance(node, Boundary): 
+            elif isinstance(node, Boundary):
                 boundaries.append(n)
-                
+
         print("Bulk nodes:", connections)
         print("Boundary nodes:", boundaries)
-              
+
         ### List all nodes by element
         print("\nNodes by element: ")
         print("-----------------")
         for i, element in enumerate(self.elements):
-            print(element.name+":", element.ports) 
-            
+            if element is None: continue
+            print(element.name+":", element.ports)
+
         ### List all neighbors of each element
         print("\nNeighbors by element: ")
         print("---------------------")
         for i, element in enumerate(self.elements):
+            if element is None: continue
             print(element.name+":")
-            for n, neighbor in enumerate(element.neighbors): 
+            for n, neighbor in enumerate(element.neighbors):
                 if neighbor is None: name = "Boundary"
                 else: name = neighbor.name
                 print("   Port "+str(n)+":", name)
@@ -97,36 +367,84 @@ class Network:
 ### ------------------------- ###
 ### Lumped Element Base Class ###
 ### ------------------------- ###
-                        
-class Element:    
-    
+
+class Element:
+
     ### Base constructor
     def __init__(self, name, num_ports):
         self.name = name
+        self.id = None
+        self.network = None
+        self.fluid = None # working fluid, if different from the model's
         self.neighbors = [None]*num_ports
+        self.neighbor_ports = [None]*num_ports # port index on the neighbor's side
         self.ports = [None]*num_ports
-          
+
     ### Connect two elements
     def tie_in(self, new_element, self_index, new_index):
         self.neighbors[self_index] = new_element
+        self.neighbor_ports[self_index] = new_index
         new_element.neighbors[new_index] = self
+        new_element.neighbor_ports[new_index] = self_index
 
     ### Remove component from network
     def remove(self):
+        if self.network is not None:
+            self.network.remove(self)
+        else:
+            self.unlink()
+
+    ### Drop all ties to neighbors
+    def unlink(self):
         # Parsing through neighbors
         for n in range(len(self.neighbors)):
-            
+            if self.neighbors[n] is None: continue
+
             # Removing self from neighbor's neighbors
-            for i in range(len(self.neighbors[n].neighbors)):
-                
-                if self.neighbors[n].neighbors[i] == self:
-                    self.neighbors[n].neighbors[i] = None
-            
+            m = self.neighbor_ports[n]
+            self.neighbors[n].neighbors[m] = None
+            self.neighbors[n].neighbor_ports[m] = None
+
             # Removing neighbors
             self.neighbors[n] = None
+            self.neighbor_ports[n] = None
+
+
+
+### Fill holes in a list with its last live entries
+### -------------------------------------------------
+def compact_list(items, free):
+    '''
+    Inputs:
+        items = (list) objects with None marking released slots
+        free  = (list) released indices, emptied in place
+
+    Outputs:
+        old -> new index map (array), or None if there were no holes
+    '''
+    if not free:
+        return None
+
+    index_map = np.arange(len(items), dtype=np.int64)
+    holes = sorted(free)
+    free.clear()
+    while holes:
+        # drop released entries at the end of the list
+        while items and items[-1] is None:
+            items.pop()
+            if holes and holes[-1] == len(items): holes.pop()
+        if not holes:
+            break
+
+        # move last entry into lowest hole
+        h = holes.pop(0)
+        index_map[len(items)-1] = h
+        items[h] = items.pop()
+
+    return index_map
+
 
 
-            
 ### ------------------------------- ###
 ### Node Base Class and Sub-classes ###
 ### ------------------------------- ###
@@ -134,7 +452,7 @@ class Element:
 class Node:
     def __init__(self):
         ...
-        
+
 class Connection(Node):
     def __init__(self):
         ...
@@ -142,6 +460,6 @@ class Connection(Node):
 class Boundary(Node):
     def __init__(self):
         ...
-        
-        
-    
\ No newline at end of file
+
+
+
@@ -86,7 +86,7 @@ class Orifice(Element):
     ### Pull quadratic damping load
     ### ---------------------------
     def dP_damping(self, mdot_tot, rho):
-        return self.Ko * (mdot_tot/self.N)**2 / (2*self.Ao**2 * rho) # [Pa]
+        return self.Ko * (mdot_tot/self.N)*abs(mdot_tot/self.N) / (2*self.Ao**2 * rho) # [Pa]
 
     ### Pull volume load
     ### ----------------
@@ -95,21 +95,60 @@ class Orifice(Element):
 
     ### Pull steady flow equations
     ### --------------------------
-    def steady_flow_eqns(self, statevars, N_sv, rho):
+    def steady_flow_eqns(self, statevars, N_sv, rho, mu):
         ### Relevant state variables
         P_1 = statevars[self.ports[0]]
         P_2 = statevars[self.ports[1]]
-        mdot_1 = statevars[N_sv/2 + self.ports[0]]
-        mdot_2 = statevars[N_sv/2 + self.ports[1]]
+        mdot_1 = statevars[N_sv//2 + self.ports[0]]
+        mdot_2 = statevars[N_sv//2 + self.ports[1]]
         
         return [
             # Steady-state momentum equation
-            P_2 - P_1 - self.dP_damping(mdot_1, rho),
+            P_1 - P_2 - self.dP_damping(mdot_1, rho),
             
             # Mass continuity equation
-            mdot_2 - mdot_1
+            mdot_1 - mdot_2
         ]
 
+    ### ------------------------ ###
+    ### Vectorized Group Kernels ###
+    ### ------------------------ ###
+
+    ### Pack parameters of many orifice plates into arrays
+    ### --------------------------------------------------
+    @staticmethod
+    def pack(elements):
+        for el in elements:
+            if not hasattr(el, "Knet"):
+                raise Exception("Orifice " + el.name + " has no K-factor. " \
+                                "Assign one with set_Ko or set_Knet.")
+        return {
+            "do": np.array([el.do for el in elements], dtype=float),
+            "Knet": np.array([el.Knet for el in elements], dtype=float),
+            "lo": np.array([el.lo for el in elements], dtype=float),
+        }
+
+    ### Inertance over arrays of orifice plates
+    ### ---------------------------------------
+    @staticmethod
+    def inertance(p, rho):
+        # per unit mass flow rate, I(rho)/rho
+        return p["lo"]/(pi*p["do"]**2/4)
+
+    ### Quadratic damping load over arrays of orifice plates
+    ### ----------------------------------------------------
+    @staticmethod
+    def loss(p, mdot, rho, mu):
+        Ao = pi*p["do"]**2/4
+        return p["Knet"] * mdot*np.abs(mdot) / (2*Ao**2 * rho)
+
+    ### Flow derivative of damping load over arrays of orifice plates
+    ### -------------------------------------------------------------
+    @staticmethod
+    def loss_jacobian(p, mdot, rho, mu):
+        Ao = pi*p["do"]**2/4
+        return p["Knet"] * np.abs(mdot) / (Ao**2 * rho)
+
 ### -------------------------- ###
 ### Flow Resistance Estimation ###
 ### -------------------------- ###
@@ -27,7 +27,8 @@ class Pipe(Element):
 
     ### Constructor
     ### -----------
-    def __init__(self, name, l, Dh, epsilon, r_bend=None, a_bend=None, model="analytical"):
+    def __init__(self, name, l, Dh, epsilon, r_bend=None, a_bend=None, model="analytical", \
+                 a=None):
         '''
         Inputs:
             name    = (string) component ID, part number, etc.
@@ -37,6 +38,8 @@ class Pipe(Element):
             r_bend  = (vector) [m] pipe bend radii
             a_bend  = (vector) [deg] pipe bend angles
             A       = (scalar) [m^2] cross-sectional flow area
+            a       = (scalar) [m/s] wave speed in the line (fluid and wall
+                      elasticity), None for an incompressible line
         '''
 
         super().__init__(name, 2) # call parent class constructor
@@ -48,6 +51,7 @@ class Pipe(Element):
         self.r_bend = r_bend
         self.a_bend = a_bend
         self.A = pi*Dh**2/4
+        self.a = a
         
         ### Data for empirical flow resistance estimation
         self.Re_data = None
@@ -75,17 +79,28 @@ class Pipe(Element):
         return rho * self.l/self.A 
     
     
+    ### Pull compliance
+    ### ---------------
+    def C(self, rho):
+        if self.a is None: return 0
+        return self.A*self.l / self.a**2 # [kg/Pa]
+    
+    
     ### Pull quadratic damping load
     ### ---------------------------
     def dP_damping(self, mdot, rho, mu):
         ### Reynold's number at current flowrate
-        Re = rho * mdot * self.Dh / (mu * self.A)
+        Re = abs(mdot) * self.Dh / (mu * self.A)
+
+        ### Laminar case (linear in mdot, well-behaved at zero flow)
+        if Re < 2100: 
+            return 32 * mu * self.l * mdot / (rho * self.A * self.Dh**2)
 
         ### Darcy friction factor
-        f = self.f_colebrook_white(self.Dh, self.epsilon, Re)
+        f = f_colebrook_white(self.Dh, self.epsilon, Re)
 
         ### Friction/viscous resistance
-        return f * self.l/self.Dh
+        return f * self.l/self.Dh * mdot*abs(mdot) / (2*rho*self.A**2)
     
     
     ### Plot Moody diagram curve
@@ -95,9 +110,7 @@ class Pipe(Element):
         Re = np.logspace(1, 10e8, 100)
 
         ### Calc friction factors
-        f = np.array(len(Re))
-        for i in range(len(Re)):
-            f[i] = f_colebrook_white(Dh, epsilon, Re[i], N)
+        f = f_colebrook_white(self.Dh, self.epsilon, Re)
             
         ### Plotstuff
         ... # (TODO)
@@ -111,47 +124,181 @@ class Pipe(Element):
         
     ### Pull steady flow equations
     ### --------------------------
-    def steady_flow_eqns(self, statevars, N_sv, rho):
+    def steady_flow_eqns(self, statevars, N_sv, rho, mu):
         ### Relevant state variables
         P_1 = statevars[self.ports[0]]
         P_2 = statevars[self.ports[1]]
-        mdot_1 = statevars[N_sv/2 + self.ports[0]]
-        mdot_2 = statevars[N_sv/2 + self.ports[1]]
+        mdot_1 = statevars[N_sv//2 + self.ports[0]]
+        mdot_2 = statevars[N_sv//2 + self.ports[1]]
         
         return [
             # Steady-state momentum equation
-            P_2 - P_1 - self.dP_damping(mdot_1, rho) - self.dP_body(rho),
+            P_1 - P_2 - self.dP_damping(mdot_1, rho, mu) - self.dP_body(rho),
             
             # Mass continuity equation
-            mdot_2 - mdot_1
+            mdot_1 - mdot_2
         ]
 
+
+    ### ------------------------ ###
+    ### Vectorized Group Kernels ###
+    ### ------------------------ ###
+    
+    
+    ### Pack parameters of many pipes into arrays
+    ### -----------------------------------------
+    @staticmethod
+    def pack(elements):
+        return {
+            "l": np.array([el.l for el in elements], dtype=float),
+            "Dh": np.array([el.Dh for el in elements], dtype=float),
+            "epsilon": np.array([el.epsilon for el in elements], dtype=float),
+            "a": np.array([np.inf if el.a is None else el.a for el in elements], dtype=float),
+        }
+    
+    
+    ### Inertance and compliance over arrays of pipes
+    ### ---------------------------------------------
+    @staticmethod
+    def inertance(p, rho):
+        # per unit mass flow rate, I(rho)/rho
+        return p["l"]/(pi*p["Dh"]**2/4)
+    
+    @staticmethod
+    def compliance(p, rho):
+        return pi*p["Dh"]**2/4 * p["l"] / p["a"]**2
+    
+    
+    ### Distributed-parameter transfer matrix over arrays of pipes
+    ### ---------------------------------------------------------
+    @staticmethod
+    def transfer_matrix(p, omega, mdot, rho, mu):
+        '''
+        Exact solution of the linearized, damped wave equation along the
+        line, relating inlet to outlet perturbation amplitudes
+        
+            [dP_1, dmdot_1] = T [dP_2, dmdot_2]
+            
+            T = [ cosh(gamma l)       Zc sinh(gamma l) ]
+                [ sinh(gamma l)/Zc    cosh(gamma l)    ]
+                
+        with series impedance Z' = R' + i omega/A and shunt admittance
+        Y' = i omega A/a^2 per unit length, gamma = sqrt(Z'Y') and
+        Zc = sqrt(Z'/Y'). R' is the steady-flow damping derivative per unit
+        length. Lines without a wave speed reduce to T = [[1, Z'l], [0, 1]].
+        
+        Inputs:
+            omega = (vector) [rad/s] frequencies
+            mdot  = (vector) [kg/s] steady flow rate per pipe
+            
+        Outputs:
+            (array) [frequency, 2, 2, pipe] transfer matrices
+        '''
+        A = pi*p["Dh"]**2/4
+        w = np.asarray(omega, dtype=float)[:, None]
+        Z = Pipe.loss_jacobian(p, mdot, rho, mu)/p["l"] + 1j*w/A
+        Y = 1j*w*A/p["a"]**2
+        
+        ### Small gamma l (incl. incompressible lines) by series, else exact
+        gl = np.sqrt(Z*Y + 0j)*p["l"]
+        small = np.abs(gl) < 1e-4
+        gl_safe = np.where(small, 1, gl)
+        cosh = np.where(small, 1 + gl**2/2, np.cosh(gl_safe))
+        sinhc = np.where(small, 1 + gl**2/6, np.sinh(gl_safe)/gl_safe) # sinh(x)/x
+        
+        T = np.empty(w.shape[:1] + (2, 2) + np.shape(p["l"]), dtype=complex)
+        T[:, 0, 0] = T[:, 1, 1] = cosh
+        T[:, 0, 1] = Z*p["l"]*sinhc
+        T[:, 1, 0] = Y*p["l"]*sinhc
+        return T
+    
+    
+    ### Quadratic damping load over arrays of pipes
+    ### -------------------------------------------
+    @staticmethod
+    def loss(p, mdot, rho, mu):
+        A = pi*p["Dh"]**2/4
+        Re = np.abs(mdot) * p["Dh"] / (mu * A)
+        
+        ### Laminar branch
+        dP = 32 * mu * p["l"] * mdot / (rho * A * p["Dh"]**2)
+        
+        ### Turbulent branch
+        turb = Re >= 2100
+        if np.any(turb):
+            Dh, l, eps, A = (np.broadcast_to(v, Re.shape)[turb] \
+                             for v in (p["Dh"], p["l"], p["epsilon"], A))
+            rho_t = np.broadcast_to(rho, Re.shape)[turb]
+            f = _f_turbulent(Dh, eps, Re[turb])
+            m = mdot[turb]
+            dP[turb] = f * l/Dh * m*np.abs(m) / (2*rho_t*A**2)
+        
+        return dP
+    
+    
+    ### Flow derivative of damping load over arrays of pipes
+    ### ----------------------------------------------------
+    @staticmethod
+    def loss_jacobian(p, mdot, rho, mu):
+        A = pi*p["Dh"]**2/4
+        Re = np.abs(mdot) * p["Dh"] / (mu * A)
+        
+        ### Laminar branch (constant resistance)
+        ddP = np.broadcast_to(32 * mu * p["l"] / (rho * A * p["Dh"]**2), Re.shape).copy()
+        
+        ### Turbulent branch: d/dmdot [f(Re) mdot|mdot|] = |mdot| (2f + Re df/dRe)
+        turb = Re >= 2100
+        if np.any(turb):
+            Dh, l, eps, A = (np.broadcast_to(v, Re.shape)[turb] \
+                             for v in (p["Dh"], p["l"], p["epsilon"], A))
+            rho_t = np.broadcast_to(rho, Re.shape)[turb]
+            f, df = _f_turbulent(Dh, eps, Re[turb], derivative=True)
+            ddP[turb] = l/Dh * np.abs(mdot[turb]) * (2*f + Re[turb]*df) / (2*rho_t*A**2)
+        
+        return ddP
+
 ### ------------------------- ###
 ### Fricton Factor Estimation ###
 ### ------------------------- ###
 
 ### Colebrook-White formula (iterative)
 ### -----------------------------------
-def f_colebrook_white(Dh, epsilon, Re, N=4):
+def f_colebrook_white(Dh, epsilon, Re, tol=1e-12, maxiter=20):
     '''
     Inputs:
-        Dh = [m] pipe equivalent/hydralic diameter
-        epsilon = [m] surface roughness
-        Re = Reynold's number
-        N = number of iterations
+        Dh      = (array) [m] pipe equivalent/hydralic diameter
+        epsilon = (array) [m] surface roughness
+        Re      = (array) Reynold's number
+        tol     = (scalar) relative change in 1/sqrt(f) at convergence
+        maxiter = (int) most Newton iterations
+
+    Outputs:
+        (array) Darcy friction factor, broadcast over the inputs
     '''
-
-    ### Laminar case
-    if Re < 2100: return 64/Re
-
-    ### Initial guesss
-    f = .05
-
-    ### Colebrook-White equation with N iterations
-    for _ in range(N): 
-        f = (2*log10(epsilon/(3.7*Dh) + 2.51/(Re*sqrt(f))))**-2 
+    return _f_masked(_f_turbulent, Dh, epsilon, Re, tol=tol, maxiter=maxiter)
+
+
+### Colebrook-White over arrays of turbulent points
+### ------------------------------------------------
+def _f_turbulent(Dh, epsilon, Re, tol=1e-12, maxiter=20, derivative=False):
+    ### Newton on x = 1/sqrt(f):  g(x) = x + 2 log10(a + b x) = 0
+    a = epsilon/(3.7*Dh)
+    b = 2.51/Re
+    x = -2*np.log10(a + 5.74/Re**.9) # Swamee-Jain start, within a few percent
+    for _ in range(maxiter):
+        u = a + b*x
+        dx = (x + 2*np.log10(u))/(1 + 2*b/(np.log(10)*u))
+        x = x - dx
+        if np.all(np.abs(dx) <= tol*np.abs(x)):
+            break
+    f = x**-2
+    if not derivative:
+        return f
     
-    return f
+    ### df/dRe by implicit differentiation of 1/sqrt(f) = -2 log10(a + b/(Re sqrt(f)))
+    g = 2/(np.log(10)*(a + b*x))
+    dx = g*2.51*x / (Re**2 * (1 + g*b))
+    return f, -2*dx/x**3
 
 
 ### Churchill's formula (explicit)
@@ -159,15 +306,32 @@ def f_colebrook_white(Dh, epsilon, Re, N=4):
 def f_churchill(Dh, epsilon, Re):
     '''
     Inputs:
-        dh      = [m] pipe equivalent/hydralic diameter
-        epsilon = [m] surface roughness
-        Re      = Reynold's number
+        Dh      = (array) [m] pipe equivalent/hydralic diameter
+        epsilon = (array) [m] surface roughness
+        Re      = (array) Reynold's number
+
+    Outputs:
+        (array) Darcy friction factor, broadcast over the inputs
     '''
-    
-    ### Laminar case
-    if Re < 2100: return 64/Re
+    return _f_masked(_f_churchill, Dh, epsilon, Re)
+
+def _f_churchill(Dh, epsilon, Re):
+    return (2*np.log10(epsilon/(3.7*Dh) + (7/Re)**.9))**-2
+
 
-    return (2*log10(epsilon/(3.7*Dh) + (7/Re)**.9))**-2
+### Laminar/turbulent masking
+### -------------------------
+def _f_masked(f_turbulent, Dh, epsilon, Re, **options):
+    ### 64/Re below Re = 2100, f_turbulent over the rest; scalars in, scalar out
+    Dh, epsilon, Re = np.broadcast_arrays(*(np.asarray(v, dtype=float) for v in (Dh, epsilon, Re)))
+    f = np.empty(Re.shape)
+    lam = Re < 2100
+    with np.errstate(divide="ignore"):
+        f[lam] = 64/Re[lam]
+    turb = ~lam
+    if np.any(turb):
+        f[turb] = f_turbulent(Dh[turb], epsilon[turb], Re[turb], **options)
+    return f[()] if f.ndim == 0 else f
 
 
 ### Generate Moody Diagram
@@ -191,19 +355,14 @@ def moody(method="Colebrook-White", epsilon_vec=None):
         epsilon_vec = [5e-2, 4e-2, 3e-2, 2e-2, 1e-2, 5e-3, 2e-3, 1e-3, \
                        5e-4, 2e-4, 1e-4, 5e-5, 1e-5, 5e-6, 1e-6, 1e-7]
 
-    ### Preallocate
+    ### Reynold's numbers
     Re = np.logspace(2, 9, num=100)
-    f = np.zeros(100)
 
-    ### Reference diameter ratios by exit diameter
-    
-    ### Calculate loss coefficients and plot
+    ### Calculate friction factors over the whole diagram at once and plot
+    f = f_func(1, np.asarray(epsilon_vec)[:, None], Re)
     fig, ax = plt.subplots()
-    for epsilon in epsilon_vec:  # skip do=0
-        for i in range(100):
-            f[i] = f_func(1, epsilon, Re[i])
-                
-        plt.plot(Re, f, label=f"$relative roughness$={epsilon}") 
+    for epsilon, f_curve in zip(epsilon_vec, f):
+        plt.plot(Re, f_curve, label=f"$relative roughness$={epsilon}") 
     
     ### Decorate
     plt.title("Moody Diagram via " + method + " Formula")
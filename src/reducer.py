@@ -42,6 +42,8 @@ class Reducer(Element):
         self.L = L
         self.a = a
         self.epsilon = epsilon
+        self.Dh = (D1 + D2)/2 # midpoint diameter
+        self.A = pi*self.Dh**2/4
         
         
         
@@ -69,13 +71,17 @@ class Reducer(Element):
     ### ---------------------------
     def dP_damping(self, mdot, rho, mu):
         ### Reynold's number at current flowrate
-        Re = rho * mdot * self.Dh / (mu * self.A)
+        Re = abs(mdot) * self.Dh / (mu * self.A)
+        
+        ### Laminar case
+        if Re < 2100:
+            return 32 * mu * self.L * mdot / (rho * self.A * self.Dh**2)
         
         ### Darcy friction factor
-        f = self.f_colebrook_white(self.Dh, self.epsilon, Re)
+        f = pipe.f_colebrook_white(self.Dh, self.epsilon, Re)
 
         ### Friction/viscous resistance
-        return f * self.L/self.Dh
+        return f * self.L/self.Dh * mdot*abs(mdot) / (2*rho*self.A**2)
     
         
     ### Pull body load
@@ -86,17 +92,56 @@ class Reducer(Element):
         
     ### Pull steady flow equations
     ### --------------------------
-    def steady_flow_eqns(self, statevars, N_sv, rho):
+    def steady_flow_eqns(self, statevars, N_sv, rho, mu):
         ### Relevant state variables
         P_1 = statevars[self.ports[0]]
         P_2 = statevars[self.ports[1]]
-        mdot_1 = statevars[N_sv/2 + self.ports[0]]
-        mdot_2 = statevars[N_sv/2 + self.ports[1]]
+        mdot_1 = statevars[N_sv//2 + self.ports[0]]
+        mdot_2 = statevars[N_sv//2 + self.ports[1]]
         
         return [
             # Steady-state momentum equation
-            P_2 - P_1 - self.dP_damping(mdot_1, rho) - self.dP_body(rho),
+            P_1 - P_2 - self.dP_damping(mdot_1, rho, mu) - self.dP_body(rho),
             
             # Mass continuity equation
-            mdot_2 - mdot_1
-        ]
\ No newline at end of file
+            mdot_1 - mdot_2
+        ]
+        
+        
+    ### ------------------------ ###
+    ### Vectorized Group Kernels ###
+    ### ------------------------ ###
+    
+    
+    ### Pack parameters of many reducers into arrays
+    ### --------------------------------------------
+    @staticmethod
+    def pack(elements):
+        return {
+            "L": np.array([el.L for el in elements], dtype=float),
+            "Dh": np.array([el.Dh for el in elements], dtype=float),
+            "epsilon": np.array([el.epsilon for el in elements], dtype=float),
+        }
+    
+    
+    ### Inertance over arrays of reducers
+    ### --------------------------------
+    @staticmethod
+    def inertance(p, rho):
+        return p["L"]/(pi*p["Dh"]**2/4) # midpoint area, per unit mass flow rate
+    
+    
+    ### Quadratic damping load over arrays of reducers
+    ### ----------------------------------------------
+    @staticmethod
+    def loss(p, mdot, rho, mu):
+        return pipe.Pipe.loss({"l": p["L"], "Dh": p["Dh"], "epsilon": p["epsilon"]}, \
+                              mdot, rho, mu)
+    
+    
+    ### Flow derivative of damping load over arrays of reducers
+    ### -------------------------------------------------------
+    @staticmethod
+    def loss_jacobian(p, mdot, rho, mu):
+        return pipe.Pipe.loss_jacobian({"l": p["L"], "Dh": p["Dh"], "epsilon": p["epsilon"]}, \
+                                       mdot, rho, mu)
\ No newline at end of file
@@ -0,0 +1,529 @@
+'''
+Series-chain and parallel-branch reduction of fluid circuits.
+
+Long runs of two-port loss elements (pipes, orifices, reducers) joined
+only by internal connection nodes are collapsed into single equivalent
+two-ports (Chain elements). Pairs of identical branches that split at one
+tee and rejoin at another are folded into one branch carrying the
+combined flow, and the two tees drop out. Both passes repeat until
+nothing changes, so ladders of identical injector branches fold down to a
+single chain.
+
+The reduced circuit is solved as an ordinary Model. Internal node
+pressures and flow rates are then recovered from the cumulative pressure
+drops along each chain.
+
+The reduction is exact: a chain's damping load is the signed sum of its
+members' loads at their share of the chain flow, not a fitted quadratic,
+so the recovered solution satisfies the full system.
+
+Author(s):
+    Samuel Ciesielski
+
+'''
+
+import copy
+from collections import deque
+import numpy as np
+from network import Network, Element
+from tee import Tee
+
+
+
+### --------------------------- ###
+### Equivalent Two-port Element ###
+### --------------------------- ###
+
+class Chain(Element):
+
+    ### Constructor
+    ### -----------
+    def __init__(self, name, steps, properties):
+        '''
+        Inputs:
+            name       = (string) component ID
+            steps      = (list) (element, sign, weight) of each member in
+                         flow order. A member carries weight*mdot of the
+                         chain flow and its load counts with sign (-1 for
+                         members tied in backwards)
+            properties = (function) element -> (rho, mu)
+        '''
+        super().__init__(name, 2)
+
+        ### Members
+        self.members = [el for el, _, _ in steps]
+        self.signs = np.array([s for _, s, _ in steps], dtype=float)
+        self.weights = np.array([w for _, _, w in steps], dtype=float)
+        props = np.array([properties(el) for el in self.members], dtype=float)
+        self.rho_members, self.mu_members = props[:, 0], props[:, 1]
+        self.fluid = next((el.fluid for el in self.members if el.fluid is not None), None)
+
+
+    ### Pull inertance
+    ### --------------
+    def I(self, rho=None):
+        # members use their own fluid density
+        return sum(s*w*el.I(r) for el, s, w, r in \
+                   zip(self.members, self.signs, self.weights, self.rho_members))
+
+
+    ### Pull damping load
+    ### -----------------
+    def dP_damping(self, mdot, rho=None, mu=None):
+        return Chain.loss(Chain.pack([self]), np.array([mdot], dtype=float), rho, mu)[0]
+
+
+    ### Pull steady flow equations
+    ### --------------------------
+    def steady_flow_eqns(self, statevars, N_sv, rho, mu):
+        ### Relevant state variables
+        P_1 = statevars[self.ports[0]]
+        P_2 = statevars[self.ports[1]]
+        mdot_1 = statevars[N_sv//2 + self.ports[0]]
+        mdot_2 = statevars[N_sv//2 + self.ports[1]]
+
+        return [
+            # Steady-state momentum equation
+            P_1 - P_2 - self.dP_damping(mdot_1),
+
+            # Mass continuity equation
+            mdot_1 - mdot_2
+        ]
+
+
+    ### ------------------------ ###
+    ### Vectorized Group Kernels ###
+    ### ------------------------ ###
+
+
+    ### Pack members of many chains into per-type arrays
+    ### ------------------------------------------------
+    @staticmethod
+    def pack(elements):
+        '''
+        Members are numbered chain by chain ("start" is the first member of
+        each chain) and grouped by type for the member kernels.
+        '''
+        by_type = {}
+        start = np.zeros(len(elements), dtype=np.int64)
+        pos = 0
+        for c, el in enumerate(elements):
+            start[c] = pos
+            for entry in zip(el.members, el.signs, el.weights, \
+                             el.rho_members, el.mu_members):
+                by_type.setdefault(type(entry[0]), []).append((c, pos) + entry)
+                pos += 1
+
+        members = []
+        for cls, entries in by_type.items():
+            chain, index, els, sign, weight, rho, mu = zip(*entries)
+            members.append((cls, cls.pack(list(els)), np.array(chain), np.array(index), \
+                            np.array(sign), np.array(weight), np.array(rho), np.array(mu)))
+
+        return {"start": start, "N_members": pos, "members": members}
+
+
+    ### Signed member loads over arrays of chains
+    ### -----------------------------------------
+    @staticmethod
+    def drops(p, mdot, derivative=False):
+        '''
+        Inputs:
+            mdot = (array) [..., chain] chain flow rates
+
+        Outputs:
+            (array) [..., member] signed damping load of each member, or
+                    its derivative with respect to the chain flow
+        '''
+        D = np.empty(np.shape(mdot)[:-1] + (p["N_members"],))
+        for cls, params, chain, index, sign, weight, rho, mu in p["members"]:
+            m = weight*mdot[..., chain]
+            if derivative:
+                D[..., index] = sign*weight*cls.loss_jacobian(params, m, rho, mu)
+            else:
+                D[..., index] = sign*cls.loss(params, m, rho, mu)
+        return D
+
+
+    ### Inertance and compliance over arrays of chains
+    ### ----------------------------------------------
+    @staticmethod
+    def inertance(p, rho):
+        # weight*inertance of each member, as seen by the chain flow
+        I = np.zeros(p["N_members"])
+        for cls, params, chain, index, sign, weight, rho, mu in p["members"]:
+            if hasattr(cls, "inertance"):
+                I[index] = sign*weight*cls.inertance(params, rho)
+        return np.add.reduceat(I, p["start"])
+
+    @staticmethod
+    def compliance(p, rho):
+        # a member of weight w stands for 1/w identical parallel copies
+        C = np.zeros(p["N_members"])
+        for cls, params, chain, index, sign, weight, rho, mu in p["members"]:
+            if hasattr(cls, "compliance"):
+                C[index] = cls.compliance(params, rho)/weight
+        return np.add.reduceat(C, p["start"])
+
+
+    ### Damping load over arrays of chains
+    ### ----------------------------------
+    @staticmethod
+    def loss(p, mdot, rho, mu):
+        # rho, mu of the chain are unused, members carry their own
+        return np.add.reduceat(Chain.drops(p, mdot), p["start"], axis=-1)
+
+
+    ### Flow derivative of damping load over arrays of chains
+    ### -----------------------------------------------------
+    @staticmethod
+    def loss_jacobian(p, mdot, rho, mu):
+        return np.add.reduceat(Chain.drops(p, mdot, derivative=True), p["start"], axis=-1)
+
+
+
+### ------------------------------- ###
+### Branches of the Reduction Graph ###
+### ------------------------------- ###
+
+class Branch:
+
+    ### Constructor
+    ### -----------
+    def __init__(self, start, end, steps, nodes):
+        '''
+        Inputs:
+            start, end = (int) circuit nodes at the branch ends
+            steps      = (list) (element, sign, weight) members in flow order
+            nodes      = (list) (node, k, weight) internal circuit nodes,
+                         each after the first k members and carrying
+                         weight*mdot of the branch flow
+        '''
+        self.start = start
+        self.end = end
+        self.steps = steps
+        self.nodes = nodes
+
+    ### Same branch walked from its end
+    ### -------------------------------
+    def reversed(self):
+        L = len(self.steps)
+        return Branch(self.end, self.start, [(el, -s, w) for el, s, w in self.steps[::-1]], \
+                      [(j, L - k, w) for j, k, w in self.nodes])
+
+    ### Branch oriented forward or backward
+    def oriented(self, forward):
+        return self if forward else self.reversed()
+
+
+
+### ---------------------- ###
+### Network Reduction Pass ###
+### ---------------------- ###
+
+class Reduction:
+
+    ### Constructor
+    ### -----------
+    def __init__(self, model):
+        '''
+        Inputs:
+            model = (Model) circuit to reduce; its boundary conditions are
+                    read at every solve
+        '''
+        self.model = model
+        if model.stale_elements or model.stale_nodes or model.circuit.adjacency_stale:
+            model.refresh()
+        self.signatures = {} # element -> hashable parameters and properties
+
+        ### Two-port loss elements start as one-member branches, the rest
+        ### are kept as junctions
+        self.branches = {} # insertion-ordered set
+        self.junctions = {}
+        self.attach = {} # circuit node -> [(piece, port), ...]
+        for el in model.circuit.elements:
+            if is_two_port(el):
+                self.add_branch(Branch(el.ports[0], el.ports[1], [(el, 1., 1.)], []))
+            else:
+                self.junctions[el] = None
+                for n, j in enumerate(el.ports):
+                    self.attach.setdefault(j, []).append((el, n))
+
+        ### Alternate series and parallel passes until nothing folds
+        self.merge_series()
+        while self.fold_parallel():
+            self.merge_series()
+
+        self.build_reduced()
+
+
+    ### Graph bookkeeping
+    ### -----------------
+    def add_branch(self, branch):
+        self.branches[branch] = None
+        self.attach.setdefault(branch.start, []).append((branch, 0))
+        self.attach.setdefault(branch.end, []).append((branch, 1))
+
+    def drop(self, piece, nodes):
+        self.branches.pop(piece, None)
+        self.junctions.pop(piece, None)
+        for j in nodes:
+            self.attach[j] = [a for a in self.attach[j] if a[0] is not piece]
+
+    def other(self, node, piece):
+        ### (piece, port) across a node from the given piece, if any
+        att = [a for a in self.attach[node] if a[0] is not piece]
+        return att[0] if len(att) == 1 else None
+
+    def signature(self, steps):
+        ### Member parameters, signs and flow shares relative to the first
+        w0 = steps[0][2]
+        for el, _, _ in steps:
+            if el not in self.signatures:
+                params = type(el).pack([el])
+                self.signatures[el] = (type(el), self.model.element_properties(el), \
+                                       tuple((key, tuple(np.ravel(params[key]))) \
+                                             for key in sorted(params)))
+        return tuple((self.signatures[el], s, round(w/w0, 12)) for el, s, w in steps)
+
+
+    ### Collapse series runs of branches
+    ### --------------------------------
+    def merge_series(self):
+        visited = set()
+        for seed in list(self.branches):
+            if seed in visited:
+                continue
+            run = self.series_run(seed)
+            visited.update(branch for branch, _ in run)
+            if len(run) == 1:
+                continue
+
+            ### Concatenate members, offsetting internal node positions
+            steps, nodes = [], []
+            for n, (branch, forward) in enumerate(run):
+                branch = branch.oriented(forward)
+                if n > 0:
+                    nodes.append((branch.start, len(steps), 1.))
+                nodes += [(j, k + len(steps), w) for j, k, w in branch.nodes]
+                steps += branch.steps
+            first, last = run[0][0].oriented(run[0][1]), run[-1][0].oriented(run[-1][1])
+
+            for branch, _ in run:
+                self.drop(branch, (branch.start, branch.end))
+            self.add_branch(Branch(first.start, last.end, steps, nodes))
+
+    def series_run(self, seed):
+        '''
+        Outputs:
+            (list) (branch, forward) of the maximal series run through seed,
+                   in flow order
+        '''
+        run = deque([(seed, True)])
+
+        ### Walk forward from the seed's end
+        node, last = seed.end, seed
+        while (nxt := self.other(node, last)) is not None:
+            branch, port = nxt
+            if not isinstance(branch, Branch):
+                break
+            if branch is seed:
+                return [(seed, True)] # closed ring, left as-is
+            run.append((branch, port == 0))
+            node, last = (branch.end if port == 0 else branch.start), branch
+
+        ### Walk backward from the seed's start
+        node, last = seed.start, seed
+        while (nxt := self.other(node, last)) is not None:
+            branch, port = nxt
+            if not isinstance(branch, Branch):
+                break
+            run.appendleft((branch, port == 1))
+            node, last = (branch.start if port == 1 else branch.end), branch
+
+        return list(run)
+
+
+    ### Fold identical branches between two tees
+    ### -----------------------------------------
+    def fold_parallel(self):
+        folded = False
+        for T1 in list(self.junctions):
+            if T1 not in self.junctions or not isinstance(T1, Tee):
+                continue
+            legs = [self.leg(T1, n) for n in (1, 2)]
+            if None in legs:
+                continue
+            (A_piece, A, T2, a), (B_piece, B, T2_b, b) = legs
+            if A_piece is B_piece or T2 is not T2_b or T2 is T1 or not isinstance(T2, Tee) \
+               or {a, b} != {1, 2} or T1.ports[0] == T2.ports[0]:
+                continue
+            if self.signature(A.steps) != self.signature(B.steps):
+                continue
+
+            ### Identical members carry equal flows, so each branch takes a
+            ### fixed share of the combined flow
+            share_A = 1/A.steps[0][2] / (1/A.steps[0][2] + 1/B.steps[0][2])
+            share_B = 1 - share_A
+            L = len(A.steps)
+            steps = [(el, s, w*share_A) for el, s, w in A.steps]
+            nodes = [(j, k, w*share_A) for j, k, w in A.nodes] + \
+                    [(j, k, w*share_B) for j, k, w in B.nodes] + \
+                    [(A.start, 0, share_A), (A.end, L, share_A), \
+                     (B.start, 0, share_B), (B.end, L, share_B)]
+
+            for piece in (A_piece, B_piece, T1, T2):
+                self.drop(piece, (piece.start, piece.end) if isinstance(piece, Branch) \
+                                 else piece.ports)
+            self.add_branch(Branch(T1.ports[0], T2.ports[0], steps, nodes))
+            folded = True
+
+        return folded
+
+    def leg(self, T, n):
+        '''
+        Outputs:
+            (branch, branch oriented away from tee T, junction at its far
+             end, port of that junction), or None if port n of T doesn't
+             lead through a branch to another junction
+        '''
+        nxt = self.other(T.ports[n], T)
+        if nxt is None or not isinstance(nxt[0], Branch):
+            return None
+        branch = nxt[0].oriented(nxt[1] == 0)
+        far = self.other(branch.end, nxt[0])
+        if far is None or isinstance(far[0], Branch):
+            return None
+        return nxt[0], branch, far[0], far[1]
+
+
+    ### Reduced circuit and recovery maps
+    ### ---------------------------------
+    def build_reduced(self):
+        model = self.model
+        pieces = {} # piece -> reduced element
+        self.chains = []
+        interior = []
+
+        ### Reduced elements (copies, so the original circuit is untouched)
+        for branch in self.branches:
+            el, s, w = branch.steps[0]
+            if len(branch.steps) == 1 and s == 1 and w == 1 and not branch.nodes:
+                pieces[branch] = detached_copy(el)
+                continue
+            chain = Chain("chain(" + el.name + "..." + branch.steps[-1][0].name + ")", \
+                          branch.steps, model.element_properties)
+            interior += [(j, len(self.chains), k, w) for j, k, w in branch.nodes]
+            self.chains.append(chain)
+            pieces[branch] = chain
+        for junction in self.junctions:
+            pieces[junction] = detached_copy(junction)
+
+        ### Tie reduced elements across surviving connection nodes
+        for j, att in self.attach.items():
+            if len(att) == 2:
+                (p, n), (q, m) = att
+                pieces[p].tie_in(pieces[q], n, m)
+        source = next(iter(pieces.values()))
+        self.reduced = type(model)(Network(source), model.fluid)
+
+        ### Surviving nodes, circuit -> reduced numbering
+        self.node_map = {}
+        for piece, el in pieces.items():
+            ports = (piece.start, piece.end) if isinstance(piece, Branch) else piece.ports
+            for j, r in zip(ports, el.ports):
+                self.node_map[j] = r
+        self.kept = np.array(list(self.node_map.keys()), dtype=np.int64)
+        self.kept_reduced = np.array(list(self.node_map.values()), dtype=np.int64)
+
+        ### Internal nodes, recovered along their chains
+        self.params = Chain.pack(self.chains)
+        self.chain_start = np.array([chain.ports[0] for chain in self.chains], dtype=np.int64)
+        interior = np.array(interior, dtype=float).reshape(-1, 4)
+        self.interior = interior[:, 0].astype(np.int64)
+        self.interior_chain = interior[:, 1].astype(np.int64)
+        self.interior_k = interior[:, 2].astype(np.int64)
+        self.interior_weight = interior[:, 3]
+
+
+    ### State variable counts
+    ### ---------------------
+    def report(self):
+        N_full, N_reduced = self.model.N_sv, self.reduced.N_sv
+        print("State variables: " + str(N_full) + " -> " + str(N_reduced) + \
+              " (" + str(len(self.chains)) + " chains)")
+        return N_full, N_reduced
+
+
+    ### Expand reduced solutions to the full circuit
+    ### ---------------------------------------------
+    def expand(self, statevars):
+        '''
+        Inputs:
+            statevars = (array) [..., N_sv] reduced pressures then flow rates
+
+        Outputs:
+            (array) [..., N_sv] pressures then flow rates by circuit node
+        '''
+        N, N_r = self.model.N_nodes, self.reduced.N_nodes
+        P_r, mdot_r = statevars[..., :N_r], statevars[..., N_r:]
+        x = np.empty(statevars.shape[:-1] + (2*N,))
+        x[..., self.kept] = P_r[..., self.kept_reduced]
+        x[..., N + self.kept] = mdot_r[..., self.kept_reduced]
+        if not self.chains:
+            return x
+
+        ### Cumulative member loads from each chain's start
+        mdot = mdot_r[..., self.chain_start]
+        D = Chain.drops(self.params, mdot)
+        cum = np.concatenate([np.zeros(D.shape[:-1] + (1,)), np.cumsum(D, axis=-1)], axis=-1)
+        first = self.params["start"][self.interior_chain]
+        x[..., self.interior] = P_r[..., self.chain_start[self.interior_chain]] - \
+                                (cum[..., first + self.interior_k] - cum[..., first])
+        x[..., N + self.interior] = self.interior_weight*mdot[..., self.interior_chain]
+        return x
+
+
+    ### Solve reduced circuit
+    ### ---------------------
+    def solve(self, **options):
+        '''
+        Inputs:
+            options = Model.steady_solve options for the reduced model
+
+        Outputs:
+            (OptimizeResult) reduced solve with x expanded to the full
+            circuit (reduced state in x_reduced)
+        '''
+        model, reduced = self.model, self.reduced
+
+        ### Boundary conditions follow the full model's
+        for j, r in self.node_map.items():
+            if model.circuit.is_boundary[j]:
+                reduced.P_bc[r], reduced.mdot_bc[r] = model.P_bc[j], model.mdot_bc[j]
+
+        sol = reduced.steady_solve(**options)
+        sol.x_reduced = sol.x
+        sol.x = self.expand(sol.x)
+        if sol.success:
+            model.P_steady = sol.x[:model.N_nodes]
+            model.mdot_steady = sol.x[model.N_nodes:]
+        return sol
+
+
+
+### Two-port elements with a loss kernel
+### ------------------------------------
+def is_two_port(element):
+    cls = type(element)
+    return len(element.ports) == 2 and hasattr(cls, "loss") and \
+           not hasattr(cls, "steady_residuals")
+
+### Copy of an element with no ties
+### -------------------------------
+def detached_copy(element):
+    new = copy.copy(element)
+    N = len(element.ports)
+    new.neighbors, new.neighbor_ports, new.ports = [None]*N, [None]*N, [None]*N
+    new.id = new.network = None
+    return new
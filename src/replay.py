@@ -0,0 +1,172 @@
+'''
+Quasi-steady replay of measured boundary-condition time series.
+
+Test records (tank pressures, valve positions, ... sampled over time) are
+pushed through the circuit one sample at a time: each sample's values are
+written into the boundary conditions and element parameters they drive,
+and the steady equations are solved warm started from the previous
+sample's solution, which at test-stand rates is already within a Newton
+step or two. The iteration reuses one factored Jacobian across samples
+(chord Newton), refactoring only when it stops contracting, and falls back
+to the damped NewtonSolver for samples it cannot solve.
+
+Samples are consumed from any iterator, e.g. csv_samples() reading a
+record line by line, and solutions are yielded as they are found, so
+memory stays bounded however long the record is.
+
+Author(s):
+    Samuel Ciesielski
+
+'''
+
+import csv
+import numpy as np
+from scipy.sparse.linalg import splu
+from network import Element
+from solver import NewtonSolver
+
+
+
+class QuasiSteady:
+
+    ### Constructor
+    ### -----------
+    def __init__(self, model, channels, tol=1e-9, maxiter=10, **options):
+        '''
+        Inputs:
+            model    = (Model) circuit with boundary conditions assigned
+            channels = (list) (target, key) driven by each sample value:
+                       ("pressure" or "flowrate", boundary node) or
+                       (Element or list of elements, packed parameter name)
+            tol      = (scalar) relative Newton step at convergence
+            maxiter  = (int) chord iterations before the fallback solve
+            options  = NewtonSolver options of the fallback solve
+        '''
+        assembly = model.compile()
+        if assembly.pattern is None:
+            assembly.build_pattern()
+        self.assembly = assembly.copy(own_params=True)
+        self.specs = []
+        for target, key in channels:
+            if isinstance(target, Element):
+                target = [target]
+            self.specs.append(self.assembly.locate(target, key))
+        self.tol, self.maxiter = tol, maxiter
+        self.solver = NewtonSolver("newton", tol=tol, **options)
+        self.lu = None
+
+        ### Warm start
+        self.x = model.steady_state() if model.has_steady() else model.initial_guess()
+        self.values = None
+        self.stats = {"samples": 0, "solves": 0, "failed": 0, "nit": 0, "factors": 0, \
+                      "fallbacks": 0}
+
+
+    ### Solve one sample
+    ### ----------------
+    def solve(self, values):
+        '''
+        Inputs:
+            values = (vector) one value per channel
+
+        Outputs:
+            (vector) [N_sv] pressures then flow rates by node, NaN if the
+            solve did not converge
+        '''
+        self.stats["samples"] += 1
+        values = np.asarray(values, dtype=float)
+
+        ### Held values need no solve
+        if self.values is not None and np.array_equal(values, self.values):
+            return self.x.copy()
+        for specs, value in zip(self.specs, values):
+            self.assembly.assign(specs, value)
+
+        x, success = self.chord(self.x)
+        if not success:
+            self.stats["fallbacks"] += 1
+            asm = self.assembly
+            sol = self.solver.solve(asm.residuals, asm.jacobian, self.x, key=asm.pattern)
+            self.stats["nit"] += sol.nit
+            x, success, self.lu = sol.x, sol.success, None
+        self.stats["solves"] += 1
+        if not success:
+            self.stats["failed"] += 1
+            self.values = None
+            return np.full(len(self.x), np.nan)
+        self.x, self.values = x, values
+        return x.copy()
+
+
+    ### Newton iteration on a reused Jacobian
+    ### -------------------------------------
+    def chord(self, x):
+        '''
+        Outputs:
+            (vector) x, (bool) converged
+        '''
+        asm = self.assembly
+        x = x.copy()
+        step_old = np.inf
+        for _ in range(self.maxiter):
+            F = asm.residuals(x)
+            if self.lu is None:
+                self.lu = splu(asm.jacobian(x).tocsc())
+                self.stats["factors"] += 1
+            dx = self.lu.solve(-F)
+            self.stats["nit"] += 1
+            x += dx
+            step = np.max(np.abs(dx)/(np.abs(x) + 1))
+            if not np.isfinite(step):
+                break
+            if step < self.tol:
+                return x, True
+            if step > .3*step_old:
+                self.lu = None # slow contraction, refactor at the new iterate
+            step_old = step
+        self.lu = None
+        return x, False
+
+
+    ### Stream of samples
+    ### -----------------
+    def __call__(self, samples):
+        '''
+        Inputs:
+            samples = (iterable) (t, values) per sample
+
+        Outputs:
+            (generator) (t, x) per sample, see solve()
+        '''
+        for t, values in samples:
+            yield t, self.solve(values)
+
+
+
+### Samples read line by line from a CSV record
+### -------------------------------------------
+def csv_samples(source, columns, time="t"):
+    '''
+    Inputs:
+        source  = (string or file) CSV path or open file with a header row
+        columns = (list) header names of the channel values, in channel order
+        time    = (string) header name of the time column
+
+    Outputs:
+        (generator) (t, values) per row
+    '''
+    f = open(source, newline="") if isinstance(source, str) else source
+    try:
+        reader = csv.reader(f)
+        header = [name.strip() for name in next(reader)]
+        missing = [name for name in [time] + list(columns) if name not in header]
+        if missing:
+            raise Exception("Columns not found in the record: " + ", ".join(missing) + ".")
+        i_t = header.index(time)
+        i_values = [header.index(name) for name in columns]
+        for row in reader:
+            if row:
+                yield float(row[i_t]), np.array([float(row[i]) for i in i_values])
+    finally:
+        if f is not source:
+            f.close()
@@ -0,0 +1,241 @@
+'''
+Sparse Newton solvers for large steady-state fluid networks.
+
+Both solvers take the residual function and analytic sparse Jacobian of
+an Assembly. The sparsity pattern of that Jacobian is fixed by the network
+topology, so the fill-reducing column ordering (the symbolic part of the
+factorization) is computed once and reused for every iteration and every
+later solve on the same pattern:
+
+    "newton" = Newton's method with a direct SuperLU solve per iteration
+    "krylov" = inexact Newton with ILU-preconditioned GMRES, for systems
+               too large to factor exactly. The ILU preconditioner is
+               lagged: it is only rebuilt when GMRES stops converging.
+
+Steps are globalized with a backtracking (Armijo) line search on the
+residual norm. A solve converges when the full Newton step and the
+residual norm are both small; a line search that stalls away from
+roundoff is reported as a failure.
+
+Author(s):
+    Samuel Ciesielski
+
+'''
+
+import numpy as np
+from scipy.sparse.linalg import splu, spilu, gmres, LinearOperator
+from scipy.optimize import OptimizeResult
+
+
+
+class NewtonSolver:
+
+    ### Constructor
+    ### -----------
+    def __init__(self, method="newton", tol=1e-9, ftol=1e-6, maxiter=100, \
+                 krylov_rtol=1e-2, ilu_drop_tol=1e-5, ilu_fill_factor=10):
+        '''
+        Inputs:
+            method          = (string) "newton" or "krylov"
+            tol             = (scalar) convergence tolerance on the relative
+                              Newton step, max|dx|/(|x| + 1)
+            ftol            = (scalar) convergence tolerance on the residual
+                              norm |F|, in the units of the residuals
+            maxiter         = (int) maximum Newton iterations
+            krylov_rtol     = (scalar) initial GMRES forcing term
+            ilu_drop_tol    = (scalar) drop tolerance of ILU preconditioner
+            ilu_fill_factor = (scalar) fill factor of ILU preconditioner
+        '''
+        if method not in ("newton", "krylov"):
+            raise Exception("Invalid Newton method: " + method + ". Must be " \
+                            "either \"newton\" or \"krylov\".")
+        self.method = method
+        self.tol = tol
+        self.ftol = ftol
+        self.maxiter = maxiter
+        self.krylov_rtol = krylov_rtol
+        self.ilu_drop_tol = ilu_drop_tol
+        self.ilu_fill_factor = ilu_fill_factor
+
+        ### Symbolic analysis, shared by all solves on one pattern
+        self.perm_c = None
+        self.pattern_key = None
+        self.ilu = None
+
+
+    ### Fill-reducing ordering of a sparsity pattern
+    ### --------------------------------------------
+    def analyze(self, J, key=None):
+        ### Reuse ordering while the pattern is unchanged
+        if self.perm_c is not None and key is not None and key is self.pattern_key:
+            return
+        # SuperLU factors A Pc with Pc[i, perm_c[i]] = 1, i.e. A[:, argsort(perm_c)]
+        self.perm_c = np.argsort(splu(J.tocsc(), permc_spec="COLAMD").perm_c)
+        self.pattern_key = key
+        self.ilu = None
+
+
+    ### Solve J x = b in the stored ordering
+    ### ------------------------------------
+    def linear_solve(self, J, b, rtol, perm_c=None):
+        if perm_c is None:
+            perm_c = self.perm_c
+        Jp = J.tocsc()[:, perm_c]
+        
+        ### Direct sparse LU
+        if self.method == "newton":
+            y = splu(Jp, permc_spec="NATURAL").solve(b)
+            
+        ### GMRES, rebuilding the preconditioner only if it stops working
+        else:
+            for attempt in range(2):
+                if self.ilu is None:
+                    self.ilu = spilu(Jp, permc_spec="NATURAL", drop_tol=self.ilu_drop_tol, \
+                                     fill_factor=self.ilu_fill_factor)
+                M = LinearOperator(Jp.shape, self.ilu.solve, dtype=Jp.dtype)
+                y, info = gmres(Jp, b, M=M, rtol=rtol, atol=0, restart=30, maxiter=3)
+                if info == 0:
+                    break
+                self.ilu = None
+
+        # undo column ordering
+        x = np.empty_like(y)
+        x[perm_c] = y
+        return x
+
+
+    ### Newton iteration
+    ### ----------------
+    def solve(self, fun, jac, x0, key=None):
+        '''
+        Inputs:
+            fun = (function) x -> residual vector
+            jac = (function) x -> sparse Jacobian
+            x0  = (vector) initial guess
+            key = (object) identifies the Jacobian sparsity pattern; the
+                  ordering is recomputed when it changes
+
+        Outputs:
+            (OptimizeResult) x, success, nit, nfev, njev, message
+        '''
+        x = np.array(x0, dtype=float)
+        F = fun(x)
+        nfev, njev = 1, 0
+        phi = .5*np.dot(F, F)
+        rtol = self.krylov_rtol
+        success, message = False, "Maximum number of iterations reached."
+
+        for nit in range(1, self.maxiter + 1):
+            ### Newton direction
+            J = jac(x)
+            njev += 1
+            self.analyze(J, key)
+            dx = self.linear_solve(J, -F, rtol)
+            if not np.all(np.isfinite(dx)):
+                message = "Singular Jacobian."
+                break
+
+            ### Backtracking line search on 1/2 |F|^2
+            alpha = 1
+            while True:
+                x_new = x + alpha*dx
+                F_new = fun(x_new)
+                nfev += 1
+                phi_new = .5*np.dot(F_new, F_new)
+                if phi_new <= (1 - 1e-4*alpha)*phi or alpha < 1e-4:
+                    break
+                alpha *= .5
+
+            ### Eisenstat-Walker forcing term for the Krylov solve
+            if phi > 0:
+                rtol = min(self.krylov_rtol, .9*phi_new/phi)
+
+            ### Convergence on the full Newton step and the residual
+            step = np.max(np.abs(dx)/(np.abs(x) + 1))
+            if alpha < 1e-4:
+                # no decrease along dx: converged only at roundoff level
+                if step < 1e3*self.tol and np.sqrt(2*phi) <= self.ftol:
+                    success, message = True, "Converged to roundoff."
+                else:
+                    message = "Line search stalled."
+                break
+            
+            x, F, phi = x_new, F_new, phi_new
+            if phi == 0 or (step < self.tol and np.sqrt(2*phi) <= self.ftol):
+                success, message = True, "Converged."
+                break
+
+        return OptimizeResult(x=x, fun=F, success=success, status=int(not success), \
+                              nit=nit, nfev=nfev, njev=njev, message=message)
+
+
+    ### Batched Newton iteration
+    ### ------------------------
+    def solve_batch(self, fun, jac, X0, key=None):
+        '''
+        Solves many independent copies of one system (e.g. at different
+        boundary values) in lockstep. Each iteration factors the stacked
+        block-diagonal Jacobian of the still-active entries at once, with
+        the single-system ordering tiled over the blocks. Line search and
+        convergence are tracked per entry.
+
+        Inputs:
+            fun = (function) (X, idx) -> residuals [len(idx), n] of entries idx
+            jac = (function) (X, idx) -> block-diagonal sparse Jacobian
+            X0  = (array) [batch, n] initial guesses
+            key = (object) identifies the Jacobian sparsity pattern
+
+        Outputs:
+            (OptimizeResult) x [batch, n], success [batch], nit [batch]
+        '''
+        X = np.array(X0, dtype=float)
+        B, n = X.shape
+        active = np.arange(B)
+        success = np.zeros(B, dtype=bool)
+        nit = np.zeros(B, dtype=int)
+        F = fun(X, active)
+        phi = .5*np.sum(F**2, axis=1)
+
+        for _ in range(self.maxiter):
+            if len(active) == 0:
+                break
+            nit[active] += 1
+
+            ### Newton directions of all active entries
+            J = jac(X[active], active)
+            if self.perm_c is None or key is None or key is not self.pattern_key:
+                self.analyze(J[:n, :n], key)
+            perm = (self.perm_c[None, :] + n*np.arange(len(active))[:, None]).ravel()
+            dX = self.linear_solve(J, -F.ravel(), self.krylov_rtol, perm).reshape(-1, n)
+
+            ### Backtracking line search per entry
+            alpha = np.ones(len(active))
+            X_new = X[active] + dX
+            F_new = np.empty_like(F)
+            phi_new = np.empty_like(phi)
+            pending = np.arange(len(active))
+            while len(pending):
+                X_new[pending] = X[active[pending]] + alpha[pending, None]*dX[pending]
+                F_new[pending] = fun(X_new[pending], active[pending])
+                phi_new[pending] = .5*np.sum(F_new[pending]**2, axis=1)
+                ok = (phi_new[pending] <= (1 - 1e-4*alpha[pending])*phi[pending]) | \
+                     (alpha[pending] < 1e-4)
+                pending = pending[~ok]
+                alpha[pending] *= .5
+
+            ### Convergence per entry, as in solve()
+            step = np.max(np.abs(dX)/(np.abs(X[active]) + 1), axis=1)
+            stalled = alpha < 1e-4
+            roundoff = stalled & (step < 1e3*self.tol) & (np.sqrt(2*phi) <= self.ftol)
+            converged = ~stalled & ((phi_new == 0) | \
+                                    ((step < self.tol) & (np.sqrt(2*phi_new) <= self.ftol)))
+            done = converged | stalled
+            stuck = ~np.all(np.isfinite(dX), axis=1)
+            X[active] = np.where((stuck | stalled)[:, None], X[active], X_new)
+            success[active[(converged | roundoff) & ~stuck]] = True
+
+            keep = ~done & ~stuck
+            active = active[keep]
+            F, phi = F_new[keep], phi_new[keep]
+
+        return OptimizeResult(x=X, success=success, nit=nit)
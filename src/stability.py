@@ -0,0 +1,236 @@
+'''
+POGO stability maps over two-parameter grids of operating points.
+
+Every grid cell (e.g. tank pressure x chamber pressure, or tank pressure x
+injector K-factor) gets a steady solve, the linearized dynamics about it
+and the damping ratios of the modes nearest the target frequencies; a
+negative damping ratio marks an unstable (self-excited) mode [1].
+
+Rows of the grid (fixed first-axis value) are spread over a process pool.
+Each cell is warm started from its neighbour in the row, and the first
+cell of each row from the neighbouring row's first cell, solved up front
+along the first axis; a row's march then starts from its first cell's
+state. Results are written straight to an on-disk .npy array as cells
+finish, so an interrupted map resumes where it stopped, skipping every
+cell whose status is already set.
+
+Author(s):
+    Samuel Ciesielski
+
+Source(s):
+    [1] B. W. Oppenheim, S. Rubin, "Advanced POGO Stability Analysis for
+        Liquid Rockets," The Aerospace Corporation, AIAA-92-2454-CP.
+
+'''
+
+import os
+from multiprocessing import Pool
+import numpy as np
+from network import Element
+from solver import NewtonSolver
+from modal import companion, nearest_modes
+
+
+
+class StabilityMap:
+
+    ### Constructor
+    ### -----------
+    def __init__(self, model):
+        '''
+        Inputs:
+            model = (Model) circuit with boundary conditions assigned
+        '''
+        self.model = model
+        self.axes = [] # (target, key, values)
+        self.results = None
+
+
+    ### Grid axis over a boundary value or element parameter
+    ### ----------------------------------------------------
+    def add_axis(self, target, key, values):
+        '''
+        Inputs:
+            target = (string) "pressure" or "flowrate" for a boundary value,
+                     or (Element or list) elements whose parameter is set
+                     to each value together
+            key    = (int) boundary node, or (string) packed parameter
+                     name, e.g. "Knet", "do", "l"
+            values = (vector) grid values along this axis
+        '''
+        if len(self.axes) == 2:
+            raise Exception("A stability map has two axes.")
+        if isinstance(target, Element):
+            target = [target]
+        elif isinstance(target, str) and target not in ("pressure", "flowrate"):
+            raise Exception("Invalid axis type: " + target + ". Must be either " \
+                            "\"pressure\", \"flowrate\" or a list of elements.")
+        self.axes.append((target, key, np.asarray(values, dtype=float)))
+        self.results = None
+
+
+    ### Solve every cell
+    ### ----------------
+    def run(self, path, k=4, f_target=100., processes=None, **options):
+        '''
+        Inputs:
+            path      = (string) .npy file holding the map; cells already
+                        in an existing file of the same shape are skipped
+            k         = (int) modes per target frequency
+            f_target  = (scalar or vector) [Hz] target frequencies
+            processes = (int) worker processes, None for all cores, 1 to run
+                        in this process
+            options   = NewtonSolver options
+
+        Outputs:
+            (StabilityMap) self, with results, f_n, zeta and margin over
+            the grid
+        '''
+        if len(self.axes) != 2:
+            raise Exception("Add two axes before running the map.")
+        model = self.model
+        assembly = model.compile()
+        if assembly.pattern is None:
+            assembly.build_pattern()
+        specs = [(assembly.locate(target, key), values) for target, key, values in self.axes]
+        N_1, N_2 = (len(values) for _, _, values in self.axes)
+        N_modes = k*np.size(f_target)
+
+        ### On-disk map [row, column, status + frequencies + damping ratios],
+        ### status NaN until a cell is solved, 1 if solved and 0 if failed
+        shape = (N_1, N_2, 1 + 2*N_modes)
+        if os.path.exists(path):
+            results = np.load(path, mmap_mode="r+")
+            if results.shape != shape:
+                raise Exception(path + " holds a map of a different shape " + \
+                                str(results.shape) + ".")
+        else:
+            results = np.lib.format.open_memmap(path, mode="w+", shape=shape)
+            results[:] = np.nan
+            results.flush()
+        del results
+
+        ### First column, marched along the first axis, seeds every row;
+        ### cells finished by an earlier run pass the seed on unchanged
+        x0 = model.steady_solve(**options).x
+        payload = (assembly.copy(own_params=True), specs, path, k, f_target, options)
+        init_worker(*payload)
+        results = np.load(path, mmap_mode="r+")
+        failed, seeds = 0, []
+        for i in range(N_1):
+            if np.isnan(results[i, 0, 0]):
+                sol = solve_cell(i, 0, x0)
+                failed += store_cell(results, i, 0, sol)
+                x0 = sol.x if sol.success else x0
+            seeds.append(x0)
+        tasks = [(i, seeds[i]) for i in range(N_1) if np.any(np.isnan(results[i, :, 0]))]
+        del results
+
+        ### Rows
+        if processes == 1:
+            failed += sum(map(run_row, tasks))
+        else:
+            with Pool(processes, initializer=init_worker, initargs=payload) as pool:
+                failed += sum(pool.imap_unordered(run_row, tasks))
+
+        if failed:
+            print(str(failed) + " of " + str(N_1*N_2) + " operating points did not converge.")
+        self.results = np.load(path, mmap_mode="r")
+        return self
+
+
+    ### Views of the map
+    ### ----------------
+    @property
+    def f_n(self):
+        ### [Hz] frequencies [row, column, mode], NaN past the modes found
+        N_modes = (self.results.shape[2] - 1)//2
+        return self.results[..., 1:1 + N_modes]
+
+    @property
+    def zeta(self):
+        ### damping ratios [row, column, mode]
+        N_modes = (self.results.shape[2] - 1)//2
+        return self.results[..., 1 + N_modes:]
+
+    @property
+    def margin(self):
+        ### least damping ratio per cell, negative where unstable
+        zeta = np.where(np.isnan(self.zeta), np.inf, self.zeta).min(axis=2)
+        return np.where(np.isinf(zeta), np.nan, zeta)
+
+    @property
+    def critical_frequency(self):
+        ### [Hz] frequency of the least damped mode per cell
+        zeta = np.where(np.isnan(self.zeta), np.inf, self.zeta)
+        i = np.argmin(zeta, axis=2)[..., None]
+        return np.where(np.isinf(zeta.min(axis=2)), np.nan, \
+                        np.take_along_axis(self.f_n, i, axis=2)[..., 0])
+
+
+
+### ---------------------- ###
+### Worker Process Helpers ###
+### ---------------------- ###
+
+worker = {}
+
+def init_worker(assembly, specs, path, k, f_target, options):
+    worker.update(assembly=assembly, specs=specs, path=path, k=k, f_target=f_target, \
+                  solver=NewtonSolver("newton", **options))
+
+### Steady solve of one cell
+### ------------------------
+def solve_cell(i, j, x0):
+    assembly = worker["assembly"]
+    for (specs, values), index in zip(worker["specs"], (i, j)):
+        assembly.assign(specs, values[index])
+    return worker["solver"].solve(assembly.residuals, assembly.jacobian, x0, \
+                                  key=assembly.pattern)
+
+### Modes of one solved cell
+### ------------------------
+def cell_modes(x):
+    A, B, _ = companion(*worker["assembly"].dynamics(x))
+    lam, _ = nearest_modes(A, B, worker["f_target"], worker["k"])
+    return lam.imag/(2*np.pi), -lam.real/np.abs(lam)
+
+### Write one cell's status and modes to the map
+### ---------------------------------------------
+def store_cell(results, i, j, sol):
+    '''
+    Outputs:
+        (bool) the cell failed
+    '''
+    N_modes = (results.shape[2] - 1)//2
+    cell = np.full(results.shape[2], np.nan)
+    cell[0] = float(sol.success)
+    if sol.success:
+        try:
+            f_n, zeta = cell_modes(sol.x)
+            n = min(len(f_n), N_modes)
+            cell[1:1 + n], cell[1 + N_modes:1 + N_modes + n] = f_n[:n], zeta[:n]
+        except RuntimeError:
+            cell[0] = 0 # singular pencil or no ARPACK convergence
+    results[i, j] = cell
+    results.flush()
+    return not cell[0]
+
+### March along one row of the grid
+### -------------------------------
+def run_row(task):
+    i, x0 = task # x0: state of the row's first cell, solved by run()
+    results = np.load(worker["path"], mmap_mode="r+")
+    failed = 0
+    for j in range(results.shape[1]):
+        if not np.isnan(results[i, j, 0]):
+            continue
+
+        ### Warm start from the neighbouring cell, else from the row's seed
+        sol = solve_cell(i, j, x0)
+        if not sol.success:
+            sol = solve_cell(i, j, task[1])
+        failed += store_cell(results, i, j, sol)
+        if sol.success:
+            x0 = sol.x
+    return failed
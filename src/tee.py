@@ -10,6 +10,7 @@ Sources:
 '''
 
 from network import Element
+import numpy as np
 
 class Tee(Element):
     
@@ -25,16 +26,24 @@ class Tee(Element):
                             
             
             
+    ### Design flow direction, inlet ports then outlet ports
+    ### ----------------------------------------------------
+    def thermal_ports(self):
+        if self.config == "diverging":
+            return (0,), (1, 2)
+        return (1, 2), (0,)
+        
+        
     ### Pull steady flow equations
     ### --------------------------
-    def steady_flow_eqns(self, statevars, N_sv, rho):
+    def steady_flow_eqns(self, statevars, N_sv, rho, mu):
         ### Relevant state variables
         P_1 = statevars[self.ports[0]]
         P_2 = statevars[self.ports[1]]
         P_3 = statevars[self.ports[2]]
-        mdot_1 = statevars[N_sv/2 + self.ports[0]]
-        mdot_2 = statevars[N_sv/2 + self.ports[1]]
-        mdot_3 = statevars[N_sv/2 + self.ports[2]]
+        mdot_1 = statevars[N_sv//2 + self.ports[0]]
+        mdot_2 = statevars[N_sv//2 + self.ports[1]]
+        mdot_3 = statevars[N_sv//2 + self.ports[2]]
         
         return [
             # Steady-state momentum equations
@@ -44,4 +53,38 @@ class Tee(Element):
             # Mass continuity equation
             mdot_1 - mdot_2 - mdot_3
         ]
-        
\ No newline at end of file
+        
+        
+    ### Steady flow equations over arrays of tees
+    ### -----------------------------------------
+    @staticmethod
+    def steady_residuals(p, P, mdot, rho, mu):
+        '''
+        Inputs:
+            P, mdot = (array) [..., tee, port] port pressures and flow rates
+            
+        Outputs:
+            (array) [..., equation, tee] residuals
+        '''
+        return np.stack([
+            P[..., 0] - P[..., 1],
+            P[..., 0] - P[..., 2],
+            mdot[..., 0] - mdot[..., 1] - mdot[..., 2]
+        ], axis=-2)
+        
+        
+    ### Partial derivatives of steady flow equations over arrays of tees
+    ### ----------------------------------------------------------------
+    @staticmethod
+    def steady_jacobian(p, P, mdot, rho, mu):
+        '''
+        Outputs:
+            (array) [..., equation, variable, tee] partials with respect to
+                    (P_1, P_2, P_3, mdot_1, mdot_2, mdot_3)
+        '''
+        J = np.array([
+            [1, -1,  0, 0,  0,  0],
+            [1,  0, -1, 0,  0,  0],
+            [0,  0,  0, 1, -1, -1],
+        ], dtype=float)
+        return np.broadcast_to(J[..., None], P.shape[:-2] + J.shape + P.shape[-2:-1])
@@ -0,0 +1,316 @@
+'''
+Coupled thermal-hydraulic steady state.
+
+Node temperatures T join the pressures and flow rates in the state vector,
+x = [P, mdot, T], and every element adds one energy equation per outlet
+port in its design flow direction (see thermal_ports()):
+
+    single outlet o:  cp sum_i mdot_i (T_o - T_i) - Q = 0   (heating, mixing)
+    several outlets:  T_o - T_in = 0                        (splitting)
+
+with Q the heat added to the element [W]. Inlet boundary nodes take a
+temperature boundary condition, which closes the system.
+
+Fluid properties are evaluated per element at the mean temperature and
+pressure of its ports, with one vectorized property call per fluid per
+evaluation, and written into the assembly's per-element rho and mu before
+the hydraulic residuals are taken. Partials through the properties come
+from one extra evaluation with every element temperature stepped at once
+(each element's equations depend on its own state only), and one more in
+pressure when a fluid has a (T, P) table. Steps are one-sided, backwards
+near the top of a table, so they stay inside the tabulated range. All
+other partials are analytic. The Jacobian keeps a fixed CSR pattern as in
+Assembly.
+
+Author(s):
+    Samuel Ciesielski
+
+'''
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+
+### Design flow direction through an element
+### ----------------------------------------
+def thermal_ports(element):
+    '''
+    Outputs:
+        (tuple) inlet ports, (tuple) outlet ports
+    '''
+    if hasattr(element, "thermal_ports"):
+        return element.thermal_ports()
+    if len(element.ports) == 2:
+        return (0,), (1,)
+    raise Exception("Element " + element.name + " has no thermal port roles. " \
+                    "Define thermal_ports() for its type.")
+
+
+
+### Difference step kept below an upper bound
+### ------------------------------------------
+def one_sided_step(x, upper):
+    h = 1e-4*np.maximum(np.abs(x), 1)
+    return np.where(x + h > upper, -h, h)
+
+
+
+class EnergyBlock:
+
+    ### Constructor
+    ### -----------
+    def __init__(self, group, k, first, inlets, outlets, heat):
+        '''
+        Energy equations of the elements of a group that share port roles.
+
+        Inputs:
+            group   = (Group) element type group
+            k       = (vector) positions of the elements in the group
+            first   = (int) index of the group's first element among all
+                      elements of the assembly
+            inlets  = (tuple) inlet ports
+            outlets = (tuple) outlet ports
+            heat    = (dictionary) element -> [W] heat added
+        '''
+        self.k = np.asarray(k, dtype=np.int64)
+        self.e = first + self.k # element positions in the assembly
+        self.ports = group.ports[self.k]
+        self.inlets, self.outlets = list(inlets), list(outlets)
+        self.n = len(self.k)
+        self.n_eq = len(self.outlets)
+        self.Q = np.array([float(heat.get(group.elements[i], 0.)) for i in self.k])
+        if self.n_eq > 1 and np.any(self.Q != 0):
+            raise Exception("Heat can only be added to elements with a single outlet.")
+        self.offset = 0
+
+    @property
+    def eq_rows(self):
+        return self.offset + np.arange(self.n_eq*self.n).reshape(self.n_eq, self.n)
+
+    ### Residuals and partials over the block
+    ### -------------------------------------
+    def residuals(self, mdot, T, cp):
+        '''
+        Inputs:
+            mdot, T = (array) [element, port] port flow rates and temperatures
+            cp      = (vector) [J/(kg*K)] specific heat per element
+
+        Outputs:
+            (array) [equation, element] residuals
+        '''
+        if self.n_eq > 1:
+            return T[:, self.outlets].T - T[:, self.inlets[0]]
+        o = self.outlets[0]
+        return (cp*np.sum(mdot[:, self.inlets]*(T[:, [o]] - T[:, self.inlets]), axis=1) \
+                - self.Q)[None, :]
+
+    def jacobian(self, mdot, T, cp):
+        '''
+        Outputs:
+            (array) [equation, variable, element] partials with respect to
+                    the port flow rates then port temperatures, at constant cp
+        '''
+        n_ports = self.ports.shape[1]
+        J = np.zeros((self.n_eq, 2*n_ports, self.n))
+        if self.n_eq > 1:
+            for q, o in enumerate(self.outlets):
+                J[q, n_ports + o] = 1
+                J[q, n_ports + self.inlets[0]] = -1
+            return J
+        o = self.outlets[0]
+        for i in self.inlets:
+            J[0, i] = cp*(T[:, o] - T[:, i])
+            J[0, n_ports + i] = -cp*mdot[:, i]
+            J[0, n_ports + o] += cp*mdot[:, i]
+        return J
+
+
+
+class Thermal:
+
+    ### Constructor
+    ### -----------
+    def __init__(self, assembly, fluid, T_nodes, T_values, heat=None):
+        '''
+        Inputs:
+            assembly = (Assembly) compiled hydraulic system; its per-element
+                       rho and mu are overwritten at every evaluation
+            fluid    = (function) element -> Fluid
+            T_nodes  = (vector) nodes with a temperature boundary condition
+            T_values = (vector) [K] boundary temperatures
+            heat     = (dictionary) element -> [W] heat added, default none
+        '''
+        self.assembly = assembly
+        if assembly.pattern is None:
+            assembly.build_pattern()
+        heat = heat or {}
+        self.N = N = assembly.N_nodes
+        self.T_nodes = np.asarray(T_nodes, dtype=np.int64)
+        self.T_values = np.asarray(T_values, dtype=float)
+
+        ### Elements in group order, and the positions of each fluid's elements
+        self.groups = list(assembly.groups.values())
+        self.first = np.concatenate([[0], np.cumsum([g.n for g in self.groups])])
+        self.N_el = self.first[-1]
+        fluids = {}
+        for group, first in zip(self.groups, self.first):
+            for k, element in enumerate(group.elements):
+                f = fluid(element)
+                fluids.setdefault(id(f), (f, []))[1].append(first + k)
+        self.fluids = [(f, np.array(e)) for f, e in fluids.values()]
+        
+        ### Upper table bounds per element, for the property difference steps
+        self.T_max, self.P_max = np.empty(self.N_el), np.full(self.N_el, np.inf)
+        self.pressure_dependent = False
+        for f, e in self.fluids:
+            T_range, P_range = f.data.ranges()
+            self.T_max[e] = T_range[1]
+            if P_range is not None:
+                self.P_max[e] = P_range[1]
+                self.pressure_dependent = True
+
+        ### Energy equations by group and port roles
+        self.blocks = []
+        for group, first in zip(self.groups, self.first):
+            roles = {}
+            for k, element in enumerate(group.elements):
+                roles.setdefault(thermal_ports(element), []).append(k)
+            for (inlets, outlets), k in roles.items():
+                self.blocks.append(EnergyBlock(group, k, first, inlets, outlets, heat))
+        self.N_hydraulic = offset = assembly.N_eqns + len(assembly.bc_nodes)
+        for block in self.blocks:
+            block.offset = offset
+            offset += block.n_eq*block.n
+        self.N_energy = offset
+        if offset + len(self.T_nodes) != 3*N:
+            raise Exception("Thermal problem has " + str(offset + len(self.T_nodes)) + \
+                            " equations for " + str(3*N) + " state variables. Give each " \
+                            "inlet boundary node, and only those, a temperature.")
+        self.build_pattern()
+
+
+    ### Fixed sparsity pattern of the Jacobian
+    ### --------------------------------------
+    def build_pattern(self):
+        asm, N = self.assembly, self.N
+        rows, cols = [], []
+
+        ### Hydraulic equations against local P, mdot and T
+        for group in self.groups:
+            n_ports = group.ports.shape[1]
+            local = np.concatenate([group.ports, N + group.ports, 2*N + group.ports], axis=1).T
+            shape = (group.n_eq, 3*n_ports, group.n)
+            rows.append(np.broadcast_to(group.eq_rows[:, None, :], shape).ravel())
+            cols.append(np.broadcast_to(local[None, :, :], shape).ravel())
+        rows.append(asm.N_eqns + np.arange(len(asm.bc_nodes)))
+        cols.append(asm.bc_nodes)
+
+        ### Energy equations against local P (through cp), mdot and T
+        for block in self.blocks:
+            n_ports = block.ports.shape[1]
+            local = np.concatenate([block.ports, N + block.ports, 2*N + block.ports], axis=1).T
+            shape = (block.n_eq, 3*n_ports, block.n)
+            rows.append(np.broadcast_to(block.eq_rows[:, None, :], shape).ravel())
+            cols.append(np.broadcast_to(local[None, :, :], shape).ravel())
+        rows.append(self.N_energy + np.arange(len(self.T_nodes)))
+        cols.append(2*N + self.T_nodes)
+
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        self.pattern = np.lexsort((cols, rows))
+        self.indices = cols[self.pattern]
+        self.indptr = np.zeros(3*N + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=3*N), out=self.indptr[1:])
+
+
+    ### Per-element fluid properties
+    ### ----------------------------
+    def element_states(self, P, T):
+        ### mean port temperature and pressure per element
+        T_e = np.concatenate([T[g.ports].mean(axis=1) for g in self.groups])
+        P_e = np.concatenate([P[g.ports].mean(axis=1) for g in self.groups])
+        return T_e, P_e
+
+    def properties(self, T_e, P_e):
+        '''
+        Outputs:
+            (array) [3, element] rho, mu, cp; also written into the groups
+        '''
+        props = np.empty((3, self.N_el))
+        for fluid, e in self.fluids:
+            props[:, e] = fluid.properties(T_e[e], ("rho", "mu", "cp"), P_e[e])
+        for group, first in zip(self.groups, self.first):
+            group.rho, group.mu = props[0, first:first + group.n], props[1, first:first + group.n]
+        return props
+
+    def element_residuals(self, P, mdot, T, cp):
+        ### hydraulic [equation, element] per group, energy per block
+        R = [g.residuals(P[g.ports], mdot[g.ports]) for g in self.groups]
+        E = [b.residuals(mdot[b.ports], T[b.ports], cp[b.e]) for b in self.blocks]
+        return R, E
+
+
+    ### Residuals of the coupled system
+    ### -------------------------------
+    def residuals(self, statevars):
+        '''
+        Inputs:
+            statevars = (vector) [3*N_nodes] pressures, flow rates then
+                        temperatures by node
+
+        Outputs:
+            (vector) hydraulic equations and boundary conditions, energy
+            equations, temperature boundary conditions
+        '''
+        N = self.N
+        P, mdot, T = statevars[:N], statevars[N:2*N], statevars[2*N:]
+        props = self.properties(*self.element_states(P, T))
+        F = np.empty(3*N)
+        F[:self.N_hydraulic] = self.assembly.residuals(statevars[:2*N])
+        for block in self.blocks:
+            F[block.eq_rows.ravel()] = block.residuals(mdot[block.ports], T[block.ports], \
+                                                       props[2, block.e]).ravel()
+        F[self.N_energy:] = T[self.T_nodes] - self.T_values
+        return F
+
+
+    ### Sparse Jacobian of the coupled system
+    ### -------------------------------------
+    def jacobian(self, statevars):
+        N = self.N
+        P, mdot, T = statevars[:N], statevars[N:2*N], statevars[2*N:]
+        T_e, P_e = self.element_states(P, T)
+
+        ### Partials through the properties, one step in element temperature
+        ### and one in pressure, the base state evaluated last
+        h_T = one_sided_step(T_e, self.T_max)
+        R_T, E_T = self.element_residuals(P, mdot, T, self.properties(T_e + h_T, P_e)[2])
+        if self.pressure_dependent:
+            h_P = one_sided_step(P_e, self.P_max)
+            R_P, E_P = self.element_residuals(P, mdot, T, self.properties(T_e, P_e + h_P)[2])
+        props = self.properties(T_e, P_e)
+        R, E = self.element_residuals(P, mdot, T, props[2])
+        if not self.pressure_dependent:
+            h_P, R_P, E_P = np.ones(self.N_el), R, E # no pressure partials
+
+        values = []
+        for g, (group, first) in enumerate(zip(self.groups, self.first)):
+            n_ports = group.ports.shape[1]
+            e = slice(first, first + group.n)
+            J = np.array(group.jacobian(P[group.ports], mdot[group.ports])) # writable
+            J[:, :n_ports] += ((R_P[g] - R[g])/h_P[e]/n_ports)[:, None, :] # per port pressure
+            dR_dT = (R_T[g] - R[g])/h_T[e]/n_ports # per port temperature
+            J_T = np.broadcast_to(dR_dT[:, None, :], (group.n_eq, n_ports, group.n))
+            values.append(np.concatenate([J, J_T], axis=1).ravel())
+        values.append(np.ones(len(self.assembly.bc_nodes)))
+        for b, block in enumerate(self.blocks):
+            n_ports = block.ports.shape[1]
+            J = np.zeros((block.n_eq, 3*n_ports, block.n))
+            J[:, n_ports:] = block.jacobian(mdot[block.ports], T[block.ports], props[2, block.e])
+            J[:, :n_ports] = ((E_P[b] - E[b])/h_P[block.e]/n_ports)[:, None, :]
+            J[:, 2*n_ports:] += ((E_T[b] - E[b])/h_T[block.e]/n_ports)[:, None, :]
+            values.append(J.ravel())
+        values.append(np.ones(len(self.T_nodes)))
+
+        data = np.concatenate(values)[self.pattern]
+        return csr_matrix((data, self.indices, self.indptr), shape=(3*N, 3*N))
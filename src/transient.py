@@ -0,0 +1,519 @@
+'''
+Time-domain transients from the steady solution.
+
+MOC, the method of characteristics for water hammer: every Pipe is split
+into N reaches of length dx = a dt (its wave speed is adjusted slightly so
+N is a whole number). Along the characteristics dx/dt = +-a the
+water-hammer equations in pressure P and mass flow rate m reduce to
+
+    C+:  P_i = C_P - B m_i,   C_P = P_(i-1) + B m_(i-1) - dP_f(m_(i-1))
+    C-:  P_i = C_M + B m_i,   C_M = P_(i+1) - B m_(i+1) + dP_f(m_(i+1))
+
+with wave impedance B = a/A and dP_f the friction drop over one reach at
+the previous time level [1]. All interior grid points of all pipes are
+advanced together in array operations. Pipe ends meet at the network's
+nodes, where orifices, tees, reducers and boundary conditions act as
+lumped relations. Each step solves the node system of the steady Assembly
+with every pipe's two rows replaced by its end characteristics (inlet C-,
+outlet C+) and a backward-Euler inertance term added to lumped momentum
+equations.
+
+BDF, the lumped circuit as the differential-algebraic system
+
+    M x' = F(x, t)
+
+with M the inertances and compliances of Assembly.dynamics and F the
+steady residuals (boundary rows and storage-free equations are
+algebraic). Small orifice inertances next to long compliant lines make
+it very stiff, so it is integrated by variable order (1 to 5), variable
+step backward differentiation formulas in their quasi-constant step size
+form [2, 3]. The Newton iteration matrix M - c J reuses the steady sparse
+Jacobian, which is only re-evaluated when the iteration stops converging.
+
+Author(s):
+    Samuel Ciesielski
+
+Source(s):
+    [1] E. B. Wylie, V. L. Streeter, "Fluid Transients in Systems,"
+        Prentice Hall, 1993.
+    [2] L. F. Shampine, M. W. Reichelt, "The MATLAB ODE Suite," SIAM J. Sci.
+        Comput., Vol. 18, No. 1, 1997.
+    [3] E. Hairer, G. Wanner, "Solving Ordinary Differential Equations II:
+        Stiff and Differential-Algebraic Problems," Springer, 1996.
+
+'''
+
+import numpy as np
+from scipy.constants import pi
+from scipy.sparse import csr_matrix, csc_matrix
+from scipy.sparse.linalg import splu
+from pipe import Pipe
+from solver import NewtonSolver
+from history import Recorder
+
+
+
+class Transient:
+
+    ### Constructor
+    ### -----------
+    def __init__(self, model):
+        '''
+        Takes a private copy of the model's assembly at its steady solution.
+
+        Inputs:
+            model = (Model) circuit with boundary conditions assigned
+        '''
+        model.compile()
+        if not model.has_steady():
+            model.steady_solve()
+        if model.assembly.pattern is None:
+            model.assembly.build_pattern()
+        self.assembly = model.assembly.copy(own_params=True)
+        self.N_nodes = model.N_nodes
+        self.events = [] # (specs, function of time)
+        self.x = model.steady_state().copy()
+        self.t = 0.
+
+
+    ### Time-varying boundary value or element parameter
+    ### ------------------------------------------------
+    def add_event(self, target, key, value):
+        '''
+        Inputs:
+            target = (string) "pressure" or "flowrate" for a boundary value,
+                     or (Element or list) elements, e.g. a closing valve
+            key    = (int) boundary node, or (string) packed parameter
+                     name, e.g. "Knet", "do"
+            value  = (function) t [s] -> value
+        '''
+        if not isinstance(target, (str, list, tuple)):
+            target = [target]
+        self.events.append((self.assembly.locate(target, key), value))
+
+    def apply_events(self, t):
+        for specs, value in self.events:
+            self.assembly.assign(specs, value(t))
+
+    def reached(self, t_bound):
+        return self.t >= t_bound
+
+
+    ### March in time
+    ### -------------
+    def run(self, t_end, every=1, interval=None, nodes=None, path=None, chunk=1024):
+        '''
+        Inputs:
+            t_end    = (scalar) [s] time to advance by
+            every    = (int) record every this many steps
+            interval = (scalar) [s] least time between records, or None
+            nodes    = (list) nodes to record, or None for all of them
+            path     = (string) directory to stream the history to in
+                       chunks, or None to return it in memory
+            chunk    = (int) records per chunk
+
+        Outputs:
+            in memory: (vector) [s] times, (array) [time, 2*node] recorded
+            pressures then flow rates, starting with the current state and
+            ending at t_end; on disk: (History) of path
+        '''
+        recorder = Recorder(self.N_nodes, nodes, every, interval, chunk, path)
+        t_bound = self.t + t_end
+        recorder.append(self.t, self.x, force=True)
+        while not self.reached(t_bound):
+            self.step(t_bound)
+            recorder.append(self.t, self.x, force=self.reached(t_bound))
+        return recorder.close()
+
+
+
+class MOC(Transient):
+
+    ### Constructor
+    ### -----------
+    def __init__(self, model, dt=None, reaches=10, tol=1e-6, maxiter=20):
+        '''
+        Starts from the model's steady solution.
+
+        Inputs:
+            model   = (Model) circuit with boundary conditions assigned and
+                      a wave speed a on every Pipe
+            dt      = (scalar) [s] time step, or None for reaches reaches
+                      on the pipe with the shortest wave travel time
+            reaches = (int) see dt
+            tol     = (scalar) relative Newton step of the node solve
+            maxiter = (int) Newton iterations per step
+        '''
+        Transient.__init__(self, model)
+        self.tol, self.maxiter = tol, maxiter
+        self.solver = NewtonSolver("newton")
+
+        ### Pipe grids
+        group = self.assembly.groups.get(Pipe)
+        if group is None:
+            raise Exception("The circuit has no pipes to discretize.")
+        p = group.params
+        if not np.all(np.isfinite(p["a"])):
+            k = np.flatnonzero(~np.isfinite(p["a"]))[0]
+            raise Exception("Pipe " + model.assembly.groups[Pipe].elements[k].name + \
+                            " has no wave speed. Set Pipe.a for transient analysis.")
+        if dt is None:
+            dt = np.min(p["l"]/p["a"])/reaches
+        N = np.maximum(1, np.round(p["l"]/(p["a"]*dt))).astype(np.int64)
+        a = p["l"]/(N*dt)
+        self.dt = dt
+        self.wave_speed_change = np.max(np.abs(a/p["a"] - 1))
+        self.pipes = group
+        self.N_reaches = N
+
+        pipe = np.repeat(np.arange(group.n), N + 1)
+        self.first = np.concatenate([[0], np.cumsum(N + 1)[:-1]])
+        self.last = self.first + N
+        self.B = (a/(pi*p["Dh"]**2/4))[pipe]
+        self.B_pipe = self.B[self.first]
+        self.reach = {key: value[pipe] for key, value in p.items()} # one reach per point
+        self.reach["l"] = (p["l"]/N)[pipe]
+        self.rho, self.mu = group.rho[pipe], group.mu[pipe]
+        self.up = np.setdiff1d(np.arange(len(pipe)), self.first) # points with a C+ neighbour
+        self.down = np.setdiff1d(np.arange(len(pipe)), self.last) # points with a C- neighbour
+        self.interior = np.setdiff1d(self.up, self.last)
+
+        ### Steady initial state: uniform flow, linear pressure along pipes
+        x = self.x
+        P_in, P_out = x[group.ports[:, 0]], x[group.ports[:, 1]]
+        s = np.arange(len(pipe)) - self.first[pipe] # reach index along each pipe
+        self.P = P_in[pipe] + (P_out - P_in)[pipe]*s/N[pipe]
+        self.m = x[self.N_nodes + group.ports[:, 0]][pipe]
+
+        ### Constant partials of the pipe end characteristics
+        J = np.zeros((2, 4, group.n))
+        J[0, 0], J[0, 2], J[1, 1], J[1, 3] = 1, -self.B_pipe, 1, self.B_pipe
+        self.pipe_jacobian = J.ravel()
+
+        ### Node Jacobian values go straight into the column-permuted CSC
+        ### layout that SuperLU factors, through one gather per evaluation
+        asm = self.assembly
+        self.solver.analyze(asm.jacobian(self.x), asm.pattern)
+        nnz = len(asm.pattern)
+        index = csr_matrix((np.arange(1, nnz + 1, dtype=float), asm.indices, asm.indptr), \
+                           shape=asm.shape).tocsc()[:, self.solver.perm_c]
+        self.gather = asm.pattern[index.data.astype(np.int64) - 1]
+        self.csc = (index.indices, index.indptr)
+
+
+    ### Node system
+    ### -----------
+    def residuals(self, x, C_M, C_P, m_old):
+        '''
+        Assembly.residuals with pipe rows on their end characteristics
+        and backward-Euler inertance in lumped momentum equations.
+        '''
+        asm, N = self.assembly, self.N_nodes
+        P, m = x[:N], x[N:]
+        F = np.empty(len(x))
+        for g in asm.groups.values():
+            if g is self.pipes:
+                ports = g.ports
+                F[g.eq_rows[0]] = P[ports[:, 0]] - self.B_pipe*m[ports[:, 0]] - C_M
+                F[g.eq_rows[1]] = P[ports[:, 1]] + self.B_pipe*m[ports[:, 1]] - C_P
+                continue
+            R = g.residuals(P[g.ports], m[g.ports])
+            if hasattr(g.cls, "inertance"):
+                m_in = g.ports[:, 0]
+                R[0] -= g.cls.inertance(g.params, g.rho)*(m[m_in] - m_old[N + m_in])/self.dt
+            F[g.rows] = R.ravel()
+        F[asm.N_eqns:] = x[asm.bc_nodes] - asm.bc_values
+        return F
+
+    def jacobian(self, x):
+        '''
+        Outputs:
+            (csc_matrix) partials of residuals(), columns in the solver's
+                         fill-reducing order
+        '''
+        asm, N = self.assembly, self.N_nodes
+        P, m = x[:N], x[N:]
+        values = []
+        for g in asm.groups.values():
+            if g is self.pipes:
+                values.append(self.pipe_jacobian)
+                continue
+            J = g.jacobian(P[g.ports], m[g.ports])
+            if hasattr(g.cls, "inertance"):
+                J[0, g.ports.shape[1]] -= g.cls.inertance(g.params, g.rho)/self.dt
+            values.append(J.ravel())
+        values.append(np.ones(len(asm.bc_nodes)))
+        data = np.concatenate(values)[self.gather]
+        return csc_matrix((data, *self.csc), shape=asm.shape)
+
+
+    ### Advance one time step
+    ### ---------------------
+    def step(self, t_bound=None):
+        self.t += self.dt
+        self.apply_events(self.t)
+
+        ### Characteristics from the previous time level
+        P, m, B = self.P, self.m, self.B
+        dP_f = Pipe.loss(self.reach, m, self.rho, self.mu)
+        C_P = np.empty_like(P)
+        C_M = np.empty_like(P)
+        up, down = self.up, self.down
+        C_P[up] = P[up - 1] + B[up - 1]*m[up - 1] - dP_f[up - 1]
+        C_M[down] = P[down + 1] - B[down + 1]*m[down + 1] + dP_f[down + 1]
+
+        ### Interior points
+        P_new, m_new = np.empty_like(P), np.empty_like(m)
+        i = self.interior
+        P_new[i] = (C_P[i] + C_M[i])/2
+        m_new[i] = (C_P[i] - C_M[i])/(2*B[i])
+
+        ### Nodes, with pipe ends on their characteristics
+        x_old = self.x
+        x = x_old.copy()
+        perm = self.solver.perm_c
+        for _ in range(self.maxiter):
+            F = self.residuals(x, C_M[self.first], C_P[self.last], x_old)
+            dx = np.empty_like(x)
+            dx[perm] = splu(self.jacobian(x), permc_spec="NATURAL").solve(-F)
+            x += dx
+            if np.max(np.abs(dx)/(np.abs(x) + 1)) < self.tol:
+                break
+        else:
+            raise Exception("Node solve did not converge at t = " + str(self.t) + " s.")
+
+        N, ports = self.N_nodes, self.pipes.ports
+        P_new[self.first], m_new[self.first] = x[ports[:, 0]], x[N + ports[:, 0]]
+        P_new[self.last], m_new[self.last] = x[ports[:, 1]], x[N + ports[:, 1]]
+        self.P, self.m, self.x = P_new, m_new, x
+
+    def reached(self, t_bound):
+        ### fixed steps land on t_bound up to round-off in t
+        return self.t >= t_bound - 1e-6*self.dt
+
+
+
+### BDF coefficients (numerical differentiation formulas) [2]
+MAX_ORDER = 5
+KAPPA = np.array([0, -.1850, -1/9, -.0823, -.0415, 0])
+GAMMA = np.hstack((0, np.cumsum(1/np.arange(1, MAX_ORDER + 1))))
+ALPHA = (1 - KAPPA)*GAMMA
+ERROR_CONST = KAPPA*GAMMA + 1/np.arange(1, MAX_ORDER + 2)
+
+def change_differences(D, order, factor):
+    ### rescales the backward differences in place for step h -> factor*h
+    def R(f):
+        I = np.arange(1, order + 1)[:, None]
+        J = np.arange(1, order + 1)
+        R = np.zeros((order + 1, order + 1))
+        R[1:, 1:] = (I - 1 - f*J)/I
+        R[0] = 1
+        return np.cumprod(R, axis=0)
+    D[:order + 1] = (R(factor) @ R(1)).T @ D[:order + 1]
+
+
+class BDF(Transient):
+
+    ### Constructor
+    ### -----------
+    def __init__(self, model, dt=None, rtol=1e-6, atol=None, max_step=np.inf, \
+                 max_order=MAX_ORDER, maxiter=4):
+        '''
+        Starts from the model's steady solution (x' = 0).
+
+        Inputs:
+            model     = (Model) circuit with boundary conditions assigned
+            dt        = (scalar) [s] first step, or None for 1 us
+            rtol      = (scalar) relative local error per step
+            atol      = (scalar or vector) absolute local error per state
+                        variable, or None for rtol/1000 of the largest
+                        steady pressure and flow rate
+            max_step  = (scalar) [s] longest step, e.g. shorter than an
+                        event's duration so it is not stepped over
+            max_order = (int) highest formula order, 1 to 5
+            maxiter   = (int) Newton iterations before the step or the
+                        Jacobian is given up
+        '''
+        Transient.__init__(self, model)
+        asm, N = self.assembly, self.N_nodes
+        self.h = 1e-6 if dt is None else dt
+        self.rtol, self.max_step, self.maxiter = rtol, max_step, maxiter
+        self.max_order = min(max(int(max_order), 1), MAX_ORDER)
+        if atol is None:
+            atol = np.repeat(rtol*1e-3*np.array([np.max(np.abs(self.x[:N])), \
+                                                 np.max(np.abs(self.x[N:]))]) + 1e-12, N)
+        self.atol = atol
+        self.newton_tol = max(10*np.finfo(float).eps/rtol, min(.03, rtol**.5))
+        self.stats = {"steps": 0, "rejected": 0, "residuals": 0, "jacobians": 0, "factors": 0}
+
+        ### Storage and steady Jacobian on one column-major union pattern,
+        ### so each iteration matrix M - c J is a single array expression
+        M, _, _ = asm.dynamics(self.x)
+        self.M = M
+        M, J = M.tocoo(), asm.jacobian(self.x).tocoo()
+        n = len(self.x)
+        keys, inverse = np.unique(np.concatenate([M.col*n + M.row, J.col*n + J.row]), \
+                                  return_inverse=True)
+        self.M_slots, self.J_slots = inverse[:M.nnz], inverse[M.nnz:]
+        self.M_data = np.bincount(self.M_slots, M.data, len(keys))
+        self.pattern = (keys % n, np.concatenate([[0], np.cumsum(np.bincount(keys//n, minlength=n))]))
+        self.shape = (n, n)
+        self.J = None
+        self.LU = None
+
+        ### Error is controlled on the differential variables only (columns
+        ### of M); algebraic ones follow them and jump with the boundary values
+        self.differential = np.unique(M.col[M.data != 0])
+
+        ### Backward differences of the interpolating polynomial
+        self.D = np.zeros((MAX_ORDER + 3, n))
+        self.D[0] = self.x
+        self.order = 1
+        self.n_equal_steps = 0
+
+
+    ### Right-hand side and its Jacobian
+    ### --------------------------------
+    def rhs(self, t, x):
+        self.apply_events(t)
+        self.stats["residuals"] += 1
+        return self.assembly.residuals(x)
+
+    def refresh_jacobian(self, t, x):
+        self.apply_events(t)
+        self.stats["jacobians"] += 1
+        J = self.assembly.jacobian(x).tocoo()
+        self.J = np.bincount(self.J_slots, J.data, len(self.M_data))
+
+    def factor(self, c):
+        self.stats["factors"] += 1
+        A = csc_matrix((self.M_data - c*self.J, *self.pattern), shape=self.shape)
+        return splu(A)
+
+    def norm(self, x, scale):
+        return np.sqrt(np.mean((x[self.differential]/scale[self.differential])**2))
+
+
+    ### Newton iteration of one implicit step
+    ### -------------------------------------
+    def newton(self, t, x_predict, c, psi, LU, scale):
+        '''
+        Solves M (x - x_predict) = c F(x, t) - M psi for x.
+
+        Outputs:
+            (bool) converged, (int) iterations, (vector) x, (vector) x - x_predict
+        '''
+        d = np.zeros_like(x_predict)
+        x = x_predict.copy()
+        dx_norm_old = None
+        converged = False
+        M = self.M
+        for k in range(self.maxiter):
+            F = self.rhs(t, x)
+            if not np.all(np.isfinite(F)):
+                break
+            dx = LU.solve(c*F - M @ (psi + d))
+            dx_norm = self.norm(dx, scale)
+            rate = None if dx_norm_old is None else dx_norm/dx_norm_old
+            if rate is not None and (rate >= 1 or \
+               rate**(self.maxiter - k)/(1 - rate)*dx_norm > self.newton_tol):
+                break
+            x += dx
+            d += dx
+            if dx_norm == 0 or (rate is not None and rate/(1 - rate)*dx_norm < self.newton_tol):
+                converged = True
+                break
+            dx_norm_old = dx_norm
+        return converged, k + 1, x, d
+
+
+    ### Advance one accepted step
+    ### -------------------------
+    def step(self, t_bound=np.inf):
+        D, order = self.D, self.order
+        h = self.h
+        min_step = 10*np.abs(np.nextafter(self.t, np.inf) - self.t)
+        if h > self.max_step:
+            change_differences(D, order, self.max_step/h)
+            h = self.max_step
+            self.n_equal_steps = 0
+            self.LU = None
+        current_jacobian = self.J is None
+        if current_jacobian:
+            self.refresh_jacobian(self.t, self.x)
+
+        LU = self.LU
+        while True:
+            if h < min_step:
+                raise Exception("Step size fell below " + str(min_step) + " s at t = " + \
+                                str(self.t) + " s.")
+            t_new = self.t + h
+            if t_new > t_bound:
+                t_new = t_bound
+                change_differences(D, order, (t_new - self.t)/h)
+                self.n_equal_steps = 0
+                LU = None
+                h = t_new - self.t
+
+            x_predict = np.sum(D[:order + 1], axis=0)
+            scale = self.atol + self.rtol*np.abs(x_predict)
+            psi = D[1:order + 1].T @ GAMMA[1:order + 1]/ALPHA[order]
+            c = h/ALPHA[order]
+
+            ### Reuse the iteration matrix, refreshing the Jacobian only
+            ### once the iteration fails with a stale one
+            while True:
+                if LU is None:
+                    LU = self.factor(c)
+                converged, n_iter, x_new, d = self.newton(t_new, x_predict, c, psi, LU, scale)
+                if converged or current_jacobian:
+                    break
+                self.refresh_jacobian(t_new, x_predict)
+                current_jacobian = True
+                LU = None
+
+            if not converged:
+                self.stats["rejected"] += 1
+                change_differences(D, order, .5)
+                h *= .5
+                self.n_equal_steps = 0
+                LU = None
+                continue
+
+            ### Local error estimate
+            safety = .9*(2*self.maxiter + 1)/(2*self.maxiter + n_iter)
+            scale = self.atol + self.rtol*np.abs(x_new)
+            error_norm = self.norm(ERROR_CONST[order]*d, scale)
+            if error_norm > 1:
+                self.stats["rejected"] += 1
+                factor = max(.2, safety*error_norm**(-1/(order + 1)))
+                change_differences(D, order, factor)
+                h *= factor
+                self.n_equal_steps = 0
+                continue
+            break
+
+        self.stats["steps"] += 1
+        self.n_equal_steps += 1
+        self.t, self.x, self.h, self.LU = t_new, x_new, h, LU
+
+        ### Update differences, D^(j+1) x_n = D^j x_n - D^j x_(n-1)
+        D[order + 2] = d - D[order + 1]
+        D[order + 1] = d
+        for i in reversed(range(order + 1)):
+            D[i] += D[i + 1]
+        if self.n_equal_steps < order + 1:
+            return
+
+        ### Order and step size for what follows
+        error_m = self.norm(ERROR_CONST[order - 1]*D[order], scale) if order > 1 else np.inf
+        error_p = self.norm(ERROR_CONST[order + 1]*D[order + 2], scale) \
+                  if order < self.max_order else np.inf
+        with np.errstate(divide="ignore"):
+            factors = np.array([error_m, error_norm, error_p])**(-1/np.arange(order, order + 3))
+        self.order = order + np.argmax(factors) - 1
+        factor = min(10, safety*np.max(factors))
+        change_differences(D, self.order, factor)
+        self.h = h*factor
+        self.n_equal_steps = 0
+        self.LU = None
@@ -0,0 +1,66 @@
+'''
+Throughput of the array friction factor kernels against a pointwise
+math-based loop over 10^6 (Re, relative roughness) points.
+
+Run from the tests directory:
+    python bench_friction.py
+
+'''
+
+import sys
+import os
+sys.path.append(os.path.abspath("../src"))
+
+import time
+import numpy as np
+from math import sqrt, log10
+import pipe
+
+
+
+### Pointwise reference formulas
+### ----------------------------
+def f_colebrook_scalar(Dh, epsilon, Re):
+    ### Colebrook-White fixed point, iterated to convergence
+    if Re < 2100: return 64/Re
+    f, f_old = .05, 0
+    while abs(f - f_old) > 1e-15*f:
+        f, f_old = (2*log10(epsilon/(3.7*Dh) + 2.51/(Re*sqrt(f))))**-2, f
+    return f
+
+def f_churchill_scalar(Dh, epsilon, Re):
+    if Re < 2100: return 64/Re
+    return (2*log10(epsilon/(3.7*Dh) + (7/Re)**.9))**-2
+
+
+### Time both paths
+### ---------------
+def bench(n=10**6, n_scalar=10**6, seed=0):
+    '''
+    Inputs:
+        n        = (int) points evaluated by the array kernels
+        n_scalar = (int) points evaluated by the pointwise loop, scaled to n
+        seed     = (int) random generator seed
+    '''
+    rng = np.random.default_rng(seed)
+    Re = 10**rng.uniform(2, 9, n)
+    epsilon = 10**rng.uniform(-7, -1.3, n) # Dh = 1
+    n_scalar = min(n_scalar, n)
+
+    for name, f_array, f_scalar in (("Colebrook-White", pipe.f_colebrook_white, f_colebrook_scalar), \
+                                    ("Churchill", pipe.f_churchill, f_churchill_scalar)):
+        start = time.perf_counter()
+        f = f_array(1, epsilon, Re)
+        t_array = time.perf_counter() - start
+
+        start = time.perf_counter()
+        f_ref = np.array([f_scalar(1, epsilon[i], Re[i]) for i in range(n_scalar)])
+        t_scalar = (time.perf_counter() - start)*n/n_scalar
+
+        error = np.max(np.abs(f[:n_scalar]/f_ref - 1))
+        print(f"{name:16s} array {n/t_array:10.3g} points/s   scalar {n/t_scalar:10.3g} points/s" \
+              f"   speedup {t_scalar/t_array:6.1f}x   max rel. difference {error:.1e}")
+
+
+if __name__ == "__main__":
+    bench(n_scalar=int(sys.argv[1]) if len(sys.argv) > 1 else 10**6)
@@ -11,6 +11,9 @@ sys.path.append(os.path.abspath("../src"))
 
 import fluid
 import numpy as np
+import pytest
+from scipy.interpolate import interp1d
+from fluid import GridTable
 import matplotlib.pyplot as plt
 
 
@@ -64,4 +67,97 @@ def test_interp_data(fluid_name):
     plt.ylabel("Pa*s")
     
     plt.tight_layout()
-    plt.show()
\ No newline at end of file
+    plt.show()
+
+
+### Spline tables reproduce the cubic interpolants
+### ----------------------------------------------
+def test_spline_table():
+    jet = fluid.Fluid("JetA")
+    T = np.linspace(min(jet.T_data), max(jet.T_data), 1001).reshape(7, 143)
+    props = jet.properties(T)
+    assert props.shape == (4,) + T.shape
+    for name, values in zip(fluid.PROPERTIES, props):
+        data = getattr(jet, name + "_data")
+        assert np.allclose(values, interp1d(jet.T_data, data, kind='cubic')(T), rtol=1e-12)
+        assert np.allclose(getattr(jet, name)(T), values, rtol=0)
+    
+    # subsets in the requested order, scalar temperatures, table bounds
+    rho, mu = jet.properties(300., ("rho", "mu"))
+    assert rho == jet.rho(300.) and mu == jet.mu(300.)
+    assert jet.rho() == jet.rho_data[0]
+    with pytest.raises(ValueError):
+        jet.mu(200.)
+
+
+### One shared instance per fluid, cached in binary next to its CSV
+### ---------------------------------------------------------------
+def test_fluid_registry(tmp_path, monkeypatch):
+    assert fluid.Fluid("JetA").table is fluid.Fluid("JetA").table
+    assert not fluid.Fluid("JetA").rho_data.flags.writeable
+    
+    # cache follows the source file's content
+    csv_path = str(tmp_path/"Test_data.csv")
+    monkeypatch.setattr(fluid, "data_path", \
+                        lambda name, extension=".csv", kind="data": str(tmp_path/("Test_data" + extension)))
+    with open(csv_path, "w") as f:
+        f.write("T,rho,cp,k,mu\n" + "".join(str(250 + 10*i) + "," + str(800 - i) + \
+                                            ",2000,0.15,0.001\n" for i in range(6)))
+    rho = fluid.read_data("Test")["rho"]
+    assert os.path.exists(str(tmp_path/"Test_data.npz")) and rho[0] == 800
+    
+    monkeypatch.setattr(fluid, "parse_csv", None) # cache hits must not parse
+    os.utime(csv_path, ns=(0, 0))
+    assert np.array_equal(fluid.read_data("Test")["rho"], rho)
+    assert np.array_equal(fluid.read_data("Test")["rho"], rho)
+    
+    monkeypatch.undo()
+    monkeypatch.setattr(fluid, "data_path", \
+                        lambda name, extension=".csv", kind="data": str(tmp_path/("Test_data" + extension)))
+    with open(csv_path, "w") as f:
+        f.write("T,rho,cp,k,mu\n" + "".join(str(250 + 10*i) + ",700,2000,0.15,0.001\n" \
+                                            for i in range(6)))
+    assert fluid.read_data("Test")["rho"][0] == 700
+
+
+### Bicubic (T, P) tables
+### ---------------------
+def test_grid_table():
+    T, P = np.linspace(60, 120, 13), np.geomspace(1e5, 1e7, 11)
+    TT, PP = np.meshgrid(T, P, indexing="ij")
+    cubic = lambda T, P: T**3*P**2/1e12 - T*P**3/1e18 + T**2
+    smooth = lambda T, P: 1e-3*np.exp(-T/30)*(1 + P/1e8)
+    table = GridTable(T, P, np.stack([cubic(TT, PP), smooth(TT, PP)], axis=-1))
+    
+    rng = np.random.default_rng(0)
+    T_q, P_q = rng.uniform(60, 120, (100, 50)), rng.uniform(1e5, 1e7, (100, 50))
+    values = table(T_q, P_q)
+    assert values.shape == (2, 100, 50)
+    assert np.allclose(values[0], cubic(T_q, P_q), rtol=1e-12, atol=1e-9)
+    assert np.allclose(values[1], smooth(T_q, P_q), rtol=1e-4)
+    assert np.allclose(table(T[4], P, [1])[0], smooth(T[4], P), rtol=1e-12)
+    
+    linear = GridTable(T, P, smooth(TT, PP)[..., None], kind="linear")
+    assert np.allclose(linear(T_q, P_q)[0], smooth(T_q, P_q), rtol=1e-2)
+    with pytest.raises(ValueError):
+        table(50., 1e6)
+
+
+### Fluids with (T, P) tables behind the usual accessors
+### ----------------------------------------------------
+def test_TP_fluid(tmp_path, monkeypatch):
+    monkeypatch.setattr(fluid, "data_path", lambda name, extension=".csv", kind="data": \
+                        str(tmp_path/(name + "_" + kind + extension)))
+    monkeypatch.setattr(fluid, "fluids", ["Cryo"])
+    monkeypatch.setattr(fluid, "registry", {})
+    rows = [(T, P, 1300 - 3*T + 1e-6*P, 1e-5*T) for P in (1e5, 1e6, 5e6) for T in (60, 70, 80, 90)]
+    with open(str(tmp_path/"Cryo_TP.csv"), "w") as f:
+        f.write("T,P,rho,mu\n" + "".join(",".join(map(str, row)) + "\n" for row in rows))
+    
+    lox = fluid.Fluid("Cryo")
+    assert np.isclose(lox.rho(75., 2e6), 1300 - 225 + 2)
+    rho, mu = lox.properties(np.array([65., 85.]), ("rho", "mu"), 3e6)
+    assert np.allclose(rho, 1300 - 3*np.array([65, 85]) + 3) and np.allclose(mu, [6.5e-4, 8.5e-4])
+    assert np.isclose(fluid.interp_mu("Cryo", 70.), 7e-4)
+    with pytest.raises(Exception):
+        lox.cp(70.)
@@ -0,0 +1,525 @@
+'''
+Tests for steady-state assembly and solution of fluid circuits.
+
+'''
+
+import sys
+import os
+sys.path.append(os.path.abspath("../src"))
+
+import numpy as np
+from network import Network
+from pipe import Pipe
+from orifice import Orifice, dP_from_K
+from reducer import Reducer
+from tee import Tee
+from model import Model
+from modal import match_modes
+
+
+
+### Helper circuits
+### ---------------
+def build_feed(P_in=2e6, P_out=1e6):
+    ### pipe -> orifice -> reducer -> pipe
+    p1 = Pipe("p1", 2, .02, 1e-5)
+    o = Orifice("o", .005)
+    o.set_Knet(2.0)
+    r = Reducer("r", .02, .015, .05, 15, 1e-5)
+    p2 = Pipe("p2", 1, .015, 1e-5)
+    p1.tie_in(o, 1, 0)
+    o.tie_in(r, 1, 0)
+    r.tie_in(p2, 1, 0)
+
+    model = Model(Network(p1), "JetA")
+    model.add_BC("pressure", p1.ports[0], P_in)
+    model.add_BC("pressure", p2.ports[1], P_out)
+    return model
+
+def build_manifold(N_branches=4, P_in=2e6, P_out=1e6):
+    ### feed pipe splitting into orifice branches through a ladder of tees
+    feed = Pipe("feed", 2, .02, 1e-5)
+    last, port = feed, 1
+    branches = []
+    for i in range(N_branches):
+        branch = Orifice("o"+str(i), .002 + .0002*i)
+        branch.set_Knet(1.5)
+        branches.append(branch)
+        if i < N_branches - 1:
+            tee = Tee("tee"+str(i), "diverging")
+            last.tie_in(tee, port, 0)
+            tee.tie_in(branch, 1, 0)
+            last, port = tee, 2
+        else:
+            last.tie_in(branch, port, 0)
+
+    model = Model(Network(feed), "JetA")
+    model.add_BC("pressure", feed.ports[0], P_in)
+    for branch in branches:
+        model.add_BC("pressure", branch.ports[1], P_out)
+    return model, branches
+
+def build_line(N_segments, l=20., P_in=2e6, P_out=1e6):
+    ### long compliant line split into segments -> injector orifice
+    segments = [Pipe("p"+str(i), l/N_segments, .02, 1e-5, a=1000.) \
+                for i in range(N_segments)]
+    for a, b in zip(segments[:-1], segments[1:]):
+        a.tie_in(b, 1, 0)
+    o = Orifice("o", .005, lo=.01)
+    o.set_Knet(2.0)
+    segments[-1].tie_in(o, 1, 0)
+
+    model = Model(Network(segments[0]), "JetA")
+    model.add_BC("pressure", segments[0].ports[0], P_in)
+    model.add_BC("pressure", o.ports[1], P_out)
+    return model, segments + [o]
+
+def build_large_manifold(N_units, P_in=2e6, P_out=1e6):
+    ### long header pipe feeding one injector orifice per tee
+    feed = Pipe("feed", 1, .1, 1e-5)
+    last, port = feed, 1
+    outlets = []
+    for i in range(N_units + 1):
+        o = Orifice("o"+str(i), .0003)
+        o.set_Knet(1.5)
+        outlets.append(o)
+        if i == N_units:
+            last.tie_in(o, port, 0)
+            break
+        seg = Pipe("seg"+str(i), .05, .1, 1e-5)
+        tee = Tee("tee"+str(i), "diverging")
+        last.tie_in(seg, port, 0)
+        seg.tie_in(tee, 1, 0)
+        tee.tie_in(o, 1, 0)
+        last, port = tee, 2
+
+    model = Model(Network(feed), "JetA")
+    model.add_BC("pressure", feed.ports[0], P_in)
+    for o in outlets:
+        model.add_BC("pressure", o.ports[1], P_out)
+    return model
+
+def scalar_residuals(model, x):
+    ### Reference residuals from per-element equations, in assembly row order
+    F = np.empty(model.N_sv)
+    for group in model.assembly.groups.values():
+        for k, el in enumerate(group.elements):
+            F[group.eq_rows[:, k]] = el.steady_flow_eqns(x, model.N_sv, \
+                                                        *model.element_properties(el))
+    F[model.assembly.N_eqns:] = x[model.assembly.bc_nodes] - model.assembly.bc_values
+    return F
+
+
+
+### Vectorized residuals match per-element equations
+### -------------------------------------------------
+def test_vectorized_residuals():
+    rng = np.random.default_rng(0)
+    for model in (build_feed(), build_manifold()[0]):
+        model.compile()
+        x = np.concatenate([rng.uniform(1e6, 2e6, model.N_nodes), \
+                            rng.uniform(-1, 1, model.N_nodes)])
+        assert np.allclose(model.build_steady_system(x), scalar_residuals(model, x))
+
+        # batched evaluation
+        X = np.stack([x, 2*x])
+        F = model.build_steady_system(X)
+        assert np.allclose(F[1], model.build_steady_system(2*x))
+
+
+### Steady solve of series feed
+### ---------------------------
+def test_steady_feed():
+    model = build_feed()
+    assert model.steady_solve().success
+    assert np.allclose(model.mdot_steady, model.mdot_steady[0])
+    assert np.all(np.diff(model.P_steady) < 0)
+
+    # orifice drop matches hand calc
+    o = model.circuit.elements[1]
+    rho = model.element_properties(o)[0]
+    dP = model.P_steady[o.ports[0]] - model.P_steady[o.ports[1]]
+    assert np.isclose(dP, dP_from_K(o.Knet, model.mdot_steady[0], o.do, rho))
+
+
+### Steady solve of tee manifold
+### ----------------------------
+def test_steady_manifold():
+    model, branches = build_manifold()
+    assert model.steady_solve().success
+    feed = model.circuit.elements[0]
+    total = sum(model.mdot_steady[b.ports[0]] for b in branches)
+    assert np.isclose(total, model.mdot_steady[feed.ports[1]])
+
+
+### Assembly follows element swaps
+### ------------------------------
+def test_assembly_update():
+    model, branches = build_manifold()
+    model.compile()
+    groups = dict(model.assembly.groups)
+
+    ### Same-type swap updates the orifice group in place
+    new = Orifice("new", .004)
+    new.set_Knet(1.0)
+    model.circuit.replace(branches[1], new)
+    model.compile()
+    assert model.assembly.groups[Pipe] is groups[Pipe]
+    assert model.assembly.groups[Orifice] is groups[Orifice]
+
+    ### Type change rebuilds only the affected groups
+    pipe = Pipe("pipe", .5, .004, 1e-5)
+    model.circuit.replace(branches[2], pipe)
+    model.compile()
+    assert model.assembly.groups[Tee] is groups[Tee]
+
+    x = np.linspace(1, 2, model.N_sv)
+    fresh = Model(model.circuit, "JetA")
+    fresh.P_bc, fresh.mdot_bc = model.P_bc, model.mdot_bc
+    fresh.compile()
+    assert np.allclose(np.sort(model.build_steady_system(x)), \
+                       np.sort(fresh.build_steady_system(x)))
+
+
+### Removing an inner element leaves one row per element
+### -----------------------------------------------------
+def test_assembly_remove():
+    pipes = [Pipe("p"+str(i), 1, .02, 1e-5) for i in range(5)]
+    for a, b in zip(pipes[:-1], pipes[1:]):
+        a.tie_in(b, 1, 0)
+    model = Model(Network(pipes[0]), "JetA")
+    model.add_BC("pressure", pipes[0].ports[0], 2e6)
+    model.add_BC("pressure", pipes[-1].ports[1], 1e6)
+    model.steady_solve()
+
+    pipes[0].remove() # the last element moves into its number
+    model.refresh()
+    model.add_BC("pressure", pipes[1].ports[0], 2e6)
+    sol = model.steady_solve()
+    assert sol.success
+    group = model.assembly.groups[Pipe]
+    assert list(group.ids) == [0, 1, 2, 3]
+    assert [el.id for el in group.elements] == [0, 1, 2, 3]
+
+    fresh = Model(model.circuit, "JetA")
+    fresh.P_bc, fresh.mdot_bc = model.P_bc, model.mdot_bc
+    assert np.allclose(fresh.steady_solve().x, sol.x)
+    assert np.array_equal(fresh.assembly.groups[Pipe].ports, group.ports)
+
+
+### Analytic Jacobian matches finite differences
+### --------------------------------------------
+def test_jacobian():
+    rng = np.random.default_rng(1)
+    for model in (build_feed(), build_manifold()[0]):
+        model.compile()
+        # flows spanning laminar and turbulent regimes
+        x = np.concatenate([rng.uniform(1e6, 2e6, model.N_nodes), \
+                            rng.uniform(-1, 1, model.N_nodes)])
+        J = model.build_steady_jacobian(x).toarray()
+
+        J_fd = np.empty_like(J)
+        F = model.build_steady_system(x)
+        for v in range(model.N_sv):
+            h = 1e-6*max(abs(x[v]), 1e-3)
+            xh = x.copy()
+            xh[v] += h
+            J_fd[:, v] = (model.build_steady_system(xh) - F)/h
+
+        assert np.allclose(J, J_fd, rtol=1e-3, atol=1e-3*np.abs(J).max())
+
+
+### Sparse Newton backends agree with dense rootfinding
+### ---------------------------------------------------
+def test_newton_backends():
+    model, _ = build_manifold()
+    reference = model.steady_solve("hybr").x
+    for method in ("newton", "krylov"):
+        sol = model.steady_solve(method)
+        assert sol.success
+        assert np.allclose(sol.x, reference, rtol=1e-6)
+
+
+### Stalled line search is not reported as converged
+### --------------------------------------------------
+def test_newton_stall():
+    from scipy.sparse import csr_matrix
+    from solver import NewtonSolver
+    fun = lambda x: x - 1
+    jac = lambda x: csr_matrix(-1e5*np.eye(len(x))) # wrong sign: ascent steps of ~1e-5
+    solver = NewtonSolver("newton")
+    sol = solver.solve(fun, jac, np.zeros(3))
+    assert not sol.success and sol.message == "Line search stalled."
+    
+    batch = solver.solve_batch(lambda X, idx: X - 1, \
+                               lambda X, idx: csr_matrix(-1e5*np.eye(X.size)), np.zeros((2, 3)))
+    assert not np.any(batch.success)
+
+
+### Large manifold converges
+### -------------------------
+def test_newton_large():
+    model = build_large_manifold(15000) # 60k nodes
+    sol = model.steady_solve("newton")
+    assert sol.success
+    assert np.max(np.abs(sol.fun[model.assembly.N_eqns:])) < 1e-6
+
+
+### Batched sweep matches point-by-point solves
+### -------------------------------------------
+def test_sweep():
+    model, branches = build_manifold()
+    inlet = model.circuit.elements[0].ports[0]
+    P_tank = np.linspace(1.2e6, 3e6, 50)
+
+    results = model.sweep(P_bc={inlet: P_tank})
+    assert results.shape == (50, model.N_sv)
+    assert np.allclose(results[:, inlet], P_tank)
+
+    for k in (0, 17, 49):
+        model.add_BC("pressure", inlet, P_tank[k])
+        model.steady_solve()
+        assert np.allclose(results[k, :model.N_nodes], model.P_steady, rtol=1e-8)
+        assert np.allclose(results[k, model.N_nodes:], model.mdot_steady, rtol=1e-6)
+
+    # one outlet swept as a flow demand at the same time
+    outlet = branches[0].ports[1]
+    results = model.sweep(P_bc={inlet: P_tank}, mdot_bc={outlet: np.linspace(.05, .1, 50)})
+    assert np.allclose(results[:, model.N_nodes + outlet], np.linspace(.05, .1, 50))
+
+
+### Warm starts and continuation across sequential solves
+### -----------------------------------------------------
+def test_warm_start():
+    model, branches = build_manifold()
+    inlet = model.circuit.elements[0].ports[0]
+    cold = model.steady_solve(guess="ones")
+    assert cold.success and not model.solve_log[-1]["warm"]
+
+    ### Small boundary change: one warm solve, fewer iterations
+    model.add_BC("pressure", inlet, 2.1e6)
+    warm = model.steady_solve()
+    assert warm.success and warm.steps == 1
+    assert warm.nit < cold.nit
+    reference = model.steady_solve(warm_start=False).x
+    assert np.allclose(warm.x, reference, rtol=1e-8)
+
+    ### Large boundary change is walked in continuation steps
+    model.add_BC("pressure", inlet, 6e6)
+    sol = model.steady_solve(max_step=.2)
+    assert sol.success and sol.steps > 1
+    assert np.isclose(model.P_steady[inlet], 6e6)
+    assert np.allclose(sol.x, model.steady_solve(warm_start=False).x, rtol=1e-8)
+
+    ### Edited element parameters are continued too
+    branches[0].set_Knet(15)
+    model.element_changed(branches[0])
+    sol = model.steady_solve(max_step=.5)
+    assert sol.success and sol.steps > 1
+    assert model.assembly.groups[Orifice].params["Knet"][0] == 15
+    assert model.assembly.param_changes == []
+
+    report = model.warm_start_report()
+    assert report["warm_solves"] == 3 and report["continuation_steps"] >= 2
+
+    ### A failed solve keeps the last converged state
+    x = model.steady_state()
+    model.add_BC("pressure", inlet, 3e6)
+    sol = model.steady_solve(warm_start=False, guess="ones", maxiter=1)
+    assert not sol.success and np.array_equal(model.steady_state(), x)
+
+
+### Linearized-network initial guess
+### --------------------------------
+def test_initial_guess():
+    model = build_large_manifold(2000, P_in=1.01e6)
+    model.compile()
+    x0 = model.initial_guess()
+
+    # exact on boundary rows and on the (linear) continuity equations
+    F = model.build_steady_system(x0)
+    assert np.allclose(F[model.assembly.N_eqns:], 0)
+    for group in model.assembly.groups.values():
+        if group.cls is not Tee:
+            assert np.allclose(F[group.eq_rows[1]], 0, atol=1e-10)
+    assert np.all(x0[model.N_nodes:] > 0)
+
+    # fewer Newton iterations than a uniform guess
+    ones = model.steady_solve(warm_start=False, guess="ones")
+    linear = model.steady_solve(warm_start=False)
+    assert ones.success and linear.success
+    assert linear.nit < ones.nit
+    assert np.allclose(ones.x, linear.x, rtol=1e-8)
+
+    # batched guesses share one factorization
+    values = np.stack([model.assembly.bc_values, 2*model.assembly.bc_values])
+    X0 = model.initial_guess(values)
+    assert X0.shape == (2, model.N_sv)
+    assert np.allclose(X0[1, model.assembly.bc_nodes], values[1])
+
+
+### Sparse linearized dynamics matrices
+### ------------------------------------
+def test_dynamics_mats():
+    model = build_feed()
+    model.steady_solve()
+    p1, o, r, p2 = model.circuit.elements
+    p1.a = 1200.
+    model.element_changed(p1)
+    M, C, K = model.build_dynamics_mats()
+    assert M.format == C.format == K.format == "csr"
+    assert K.nnz == 0
+
+    # mass-flow inertances on momentum rows, compliance at the pipe outlet
+    group = model.assembly.groups[Pipe]
+    rho = model.element_properties(p1)[0]
+    row = group.eq_rows[0, 0]
+    assert np.isclose(M[row, model.N_nodes + p1.ports[0]], p1.I(rho)/rho)
+    row = group.eq_rows[1, 0]
+    assert np.isclose(M[row, p1.ports[1]], p1.C(rho)) and M[row, p1.ports[0]] == 0
+    for el in (o, r, p2):
+        group = model.assembly.groups[type(el)]
+        k = list(group.ids).index(el.id)
+        rho = model.element_properties(el)[0]
+        assert np.isclose(M[group.eq_rows[0, k], model.N_nodes + el.ports[0]], el.I(rho)/rho)
+
+    # damping is the negated steady Jacobian
+    J = model.build_steady_jacobian(model.steady_state())
+    assert np.allclose(C.toarray(), -J.toarray())
+
+    # large networks stay sparse
+    model = build_large_manifold(5000)
+    model.steady_solve()
+    M, C, K = model.build_dynamics_mats()
+    assert M.nnz < 2*model.N_sv and C.nnz < 10*model.N_sv
+
+
+### Shift-invert eigensolver
+### ------------------------
+def test_eigen_solve():
+    ### pipe (inertance, compliance) -> orifice (inertance) between two tanks
+    p = Pipe("p", 5, .02, 1e-5, a=1000)
+    o = Orifice("o", .005, lo=.01)
+    o.set_Knet(2.0)
+    p.tie_in(o, 1, 0)
+    model = Model(Network(p), "JetA")
+    model.add_BC("pressure", p.ports[0], 2e6)
+    model.add_BC("pressure", o.ports[1], 1e6)
+    model.steady_solve()
+    f_n, zeta = model.eigen_solve(k=3, f_target=1.)
+
+    ### Characteristic polynomial of the one-node circuit
+    rho, mu = model.element_properties(p)
+    m = model.mdot_steady[0]
+    R_p = Pipe.loss_jacobian(Pipe.pack([p]), np.array([m]), rho, mu)[0]
+    R_o = Orifice.loss_jacobian(Orifice.pack([o]), np.array([m]), rho, mu)[0]
+    I_p, I_o, c = p.I(rho)/rho, o.I(rho)/rho, p.C(rho)
+    roots = np.roots([I_p*c*I_o, I_p*c*R_o + R_p*c*I_o, I_p + R_p*c*R_o + I_o, R_p + R_o])
+    roots = roots[roots.imag >= 0]
+    assert np.any(roots.imag > 0)
+    assert np.allclose(np.sort_complex(model.omega_n), np.sort_complex(roots), rtol=1e-6)
+    assert np.allclose(zeta, -model.omega_n.real/np.abs(model.omega_n))
+
+    # mode shapes satisfy the quadratic pencil
+    M, C, K = model.M, model.C, model.K
+    for lam, x in zip(model.omega_n, model.mode_shapes.T):
+        assert np.linalg.norm(lam*M @ x + C @ x + K @ x/lam) < 1e-6*np.abs(C).max()
+
+
+### Frequency response sweep
+### ------------------------
+def test_frequency_response():
+    model, branches = build_manifold()
+    feed = model.circuit.elements[0]
+    feed.a = 1000.
+    for b in branches:
+        b.lo = .01
+    model.element_changed(feed, *branches)
+    inlet, outlet = feed.ports[0], branches[0].ports[0]
+    model.steady_solve()
+
+    f = np.linspace(0, 500, 301)
+    H = model.frequency_response(f, [("pressure", inlet)], \
+                                 [("flowrate", outlet), ("pressure", inlet)], batch=40)
+    assert H.shape == (301, 2, 1)
+    assert np.allclose(H[:, 1, 0], 1)
+
+    # DC gain is the steady sensitivity
+    dP = 1e3
+    model.add_BC("pressure", inlet, 2e6 + dP)
+    mdot = model.steady_solve().x[model.N_nodes + outlet]
+    model.add_BC("pressure", inlet, 2e6)
+    mdot0 = model.steady_solve().x[model.N_nodes + outlet]
+    assert np.isclose(H[0, 0, 0].real, (mdot - mdot0)/dP, rtol=1e-3)
+
+    # matches a direct solve, and threads reproduce the serial sweep
+    M, C, K = model.build_dynamics_mats()
+    w = 2*np.pi*f[123]
+    b = np.zeros(model.N_sv)
+    b[model.assembly.N_eqns] = -1
+    x = np.linalg.solve((C + 1j*w*M).toarray(), b)
+    assert np.isclose(H[123, 0, 0], x[model.N_nodes + outlet])
+    H_threads = model.frequency_response(f, [("pressure", inlet)], \
+                                         [("flowrate", outlet), ("pressure", inlet)], \
+                                         batch=40, threads=4)
+    assert np.allclose(H_threads, H)
+
+
+### Distributed-parameter pipes
+### ---------------------------
+def test_transfer_matrix():
+    f = np.linspace(1, 200, 50)
+    model, run = build_line(1)
+    model.steady_solve()
+    inlet, outlet = run[0].ports[0], run[-1].ports[1]
+    H = model.frequency_response(f, [("pressure", inlet)], [("flowrate", outlet)], \
+                                 distributed=True)[:, 0, 0]
+
+    # chained matrix is reciprocal and gives the FRF between fixed pressures
+    T = model.transfer_matrix(run, f)
+    assert np.allclose(np.linalg.det(T), 1)
+    assert np.allclose(1/T[:, 0, 1], H)
+
+    # exact segments chain back to the whole line
+    model_10, run_10 = build_line(10)
+    model_10.steady_solve()
+    assert np.allclose(model_10.transfer_matrix(run_10, f), T)
+    H_10 = model_10.frequency_response(f, [("pressure", inlet)], \
+                                       [("flowrate", run_10[-1].ports[1])], \
+                                       distributed=True)[:, 0, 0]
+    assert np.allclose(H_10, H)
+
+    # lumped segments converge to the exact line
+    errors = []
+    for N in (40, 400):
+        model_N, run_N = build_line(N)
+        model_N.steady_solve()
+        H_N = model_N.frequency_response(f, [("pressure", inlet)], \
+                                         [("flowrate", run_N[-1].ports[1])])[:, 0, 0]
+        errors.append(np.max(np.abs(H_N - H)/np.abs(H)))
+    assert errors[1] < .05 and errors[1] < errors[0]/4
+
+
+### Mode tracking through a parameter sweep
+### ---------------------------------------
+def test_track_modes():
+    model, run = build_line(10)
+    inlet = run[0].ports[0]
+    P = np.linspace(1.5e6, 3e6, 8)
+    F, Z, MAC = model.track_modes(P, lambda v: model.add_BC("pressure", inlet, v), \
+                                  k=4, f_target=50.)
+    assert F.shape == Z.shape == MAC.shape == (8, 4)
+    assert np.all(np.isfinite(F)) and np.all(MAC > .9)
+    assert not any(log["cold"] for log in model.tracking_log[1:])
+    assert np.max(np.abs(np.diff(F, axis=0))) < 5
+
+    # tracked modes are modes of the last point, in their original order
+    f_n, zeta = model.eigen_solve(k=8, f_target=50.)
+    for f, z in zip(F[-1], Z[-1]):
+        i = np.argmin(np.abs(f_n - f))
+        assert np.isclose(f_n[i], f, rtol=1e-6) and np.isclose(zeta[i], z, rtol=1e-4)
+
+    # MAC pairing recovers a permutation of mode shapes
+    X = np.random.default_rng(0).standard_normal((30, 4))
+    match, mac = match_modes(X, 2j*X[:, [2, 0, 3, 1]])
+    assert np.array_equal(match, [1, 3, 0, 2]) and np.allclose(mac, 1)
@@ -0,0 +1,86 @@
+'''
+Tests for Monte Carlo tolerance analysis.
+
+'''
+
+import sys
+import os
+sys.path.append(os.path.abspath("../src"))
+
+import numpy as np
+import pytest
+from orifice import Orifice
+from pipe import Pipe
+from montecarlo import MonteCarlo, Summary
+from test_model import build_manifold
+
+
+
+### Streaming statistics match batch statistics
+### --------------------------------------------
+def test_summary():
+    rng = np.random.default_rng(0)
+    X = rng.normal(5, 2, (20000, 3))
+    summary = Summary(X[:100].min(axis=0), X[:100].max(axis=0), 400)
+    for chunk in np.array_split(X, 7):
+        summary.update(chunk)
+
+    assert summary.count == len(X)
+    assert np.allclose(summary.mean, X.mean(axis=0))
+    assert np.allclose(summary.std, X.std(axis=0, ddof=1))
+    assert np.allclose(summary.percentile([5, 50, 95]), \
+                       np.percentile(X, [5, 50, 95], axis=0), atol=.05)
+
+
+### Flow-split statistics bracket the tolerance extremes
+### -----------------------------------------------------
+def test_tolerance_bounds():
+    model, branches = build_manifold()
+    outlet = model.N_nodes + branches[0].ports[1]
+
+    ### Reference solves at the ends of the K-factor band
+    bounds = []
+    for Knet in (1.35, 1.65):
+        branches[0].set_Knet(Knet)
+        model.element_changed(branches[0])
+        bounds.append(model.steady_solve().x[outlet])
+    branches[0].set_Knet(1.5)
+    model.element_changed(branches[0])
+    nominal = model.steady_solve().x[outlet]
+
+    mc = MonteCarlo(model, seed=1)
+    mc.add_tolerance(branches[0], "Knet", .1)
+    mc.add_tolerance(branches[1:], "do", .01, "normal")
+    mc.add_tolerance(model.circuit.elements[0], "epsilon", .2)
+    summary = mc.run(2000, chunk_size=250, processes=1)
+
+    assert summary.count == 2000 and summary.failed == 0
+    lo, med, hi = summary.percentile([0, 50, 100])[:, outlet]
+    assert min(bounds) - 1e-3 < lo < med < hi < max(bounds) + 1e-3
+    assert abs(med - nominal) < .02*nominal
+
+    ### Nominal parameters are left untouched
+    assert model.assembly.groups[Orifice].params["Knet"][0] == 1.5
+
+    ### No samples, and a nominal problem that does not converge
+    empty = mc.run(0, processes=1)
+    assert empty.count == 0 and empty.failed == 0
+    model, branches = build_manifold() # cold
+    mc = MonteCarlo(model)
+    mc.add_tolerance(branches, "do", .02)
+    with pytest.raises(Exception):
+        mc.run(10, processes=1, maxiter=1)
+
+
+### Pool runs reproduce in-process runs
+### -----------------------------------
+def test_process_pool():
+    model, branches = build_manifold()
+    mc = MonteCarlo(model, seed=2)
+    mc.add_tolerance(branches, "do", .02)
+    serial = mc.run(600, chunk_size=100, processes=1)
+    pooled = mc.run(600, chunk_size=100, processes=2)
+
+    assert pooled.count == serial.count
+    assert np.allclose(pooled.mean, serial.mean)
+    assert np.allclose(pooled.std, serial.std)
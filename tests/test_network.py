@@ -0,0 +1,235 @@
+'''
+Tests for network meshing and the compact adjacency arrays.
+
+'''
+
+import sys
+import os
+sys.path.append(os.path.abspath("../src"))
+
+import numpy as np
+from network import Network, Boundary, Connection
+from pipe import Pipe
+from orifice import Orifice
+from tee import Tee
+
+
+
+### Helper circuits
+### ---------------
+def build_chain(N):
+    elements = [Pipe("pipe"+str(i), 1, .01, 1e-5) for i in range(N)]
+    for i in range(N-1):
+        elements[i].tie_in(elements[i+1], 1, 0)
+    return elements
+
+def build_tree(depth):
+    root = Pipe("root", 1, .01, 1e-5)
+    leaves = [root]
+    for _ in range(depth):
+        new_leaves = []
+        for leaf in leaves:
+            tee = Tee("tee", "diverging")
+            leaf.tie_in(tee, 1, 0)
+            for port in (1, 2):
+                branch = Orifice("orifice", .002)
+                tee.tie_in(branch, port, 0)
+                new_leaves.append(branch)
+        leaves = new_leaves
+    return root
+
+
+
+### Small chain numbering
+### ---------------------
+def test_chain_numbering():
+    elements = build_chain(3)
+    circuit = Network(elements[0])
+
+    assert [el.id for el in circuit.elements] == [0, 1, 2]
+    assert len(circuit.nodes) == 4
+    assert elements[0].ports[1] == elements[1].ports[0]
+    assert elements[1].ports[1] == elements[2].ports[0]
+    assert circuit.is_boundary.sum() == 2
+    assert isinstance(circuit.nodes[elements[0].ports[0]], Boundary)
+    assert isinstance(circuit.nodes[elements[0].ports[1]], Connection)
+
+
+### CSR adjacency is consistent with element ports
+### -----------------------------------------------
+def test_adjacency_consistency():
+    circuit = Network(build_tree(4))
+
+    for i, element in enumerate(circuit.elements):
+        assert list(circuit.element_nodes(i)) == element.ports
+
+    for j in range(len(circuit.nodes)):
+        els = circuit.node_elements(j)
+        ports = circuit.node_ports[circuit.node_ptr[j]:circuit.node_ptr[j+1]]
+        assert len(els) == (1 if circuit.is_boundary[j] else 2)
+        for i, n in zip(els, ports):
+            assert circuit.elements[i].ports[n] == j
+
+
+### Remeshing resets stale ports
+### ----------------------------
+def test_remesh():
+    elements = build_chain(5)
+    Network(elements[2])
+    circuit = Network(elements[0])
+    assert elements[0].id == 0
+    assert list(circuit.el_nodes) == [0, 1, 1, 2, 2, 3, 3, 4, 4, 5]
+
+
+### Large chain and tree meshing matches a reference traversal
+### -----------------------------------------------------------
+def reference_csr(source):
+    ### Plain BFS numbering from element neighbors, then both CSR directions
+    ids, ports = {source: 0}, {source: [None]*len(source.neighbors)}
+    boundary = []
+    queue = [source]
+    for top in queue:
+        for n, neighbor in enumerate(top.neighbors):
+            if ports[top][n] is not None:
+                continue
+            ports[top][n] = len(boundary)
+            boundary.append(neighbor is None)
+            if neighbor is None:
+                continue
+            if neighbor not in ids:
+                ids[neighbor] = len(queue)
+                ports[neighbor] = [None]*len(neighbor.neighbors)
+                queue.append(neighbor)
+            ports[neighbor][top.neighbor_ports[n]] = ports[top][n]
+
+    el_ptr = np.cumsum([0] + [len(el.neighbors) for el in queue])
+    el_nodes = np.array([j for el in queue for j in ports[el]])
+    slots = sorted((j, i, n) for i, el in enumerate(queue) for n, j in enumerate(ports[el]))
+    node_ptr = np.cumsum([0] + list(np.bincount(el_nodes, minlength=len(boundary))))
+    return {"el_ptr": el_ptr, "el_nodes": el_nodes, "node_ptr": node_ptr, \
+            "node_els": np.array([i for _, i, _ in slots]), \
+            "node_ports": np.array([n for _, _, n in slots]), \
+            "is_boundary": np.array(boundary)}
+
+def test_mesh_scaling():
+    elements = build_chain(100000)
+    circuit = Network(elements[0])
+    assert len(circuit.nodes) == 100001
+    for name, reference in reference_csr(elements[0]).items():
+        assert np.array_equal(getattr(circuit, name), reference), name
+
+    root = build_tree(15) # ~100k elements
+    circuit = Network(root)
+    assert np.all(np.diff(circuit.node_ptr) >= 1)
+    for name, reference in reference_csr(root).items():
+        assert np.array_equal(getattr(circuit, name), reference), name
+
+
+### Swapping an element keeps all numbering
+### ----------------------------------------
+def test_replace():
+    elements = build_chain(5)
+    circuit = Network(elements[0])
+    ports = [list(el.ports) for el in circuit.elements]
+
+    new = Orifice("swap", .003)
+    circuit.replace(elements[2], new)
+    assert new.id == 2 and new.ports == ports[2]
+    assert elements[1].neighbors[1] is new and elements[3].neighbors[0] is new
+    assert elements[2].id is None and elements[2].neighbors == [None, None]
+
+
+### Remove then re-insert reuses nodes and IDs
+### ------------------------------------------
+def test_remove_insert():
+    elements = build_chain(5)
+    circuit = Network(elements[0])
+    before = list(circuit.el_nodes)
+
+    elements[2].remove()
+    assert circuit.elements[2] is None
+    assert isinstance(circuit.nodes[elements[1].ports[1]], Boundary)
+    assert isinstance(circuit.nodes[elements[3].ports[0]], Boundary)
+
+    new = Orifice("new", .003)
+    elements[1].tie_in(new, 1, 0)
+    new.tie_in(elements[3], 1, 0)
+    circuit.insert(new)
+    circuit.refresh()
+    assert new.id == 2
+    assert list(circuit.el_nodes) == before
+    assert circuit.is_boundary.sum() == 2
+
+
+### Removing an end element compacts numbering
+### ------------------------------------------
+def test_remove_compact():
+    elements = build_chain(5)
+    circuit = Network(elements[0])
+    circuit.remove(elements[0])
+    circuit.refresh()
+
+    assert len(circuit.elements) == 4 and len(circuit.nodes) == 5
+    assert sorted(set(circuit.el_nodes)) == list(range(5))
+    for i, element in enumerate(circuit.elements):
+        assert element.id == i
+        assert list(circuit.element_nodes(i)) == element.ports
+
+
+### Tie and untie open ports
+### ------------------------
+def test_tie_untie():
+    elements = build_chain(4)
+    circuit = Network(elements[0])
+    circuit.untie(elements[1], 1)
+    assert circuit.is_boundary.sum() == 2
+    circuit.refresh()
+    assert circuit.is_boundary.sum() == 4
+
+    circuit.tie(elements[1], 1, elements[2], 0)
+    circuit.refresh()
+    assert len(circuit.nodes) == 5
+    assert elements[1].ports[1] == elements[2].ports[0]
+
+
+### Model follows edits on its circuit
+### ----------------------------------
+def test_model_listener():
+    from model import Model
+
+    elements = build_chain(3)
+    circuit = Network(elements[0])
+    model = Model(circuit)
+    model.add_BC("pressure", elements[0].ports[0], 1e6)
+    model.add_BC("pressure", elements[2].ports[1], 5e5)
+
+    circuit.remove(elements[2])
+    model.refresh()
+    assert model.N_nodes == 3
+    assert model.P_bc[elements[0].ports[0]] == 1e6
+    assert all(p is None for p in model.P_bc[1:])
+
+
+
+### Model keeps node data over several compactions
+### ----------------------------------------------
+def test_model_repeated_compaction():
+    from model import Model
+
+    elements = build_chain(5)
+    circuit = Network(elements[0])
+    model = Model(circuit, "JetA")
+    model.add_BC("pressure", elements[0].ports[0], 1e6)
+    model.add_BC("pressure", elements[4].ports[1], 5e5)
+    model.steady_solve()
+    P = {el: model.P_steady[el.ports] for el in elements[1:4]}
+
+    ### both removals compact the numbering before the model refreshes
+    elements[0].remove()
+    circuit.refresh()
+    elements[4].remove()
+    circuit.refresh()
+    model.refresh()
+    assert model.N_nodes == len(circuit.nodes) == 4
+    for el, P_el in P.items():
+        assert np.array_equal(model.P_steady[el.ports], P_el)
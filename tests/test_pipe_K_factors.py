@@ -14,6 +14,8 @@ sys.path.append(os.path.abspath("../src"))
 
 import numpy as np
 import matplotlib.pyplot as plt
+from math import sqrt, log10
+import pipe
 
 
 
@@ -102,4 +104,37 @@ def test_K_bend():
     plt.ylim([0, .8])
     plt.grid(True)
     plt.legend(fontsize=8)
-    plt.show()
\ No newline at end of file
+    plt.show()
+    
+    
+### Array friction kernels match the scalar formulas
+### -------------------------------------------------
+def test_friction_arrays():
+    def f_colebrook_scalar(Dh, epsilon, Re):
+        ### pointwise Colebrook-White fixed point, iterated to convergence
+        if Re < 2100: return 64/Re
+        f, f_old = .05, 0
+        while abs(f - f_old) > 1e-15*f:
+            f, f_old = (2*log10(epsilon/(3.7*Dh) + 2.51/(Re*sqrt(f))))**-2, f
+        return f
+    
+    def f_churchill_scalar(Dh, epsilon, Re):
+        if Re < 2100: return 64/Re
+        return (2*log10(epsilon/(3.7*Dh) + (7/Re)**.9))**-2
+    
+    # Re x relative roughness grid, refined across the laminar/turbulent switch
+    Re = np.sort(np.concatenate([np.logspace(2, 9, 141), [2100*(1 - 1e-9), 2100, 2100*(1 + 1e-9)]]))
+    roughness = np.array([0, 1e-7, 1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 5e-2])
+    Dh = .02
+    epsilon = roughness[:, None]*Dh
+    for f_array, f_scalar in ((pipe.f_colebrook_white, f_colebrook_scalar), \
+                              (pipe.f_churchill, f_churchill_scalar)):
+        f = f_array(Dh, epsilon, Re)
+        assert f.shape == (len(roughness), len(Re))
+        f_ref = np.array([[f_scalar(Dh, e, R) for R in Re] for e in epsilon[:, 0]])
+        assert np.allclose(f, f_ref, rtol=1e-12, atol=0)
+        assert np.all(f[:, Re < 2100] == 64/Re[Re < 2100])
+    
+    # scalars in, scalar out
+    assert np.ndim(pipe.f_colebrook_white(.01, 1e-5, 1e5)) == 0
+    assert np.ndim(pipe.f_churchill(.01, 1e-5, 1e3)) == 0
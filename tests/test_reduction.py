@@ -0,0 +1,119 @@
+'''
+Tests for series/parallel network reduction.
+
+'''
+
+import sys
+import os
+sys.path.append(os.path.abspath("../src"))
+
+import numpy as np
+from network import Network
+from pipe import Pipe
+from orifice import Orifice
+from tee import Tee
+from model import Model
+from reduction import Chain
+from test_model import build_feed, build_manifold
+
+
+
+### Helper circuits
+### ---------------
+def build_ladder(N_branches, P_in=2e6, P_out=1e6):
+    ### identical pipe -> orifice branches between diverging and
+    ### converging tee ladders
+    feed = Pipe("feed", 2, .02, 1e-5)
+    outlet = Pipe("outlet", 1, .02, 1e-5)
+    split, split_port = feed, 1
+    merge, merge_port = outlet, 0
+    for i in range(N_branches):
+        pipe = Pipe("b"+str(i), .3, .006, 1e-5)
+        o = Orifice("o"+str(i), .002)
+        o.set_Knet(1.5)
+        pipe.tie_in(o, 1, 0)
+        if i < N_branches - 1:
+            div, conv = Tee("div"+str(i), "diverging"), Tee("conv"+str(i), "converging")
+            split.tie_in(div, split_port, 0)
+            div.tie_in(pipe, 1, 0)
+            conv.tie_in(merge, 0, merge_port)
+            o.tie_in(conv, 1, 1)
+            split, split_port, merge, merge_port = div, 2, conv, 2
+        else:
+            split.tie_in(pipe, split_port, 0)
+            o.tie_in(merge, 1, merge_port)
+
+    model = Model(Network(feed), "JetA")
+    model.add_BC("pressure", feed.ports[0], P_in)
+    model.add_BC("pressure", outlet.ports[1], P_out)
+    return model
+
+
+
+### Series chain collapses to one two-port
+### --------------------------------------
+def test_series_reduction():
+    model = build_feed()
+    sol = model.reduced_solve()
+    assert sol.success
+    assert model.reduction.reduced.N_sv == 4 and model.N_sv == 10
+
+    reduced = sol.x.copy()
+    full = model.steady_solve(warm_start=False).x
+    assert np.allclose(reduced, full, rtol=1e-8)
+
+    # recovered state satisfies the full system
+    F = model.build_steady_system(reduced)
+    assert np.max(np.abs(F)) < 1e-3
+
+
+### Identical parallel branches fold away with their tees
+### -----------------------------------------------------
+def test_parallel_reduction():
+    model = build_ladder(5)
+    sol = model.reduced_solve()
+    assert sol.success
+    assert model.reduction.reduced.N_sv == 4
+    assert len(model.reduction.chains) == 1
+
+    reduced = sol.x.copy()
+    full = model.steady_solve(warm_start=False).x
+    assert np.allclose(reduced, full, rtol=1e-6)
+
+    # every branch carries a fifth of the feed flow
+    feed = model.circuit.elements[0]
+    branches = [el for el in model.circuit.elements if isinstance(el, Orifice)]
+    flows = [model.mdot_steady[o.ports[0]] for o in branches]
+    assert np.allclose(flows, model.mdot_steady[feed.ports[1]]/5)
+
+
+### Non-identical branches keep their tees
+### --------------------------------------
+def test_partial_reduction():
+    model, branches = build_manifold()
+    sol = model.reduced_solve()
+    assert sol.success
+    assert type(model.reduction.reduced.circuit.elements[0]) is not Chain
+    assert np.allclose(sol.x, model.steady_solve(warm_start=False).x, rtol=1e-6)
+
+    # reduction is rebuilt after an edit
+    branches[0].set_Knet(3.0)
+    model.element_changed(branches[0])
+    assert model.reduction is None
+    sol = model.reduced_solve()
+    assert np.allclose(sol.x, model.steady_solve(warm_start=False).x, rtol=1e-6)
+
+
+### Chain kernels match their members
+### ---------------------------------
+def test_chain_kernels():
+    model = build_ladder(3)
+    model.reduced_solve()
+    chain = model.reduction.chains[0]
+    p = Chain.pack([chain])
+    mdot = np.array([[.05], [.4], [-.2]])
+    dP = Chain.loss(p, mdot, None, None)
+    h = 1e-7
+    dP_fd = (Chain.loss(p, mdot + h, None, None) - dP)/h
+    assert np.allclose(Chain.loss_jacobian(p, mdot, None, None), dP_fd, rtol=1e-4)
+    assert chain.I() > 0
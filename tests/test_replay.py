@@ -0,0 +1,72 @@
+'''
+Tests for quasi-steady replay of boundary-condition records.
+
+'''
+
+import sys
+import os
+sys.path.append(os.path.abspath("../src"))
+
+import numpy as np
+import pytest
+from replay import csv_samples
+from history import History
+from test_model import build_feed
+
+
+
+### Helper record
+### -------------
+def write_record(path, N=200):
+    t = np.arange(N)*1e-3
+    P = 2e6 + 2e5*np.sin(20*t)
+    K = 2. + 10*t
+    P[50:60], K[50:60] = P[50], K[50] # held channels
+    with open(path, "w") as f:
+        f.write("t, P_tank, K_valve, unused\n")
+        for row in zip(t, P, K, np.zeros(N)):
+            f.write(",".join(repr(float(v)) for v in row) + "\n")
+    return t, P, K
+
+
+### Every sample matches a steady solve at its boundary values
+### ----------------------------------------------------------
+def test_replay(tmp_path):
+    t, P, K = write_record(str(tmp_path/"record.csv"))
+    model = build_feed()
+    model.steady_solve()
+    inlet = model.circuit.elements[0].ports[0]
+    valve = model.circuit.elements[1]
+    channels = [("pressure", inlet), (valve, "Knet")]
+    samples = csv_samples(str(tmp_path/"record.csv"), ["P_tank", "K_valve"])
+    results = list(model.replay(samples, channels))
+    assert len(results) == len(t)
+    stats = model.replayer.stats
+    assert stats["failed"] == 0 and stats["solves"] == len(t) - 9
+    assert stats["factors"] < len(t)/10
+    assert valve.Knet == 2.0 # model parameters untouched
+
+    for k in (0, 55, 150, 199):
+        model.add_BC("pressure", inlet, P[k])
+        valve.set_Knet(K[k])
+        model.element_changed(valve)
+        x = model.steady_solve().x
+        assert results[k][0] == t[k]
+        assert np.allclose(results[k][1], x, rtol=1e-7)
+
+
+### Replay streamed to disk
+### -----------------------
+def test_replay_to_disk(tmp_path):
+    t_rec, P_rec, _ = write_record(str(tmp_path/"record.csv"))
+    model = build_feed()
+    inlet = model.circuit.elements[0].ports[0]
+    samples = csv_samples(str(tmp_path/"record.csv"), ["P_tank"])
+    history = model.replay(samples, [("pressure", inlet)], path=str(tmp_path/"out"), \
+                           nodes=[inlet], every=2, chunk=16)
+    assert isinstance(history, History) and len(history) == 100
+    t, P = history.pressure(inlet)
+    assert np.allclose(t, t_rec[::2]) and np.allclose(P, P_rec[::2])
+
+    with pytest.raises(Exception):
+        next(csv_samples(str(tmp_path/"record.csv"), ["P_chamber"]))
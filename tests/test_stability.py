@@ -0,0 +1,85 @@
+'''
+Tests for POGO stability maps.
+
+'''
+
+import sys
+import os
+sys.path.append(os.path.abspath("../src"))
+
+import numpy as np
+import pytest
+from stability import StabilityMap
+from test_model import build_line
+
+
+
+### Helper map
+### ----------
+def build_map(model, run):
+    smap = StabilityMap(model)
+    smap.add_axis("pressure", run[0].ports[0], np.linspace(1.5e6, 3e6, 4))
+    smap.add_axis(run[-1], "Knet", [1.5, 2., 3.])
+    return smap
+
+
+### Cells match eigenanalysis of the model at that point
+### ----------------------------------------------------
+def test_stability_map(tmp_path):
+    model, run = build_line(4)
+    smap = build_map(model, run).run(str(tmp_path/"map.npy"), k=3, f_target=50., \
+                                     processes=1)
+    assert smap.results.shape == (4, 3, 7)
+    assert np.all(smap.results[..., 0] == 1)
+    assert np.all(smap.margin > 0) # passive circuit
+
+    ### Model is left at its own operating point
+    assert model.assembly.groups[type(run[-1])].params["Knet"][0] == 2.
+    assert model.assembly.bc_values[0] == 2e6
+
+    run[-1].set_Knet(3.)
+    model.element_changed(run[-1])
+    model.add_BC("pressure", run[0].ports[0], 2.5e6)
+    model.steady_solve()
+    f_n, zeta = model.eigen_solve(k=3, f_target=50.)
+    assert np.allclose(smap.f_n[2, 2, :len(f_n)], f_n)
+    assert np.allclose(smap.zeta[2, 2, :len(f_n)], zeta)
+    assert np.isclose(smap.margin[2, 2], zeta.min())
+    assert np.isclose(smap.critical_frequency[2, 2], f_n[np.argmin(zeta)])
+
+
+### Interrupted maps resume on a process pool
+### -----------------------------------------
+def test_resume(tmp_path, monkeypatch):
+    model, run = build_line(4)
+    path = str(tmp_path/"map.npy")
+    full = build_map(model, run).run(path, k=3, f_target=50., processes=1).results.copy()
+
+    ### Drop the last cells as if the run had stopped
+    partial = np.load(path, mmap_mode="r+")
+    partial[2:, 1:] = np.nan
+    partial.flush()
+    del partial
+    smap = build_map(model, run).run(path, k=3, f_target=50., processes=2)
+    assert np.allclose(smap.results, full, equal_nan=True)
+
+    ### Every cell is solved once, and finished cells are not solved again
+    import stability
+    solved = []
+    solve_cell = stability.solve_cell
+    def counted(i, j, x0):
+        solved.append((i, j))
+        return solve_cell(i, j, x0)
+    monkeypatch.setattr(stability, "solve_cell", counted)
+    build_map(model, run).run(str(tmp_path/"fresh.npy"), k=3, f_target=50., processes=1)
+    assert sorted(solved) == [(i, j) for i in range(4) for j in range(3)]
+    solved.clear()
+    partial = np.load(path, mmap_mode="r+")
+    partial[1:, 2] = np.nan
+    partial.flush()
+    del partial
+    build_map(model, run).run(path, k=3, f_target=50., processes=1)
+    assert sorted(solved) == [(1, 2), (2, 2), (3, 2)]
+
+    with pytest.raises(Exception):
+        build_map(model, run).run(path, k=4, f_target=50., processes=1)
@@ -0,0 +1,137 @@
+'''
+Tests for coupled thermal-hydraulic steady solves.
+
+'''
+
+import sys
+import os
+sys.path.append(os.path.abspath("../src"))
+
+import numpy as np
+import pytest
+from orifice import Orifice
+from tee import Tee
+from test_model import build_feed
+from test_reduction import build_ladder
+from fluid import Fluid, FluidData
+
+
+
+### Analytic Jacobian against finite differences of the residuals
+### -------------------------------------------------------------
+def fd_jacobian(thermal, x, sign=1):
+    ### sign = -1 steps backwards, e.g. from the top of a property table
+    J = thermal.jacobian(x).toarray()
+    F = thermal.residuals(x)
+    J_fd = np.empty_like(J)
+    for v in range(len(x)):
+        h = sign*1e-6*max(abs(x[v]), 1)
+        xh = x.copy()
+        xh[v] += h
+        J_fd[:, v] = (thermal.residuals(xh) - F)/h
+    thermal.residuals(x)
+    return J, J_fd
+
+def check_jacobian(thermal, x, sign=1):
+    J, J_fd = fd_jacobian(thermal, x, sign)
+    assert np.allclose(J, J_fd, rtol=1e-4, atol=1e-5*np.max(np.abs(J)))
+    return J
+
+
+### Heated line: energy balance and analytic Jacobian
+### -------------------------------------------------
+def test_heated_feed():
+    model = build_feed()
+    p1 = model.circuit.elements[0]
+    model.add_BC("temperature", p1.ports[0], 300.)
+    mdot_iso = model.steady_solve().x[model.N_nodes]
+    
+    sol = model.thermal_solve(heat={p1: 2e4})
+    assert sol.success
+    T_in, T_out = model.T_steady[p1.ports[0]], model.T_steady[p1.ports[1]]
+    mdot = model.mdot_steady[p1.ports[0]]
+    cp = model.fluid.cp((T_in + T_out)/2)
+    assert np.isclose(mdot*cp*(T_out - T_in), 2e4, rtol=1e-8)
+    assert np.allclose(model.T_steady[p1.ports[1]:], T_out) # unheated downstream
+    assert not np.isclose(mdot, mdot_iso, rtol=1e-4) # properties follow temperature
+    assert np.isclose(model.assembly.groups[type(p1)].rho[0], model.fluid.rho((T_in + T_out)/2))
+    
+    check_jacobian(model.thermal, sol.x)
+    
+    # isothermal solves and edits go back to the reference properties
+    rho = model.fluid.rho()
+    sol_iso = model.steady_solve()
+    assert np.isclose(sol_iso.x[model.N_nodes], mdot_iso, rtol=1e-8)
+    assert np.all(model.assembly.groups[type(p1)].rho == rho)
+    model.thermal_solve(heat={p1: 2e4})
+    model.element_changed(p1)
+    model.compile()
+    assert all(np.all(g.rho == rho) for g in model.assembly.groups.values())
+    
+    # a temperature is only given where fluid enters
+    model.add_BC("temperature", model.circuit.elements[-1].ports[-1], 300.)
+    with pytest.raises(Exception):
+        model.thermal_solve()
+
+
+### Splitting and mixing through tees
+### ---------------------------------
+def test_manifold_mixing():
+    model = build_ladder(3)
+    feed = model.circuit.elements[0]
+    branches = [el for el in model.circuit.elements if isinstance(el, Orifice)]
+    model.add_BC("temperature", feed.ports[0], 290.)
+    sol = model.thermal_solve(heat={branches[0]: 500., branches[2]: 1500.})
+    assert sol.success
+    T, mdot = model.T_steady, model.mdot_steady
+    
+    for tee in (el for el in model.circuit.elements if isinstance(el, Tee)):
+        if tee.config == "diverging":
+            assert np.allclose(T[tee.ports], T[tee.ports[0]])
+        else:
+            m, t = mdot[tee.ports], T[tee.ports]
+            assert np.isclose(m[1]*t[1] + m[2]*t[2], m[0]*t[0], rtol=1e-10)
+    outlet = next(el for el in model.circuit.elements if el.name == "outlet")
+    T_branches = np.array([T[o.ports[1]] for o in branches])
+    m_branches = np.array([mdot[o.ports[1]] for o in branches])
+    assert T_branches[1] == pytest.approx(290.)
+    assert T[outlet.ports[1]] == pytest.approx(np.sum(m_branches*T_branches)/np.sum(m_branches))
+    
+    # every inlet needs a temperature
+    model = build_ladder(2)
+    with pytest.raises(Exception):
+        model.thermal_solve()
+
+
+### Pressure-dependent properties from a (T, P) table
+### -------------------------------------------------
+def test_TP_properties():
+    T, P = np.arange(250., 401., 10.), np.array([1e5, 1e6, 2e6, 3e6, 5e6])
+    TT, PP = [v.ravel() for v in np.meshgrid(T, P, indexing="ij")]
+    synthetic = Fluid()
+    synthetic.data = FluidData("synthetic", grid={"T": TT, "P": PP, \
+        "rho": 1000 - .8*TT + 2e-5*PP, "cp": 1500 + 2*TT + 1e-4*PP, \
+        "mu": 1e-3*np.exp(-(TT - 300)/80)*(1 + 2e-7*PP)})
+    
+    model = build_feed()
+    model.fluid = synthetic
+    p1 = model.circuit.elements[0]
+    model.add_BC("temperature", p1.ports[0], 400.) # top of the table
+    sol = model.thermal_solve()
+    assert sol.success and np.allclose(model.T_steady, 400.)
+    
+    # difference steps stay inside the table
+    check_jacobian(model.thermal, sol.x, sign=-1)
+    
+    # pressure partials through the properties, on both kinds of rows
+    model.add_BC("temperature", p1.ports[0], 350.)
+    sol = model.thermal_solve(heat={p1: 2e4})
+    assert sol.success
+    thermal, N = model.thermal, model.N_nodes
+    J, J_fd = fd_jacobian(thermal, sol.x)
+    assert np.allclose(J[:, :N], J_fd[:, :N], rtol=1e-5, atol=1e-9)
+    assert np.any(J[thermal.N_hydraulic:thermal.N_energy, :N] != 0)
+    
+    thermal.pressure_dependent = False # temperature step alone
+    J = thermal.jacobian(sol.x).toarray()
+    assert not np.allclose(J[:, :N], J_fd[:, :N], rtol=1e-5, atol=1e-9)
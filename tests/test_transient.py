@@ -0,0 +1,139 @@
+'''
+Tests for method of characteristics transients.
+
+'''
+
+import sys
+import os
+sys.path.append(os.path.abspath("../src"))
+
+import numpy as np
+import pytest
+from scipy.constants import pi
+from network import Network
+from pipe import Pipe
+from model import Model
+from transient import MOC, BDF
+from history import History
+from test_model import build_feed, build_manifold, build_line
+
+
+
+### Steady state is held without events
+### -----------------------------------
+def test_steady_invariance():
+    model = build_feed()
+    for el in model.circuit.elements:
+        if isinstance(el, Pipe):
+            el.a = 1200.
+    model.compile()
+    model.steady_solve()
+    t, X = model.transient_solve(.01, reaches=8)
+    assert np.allclose(X, X[0], rtol=1e-8, atol=1e-6)
+
+    model, _ = build_manifold()
+    model.circuit.elements[0].a = 1000.
+    model.compile()
+    model.steady_solve()
+    t, X = model.transient_solve(.01)
+    assert np.allclose(X, X[0], rtol=1e-8, atol=1e-6)
+
+
+### Instant valve closure raises the Joukowsky surge
+### ------------------------------------------------
+def test_joukowsky():
+    l, D, a, mdot = 100., .05, 1200., 2.
+    p = Pipe("p", l, D, 1e-7, a=a)
+    model = Model(Network(p), "JetA")
+    model.add_BC("pressure", p.ports[0], 2e6)
+    model.add_BC("flowrate", p.ports[1], mdot)
+    t, X = model.transient_solve(4*l/a, events=[("flowrate", p.ports[1], lambda t: 0.)], \
+                                 reaches=50)
+    P_valve = X[:, p.ports[1]]
+    surge = a*mdot/(pi*D**2/4)
+    assert abs(P_valve[1] - P_valve[0] - surge) < .01*surge
+
+    # the reflected expansion wave reaches the valve after 2l/a
+    early, late = t < .9*2*l/a, (t > 1.1*2*l/a) & (t < .9*4*l/a)
+    assert np.all(P_valve[early][1:] > X[0, p.ports[1]] + .9*surge)
+    assert np.all(P_valve[late] < X[0, p.ports[1]] - .9*surge)
+
+
+### Parameter events act on the engine's own copy
+### ---------------------------------------------
+def test_valve_ramp():
+    model, run = build_line(4)
+    model.steady_solve()
+    o = run[-1]
+    mdot_0 = model.mdot_steady[o.ports[0]]
+    closure = lambda t: 2. + 1e4*min(t, .02)
+    t, X = model.transient_solve(.1, events=[(o, "Knet", closure)], every=5)
+    assert X.shape == (len(t), model.N_sv)
+    assert abs(X[-1, model.N_nodes + o.ports[0]]) < .2*mdot_0
+    assert np.max(X[:, o.ports[0]]) > X[0, o.ports[0]]
+    assert model.assembly.groups[type(o)].params["Knet"][0] == 2.
+
+    # a pipe without a wave speed cannot be discretized
+    model, _ = build_manifold()
+    with pytest.raises(Exception):
+        MOC(model)
+
+
+### Stiff lumped circuit settles at the new steady state
+### ----------------------------------------------------
+def test_bdf_step_response():
+    model, run = build_line(20)
+    run[-1].lo = 1e-9 # fastest mode ~1e8 times the slowest
+    model.element_changed(run[-1])
+    model.steady_solve()
+    inlet = run[0].ports[0]
+    step = ("pressure", inlet, lambda t: 2.1e6)
+    t, X = model.transient_solve(.5, events=[step], method="bdf")
+    stats = model.transient.stats
+    assert t[-1] == .5 and np.all(np.diff(t) > 0)
+    assert stats["steps"] < 5000 and stats["jacobians"] < stats["steps"]/10
+
+    model.add_BC("pressure", inlet, 2.1e6)
+    x = model.steady_solve().x
+    assert np.allclose(X[-1], x, rtol=1e-3)
+
+
+### Tolerance controls the trajectory error
+### ---------------------------------------
+def test_bdf_accuracy():
+    def final_state(rtol):
+        model, run = build_line(10)
+        engine = BDF(model, rtol=rtol)
+        engine.add_event("pressure", run[0].ports[0], lambda t: 2e6 + 1e5*np.sin(200*t))
+        return engine.run(.05)[1][-1], model.N_nodes
+    x_ref, N = final_state(1e-10)
+    errors = [np.max(np.abs(final_state(rtol)[0] - x_ref)[:N]) for rtol in (1e-4, 1e-7)]
+    assert errors[1] < errors[0]/10 and errors[1] < 100.
+
+
+### Streamed history matches the in-memory one
+### ------------------------------------------
+def test_streamed_history(tmp_path):
+    model, run = build_line(4)
+    o = run[-1]
+    events = [(o, "Knet", lambda t: 2. + 1e4*min(t, .02))]
+    t, X = model.transient_solve(.05, events=events)
+    N = model.N_nodes
+
+    nodes = [run[0].ports[1], o.ports[0]]
+    history = model.transient_solve(.05, events=events, every=3, nodes=nodes, \
+                                     path=str(tmp_path/"run"), chunk=16)
+    assert isinstance(history, History) and len(history) > 16
+    assert history.t[0] == 0 and np.isclose(history.t[-1], t[-1])
+    rows = np.searchsorted(t, np.array(history.t[:-1]))
+    assert np.allclose(history.P[:-1], X[rows][:, nodes])
+    assert np.allclose(history.mdot[:-1], X[rows][:, N + np.array(nodes)])
+
+    # lazy reads by node and time window, and reopening from disk
+    t_w, P_w = History(str(tmp_path/"run")).pressure(o.ports[0], .01, .02)
+    assert np.all((t_w >= .01) & (t_w <= .02)) and len(t_w) == len(P_w) > 0
+    assert np.allclose(P_w, X[np.searchsorted(t, t_w), o.ports[0]])
+
+    # time decimation
+    t, X = model.transient_solve(.05, events=events, interval=.01, nodes=nodes)
+    assert X.shape == (len(t), 4) and np.all(np.diff(t)[:-1] >= .01 - 1e-12)